@@ -0,0 +1,161 @@
+"""
+Benchmark de la compresión de lotes del Middleware.
+
+Arma lotes de reviews con el mismo formato que publica el gateway a partir
+de un dataset del cliente y mide, por codec, la relación de compresión y
+el costo de CPU de comprimir/descomprimir. Con --host además mide el
+throughput de publicar y consumir esos lotes contra un RabbitMQ real, con
+y sin compresión.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.compression_benchmark --file data/sample_30_reviews.csv
+    python -m benchmarks.compression_benchmark --file data/sample_30_reviews.csv --host localhost
+"""
+
+import argparse
+import json
+import time
+import uuid
+import pika
+from common import compression
+from common.constants import MAX_BATCH_SIZE
+from common.review import Review
+
+BENCHMARK_QUEUE = "compression_benchmark"
+
+
+def build_batches(file_path: str, batch_size: int, max_batches: int) -> list[bytes]:
+    """
+    Lee el CSV de reviews y devuelve los lotes tal como los publica el gateway.
+    """
+    batches = []
+    review_id = 0
+    with open(file_path, "r", encoding="utf-8") as file:
+        next(file, None)
+        rows = []
+        for line in file:
+            rows.append(line)
+            if len(rows) == batch_size:
+                batch, review_id = encode_batch(rows, review_id)
+                batches.append(batch)
+                rows = []
+                if len(batches) == max_batches:
+                    return batches
+        if rows:
+            batch, review_id = encode_batch(rows, review_id)
+            batches.append(batch)
+    return batches
+
+
+def encode_batch(rows: list[str], review_id: int) -> tuple[bytes, int]:
+    batch = f"{uuid.uuid4()}\n"
+    for row in rows:
+        review = Review.from_csv_row(review_id, row, 1)
+        if review.checkNanElements():
+            continue
+        batch += f"{json.dumps(review.getData())}\n"
+        review_id += 1
+    return batch.encode("utf-8"), review_id
+
+
+def bench_codec(batches: list[bytes], codec: str) -> dict:
+    raw_size = sum(len(b) for b in batches)
+
+    start = time.process_time()
+    compressed = [compression.compress(b, codec) for b in batches]
+    compress_cpu = time.process_time() - start
+
+    start = time.process_time()
+    for body in compressed:
+        compression.decompress(body, codec)
+    decompress_cpu = time.process_time() - start
+
+    compressed_size = sum(len(b) for b in compressed)
+    return {
+        "codec": codec,
+        "raw_mb": raw_size / 1e6,
+        "compressed_mb": compressed_size / 1e6,
+        "ratio": raw_size / compressed_size,
+        "compress_us_per_batch": compress_cpu / len(batches) * 1e6,
+        "decompress_us_per_batch": decompress_cpu / len(batches) * 1e6,
+        "compress_mb_per_cpu_s": raw_size / 1e6 / compress_cpu if compress_cpu else float("inf"),
+    }
+
+
+def bench_broker(host: str, batches: list[bytes], codec: str = None) -> dict:
+    """
+    Publica todos los lotes en una cola y los consume, midiendo tiempo total
+    y CPU del proceso (compresión incluida).
+    """
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+    channel = connection.channel()
+    channel.queue_declare(queue=BENCHMARK_QUEUE, durable=True)
+    channel.queue_purge(queue=BENCHMARK_QUEUE)
+    properties = pika.BasicProperties(content_encoding=codec) if codec else None
+
+    start, start_cpu = time.monotonic(), time.process_time()
+    wire_bytes = 0
+    for body in batches:
+        if codec:
+            body = compression.compress(body, codec)
+        wire_bytes += len(body)
+        channel.basic_publish(exchange="", routing_key=BENCHMARK_QUEUE, body=body, properties=properties)
+    publish_elapsed = time.monotonic() - start
+
+    received = 0
+    for method, props, body in channel.consume(BENCHMARK_QUEUE, inactivity_timeout=5):
+        if method is None:
+            break
+        if compression.is_compressed(props):
+            body = compression.decompress(body, props.content_encoding)
+        body.decode("utf-8")
+        channel.basic_ack(method.delivery_tag)
+        received += 1
+        if received == len(batches):
+            break
+    channel.cancel()
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - start_cpu
+
+    channel.queue_delete(queue=BENCHMARK_QUEUE)
+    connection.close()
+    return {
+        "codec": codec or "none",
+        "batches": received,
+        "wire_mb": wire_bytes / 1e6,
+        "publish_batches_per_s": len(batches) / publish_elapsed,
+        "roundtrip_batches_per_s": received / elapsed,
+        "cpu_s": cpu,
+    }
+
+
+def print_table(rows: list[dict]):
+    for row in rows:
+        print("  ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in row.items()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de compresión de lotes del Middleware")
+    parser.add_argument("--file", default="data/sample_30_reviews.csv", help="CSV de reviews del cliente")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=2000)
+    parser.add_argument("--host", default=None, help="Host de RabbitMQ para medir throughput")
+    args = parser.parse_args()
+
+    batches = build_batches(args.file, args.batch_size, args.max_batches)
+    print(f"{len(batches)} lotes de hasta {args.batch_size} reviews")
+
+    print("\nCPU y relación de compresión")
+    print_table([bench_codec(batches, codec) for codec in compression.available_codecs()])
+
+    if args.host:
+        print(f"\nThroughput contra {args.host}")
+        codecs = [None] + compression.available_codecs()
+        print_table([bench_broker(args.host, batches, codec) for codec in codecs])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Grabación y replay del flujo de entrada de un nodo, para medir una sola
+etapa sin levantar todo el sistema.
+
+`record` ata colas propias (exclusivas) a los mismos exchanges y routing
+keys que las colas de entrada del nodo, así copia lo que les llega sin
+sacárselo, y guarda cada mensaje tal cual (headers, codec, compresión y
+cuerpo, FIN incluidos) en el orden en que llegó.
+
+`replay` construye la clase del nodo con el entorno de su servicio en el
+compose, sobre el broker en memoria, le entrega lo grabado a máxima
+velocidad y reporta filas/s, latencia del callback (p50/p90/p99) y bytes
+escritos en persistencia. La persistencia va a un directorio temporal.
+
+Uso (desde la raíz del repo, con el sistema corriendo para grabar):
+    python -m benchmarks.replay_benchmark record --host localhost --output action.rec \\
+        --bind negative_review_queue_1=negative_reviews --bind action_games_queue_1=action_games --fins 4
+    python -m benchmarks.replay_benchmark replay --input action.rec \\
+        --node game_review_filter --service action_game_review_filter
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+# Largo de los metadatos y del cuerpo de cada mensaje grabado
+FRAME_LENGTH = struct.Struct(">I")
+# Cuánto tiene que quedar quieto el broker para dar por terminado el replay (segundos)
+SETTLE_SECONDS = 0.2
+
+
+def write_message(file, queue: str, routing_key: str, properties, body: bytes):
+    meta = {
+        "queue": queue,
+        "routing_key": routing_key,
+        "headers": {k: _text(v) for k, v in (properties.headers or {}).items()},
+        "content_type": properties.content_type,
+        "content_encoding": properties.content_encoding,
+    }
+    encoded = json.dumps(meta).encode("utf-8")
+    file.write(FRAME_LENGTH.pack(len(encoded)) + encoded + FRAME_LENGTH.pack(len(body)) + body)
+
+
+def read_messages(path: str) -> list:
+    """
+    Devuelve los mensajes grabados como (metadatos, cuerpo), en orden.
+    """
+    messages = []
+    with open(path, "rb") as file:
+        while True:
+            length = file.read(FRAME_LENGTH.size)
+            if not length:
+                return messages
+            meta = json.loads(file.read(FRAME_LENGTH.unpack(length)[0]))
+            body = file.read(FRAME_LENGTH.unpack(file.read(FRAME_LENGTH.size))[0])
+            messages.append((meta, body))
+
+
+def _text(value):
+    # pika entrega los strings de los headers como bytes
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def record(args):
+    import pika
+    from common.envelope import Envelope
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.host))
+    channel = connection.channel()
+    recorded = {"messages": 0, "fins": 0}
+    output = open(args.output, "wb")
+
+    def on_message(queue, method, properties, body):
+        write_message(output, queue, method.routing_key, properties, body)
+        recorded["messages"] += 1
+        envelope = Envelope.from_properties(properties)
+        if envelope is not None and envelope.is_fin:
+            recorded["fins"] += 1
+        if args.fins and recorded["fins"] >= args.fins:
+            channel.stop_consuming()
+
+    for bind in args.bind:
+        queue, _, target = bind.partition("=")
+        exchange, _, routing_key = target.partition(":")
+        tap = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+        # Sin routing key se usa el nombre de la cola, como al atar la del nodo
+        channel.queue_bind(queue=tap, exchange=exchange, routing_key=routing_key or queue)
+        channel.basic_consume(
+            queue=tap, auto_ack=True,
+            on_message_callback=lambda _ch, method, properties, body, queue=queue: on_message(queue, method, properties, body),
+        )
+        print(f"Grabando {exchange}/{routing_key or queue} como {queue}")
+
+    def stop_if_idle(last=[0]):
+        if recorded["messages"] and recorded["messages"] == last[0]:
+            channel.stop_consuming()
+            return
+        last[0] = recorded["messages"]
+        connection.call_later(args.idle, stop_if_idle)
+
+    connection.call_later(args.idle, stop_if_idle)
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        pass
+    output.close()
+    connection.close()
+    print(f"{recorded['messages']} mensajes ({recorded['fins']} FIN) en {args.output}")
+
+
+def service_environment(compose_file: str, service: str) -> dict:
+    import yaml
+
+    with open(compose_file) as file:
+        services = yaml.safe_load(file)["services"]
+    return dict(item.split("=", 1) for item in services[service].get("environment", []))
+
+
+def replay(args):
+    env = service_environment(args.compose, args.service) if args.service else {}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    # La configuración del Middleware se lee al importarlo: va antes de los imports
+    os.environ.update(env)
+    os.environ["MIDDLEWARE_ENGINE"] = "memory"
+    os.environ["METRICS_ENABLED"] = "true"
+    import pika
+    from common import metrics
+    from common.memory_engine import MemoryBroker
+    from common.stages import load_stage
+
+    messages = read_messages(args.input)
+    queues = sorted({meta["queue"] for meta, _ in messages})
+    # La persistencia del nodo ("../persistence/") queda en un directorio temporal
+    workdir = os.path.join(tempfile.mkdtemp(prefix="replay_"), "work")
+    os.makedirs(workdir)
+    os.chdir(workdir)
+
+    node = load_stage(args.service or args.node, args.node, env)
+    broker = MemoryBroker.instance()
+    threading.Thread(target=node.start, daemon=True).start()
+    _wait_for_consumers(broker, queues)
+
+    start = time.perf_counter()
+    for meta, body in messages:
+        properties = pika.BasicProperties(
+            headers=meta["headers"] or None,
+            content_type=meta["content_type"],
+            content_encoding=meta["content_encoding"],
+        )
+        broker.publish("", meta["queue"], body, properties)
+    elapsed = _wait_until_settled(broker) - start
+
+    snapshot = metrics.registry.snapshot()
+    rows = _counter(snapshot, "rows_total")
+    callback = _merged_histogram(snapshot, metrics, "callback_seconds")
+    print_report({
+        "node": args.node,
+        "messages": len(messages),
+        "rows": int(rows),
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed if elapsed else 0.0,
+        "messages_per_s": len(messages) / elapsed if elapsed else 0.0,
+        "callback_p50_ms": callback.quantile(0.5) * 1000,
+        "callback_p90_ms": callback.quantile(0.9) * 1000,
+        "callback_p99_ms": callback.quantile(0.99) * 1000,
+        "persistence_bytes": int(_counter(snapshot, "fault_manager_bytes")),
+    })
+    # Los nodos dejan hilos no daemon (limpieza de persistencia)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def _wait_for_consumers(broker, queues: list, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with broker.lock:
+            if all(q in broker.queues and broker.queues[q].consumers for q in queues):
+                return
+        time.sleep(0.01)
+    raise RuntimeError(f"The node didn't consume from {queues}; check --bind names and INSTANCE_ID")
+
+
+def _wait_until_settled(broker) -> float:
+    """
+    Espera a que el nodo termine con todo lo entregado y devuelve cuándo
+    quedó quieto el broker por última vez.
+    """
+    idle_since = None
+    while True:
+        if broker.idle():
+            now = time.perf_counter()
+            idle_since = idle_since or now
+            if now - idle_since >= SETTLE_SECONDS:
+                return idle_since
+        else:
+            idle_since = None
+        time.sleep(0.001)
+
+
+def _counter(snapshot: dict, name: str) -> float:
+    return sum(c["value"] for c in snapshot["counters"] if c["name"] == name)
+
+
+def _merged_histogram(snapshot: dict, metrics, name: str):
+    """
+    Junta en un solo histograma las series de `name` (una por tipo de
+    mensaje y cliente).
+    """
+    merged = metrics.Histogram()
+    indexes = {f"{bound:g}": i for i, bound in enumerate(metrics.BUCKETS)}
+    indexes["+Inf"] = len(metrics.BUCKETS)
+    for histogram in snapshot["histograms"]:
+        if histogram["name"] != name:
+            continue
+        merged.count += histogram["count"]
+        merged.sum += histogram["sum"]
+        merged.max = max(merged.max, histogram["max"])
+        for bound, count in histogram["buckets"].items():
+            merged.counts[indexes[bound]] += count
+    return merged
+
+
+def print_report(row: dict):
+    print("  ".join(
+        f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in row.items()
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grabación y replay del flujo de entrada de un nodo")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Graba lo que llega a las colas de entrada de un nodo")
+    record_parser.add_argument("--host", default="localhost", help="Host de RabbitMQ")
+    record_parser.add_argument("--output", required=True, help="Archivo de salida")
+    record_parser.add_argument(
+        "--bind", action="append", required=True,
+        help="cola_del_nodo=exchange[:routing_key], p. ej. games_queue_filter_0=games (repetible)",
+    )
+    record_parser.add_argument("--fins", type=int, default=0, help="Cortar después de esta cantidad de FIN")
+    record_parser.add_argument("--idle", type=float, default=30, help="Cortar tras estos segundos sin mensajes")
+
+    replay_parser = commands.add_parser("replay", help="Reproduce una grabación sobre la clase del nodo")
+    replay_parser.add_argument("--input", required=True, help="Archivo grabado")
+    replay_parser.add_argument("--node", required=True, help="Directorio del nodo, p. ej. game_review_filter")
+    replay_parser.add_argument("--service", default=None, help="Servicio del compose del que se toma el entorno")
+    replay_parser.add_argument("--compose", default="docker-compose-system.yaml")
+    replay_parser.add_argument("--env", action="append", default=[], help="KEY=VALUE extra (repetible)")
+
+    args = parser.parse_args()
+    record(args) if args.command == "record" else replay(args)
+
+
+if __name__ == "__main__":
+    main()
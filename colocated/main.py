@@ -0,0 +1,32 @@
+import json
+import logging
+import os
+import threading
+from common import middleware
+from common.colocation import Bridge
+from common.healthcheck import HealthCheckServer
+from common.stages import load_stage
+
+
+def main():
+    logging.basicConfig(level=getattr(logging, os.getenv("LOGGING_LEVEL", "DEBUG")),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if middleware.MIDDLEWARE_ENGINE != middleware.MEMORY_ENGINE:
+        raise ValueError("Co-located stages need MIDDLEWARE_ENGINE=memory")
+    stages = json.loads(os.getenv("FUSED_STAGES", "[]"))
+    bridge = Bridge(json.loads(os.getenv("BRIDGE_INBOUND", "{}")), json.loads(os.getenv("BRIDGE_OUTBOUND", "{}")))
+    bridge.setup()
+
+    threads = []
+    for stage in stages:
+        node = load_stage(stage["name"], stage["node"], stage["env"])
+        logging.info(f"Etapa {stage['name']} ({stage['node']}) lista")
+        threads.append(threading.Thread(target=node.start, name=stage["name"]))
+    threads.append(threading.Thread(target=bridge.start, name="bridge"))
+    for thread in threads:
+        thread.start()
+    HealthCheckServer(threads).start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import json
+import os
+import struct
+from array import array
+from typing import Optional, Union
+from common.packet_fin import Fin
+
+# Codecs de lote disponibles; el JSON por líneas sigue siendo el formato legible
+JSON_CODEC = "json"
+COLUMNAR_CODEC = "columnar"
+
+# content_type AMQP con el que viajan los lotes columnares
+COLUMNAR_CONTENT_TYPE = "application/x-steam-columnar"
+
+# Codec a usar por exchange o cola de destino, p. ej. {"reviews": "columnar"}
+BATCH_CODECS: dict = json.loads(os.getenv("BATCH_CODECS", "{}"))
+
+MAGIC = b"SCB1"
+
+# Tipos de mensaje, para las métricas
+FIN_MESSAGE = "fin"
+BATCH_MESSAGE = "batch"
+
+# Tipos de columna
+STR_COLUMN = 0
+INT_COLUMN = 1
+JSON_COLUMN = 2
+
+# magic, largo del header
+PREFIX = struct.Struct("<4sI")
+# filas, columnas, largo del packet_id
+HEADER = struct.Struct("<IHH")
+# tipo, offset y largo del bloque de la columna (relativos al inicio de los datos)
+COLUMN_ENTRY = struct.Struct("<BII")
+
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+def codec_for(*destinations: str) -> str:
+    """
+    Codec configurado para el primero de `destinations` (cola, routing key
+    o exchange) que tenga uno; JSON si ninguno lo tiene.
+    """
+    for destination in destinations:
+        if destination in BATCH_CODECS:
+            return BATCH_CODECS[destination]
+    return JSON_CODEC
+
+
+def encode_batch(packet_id, rows: list, codec: str = JSON_CODEC) -> Union[str, bytes]:
+    """
+    Codifica un lote de filas (listas de campos, como las de `getData()`).
+
+    JSON produce el formato de siempre: el packet_id en la primera línea y
+    una fila JSON por línea. El formato columnar es:
+
+        magic | largo del header | header | bloques de columnas
+
+    donde el header tiene la cantidad de filas y columnas, el packet_id y
+    la tabla (tipo, offset, largo) de cada columna. Las columnas de texto
+    son un arreglo de offsets uint32 seguido de los bytes UTF-8
+    concatenados; las enteras, un arreglo int64.
+    """
+    if codec != COLUMNAR_CODEC:
+        lines = "".join(f"{json.dumps(row)}\n" for row in rows)
+        return f"{packet_id}\n{lines}"
+
+    column_count = max((len(row) for row in rows), default=0)
+    blocks = []
+    entries = []
+    offset = 0
+    for index in range(column_count):
+        values = [row[index] if index < len(row) else None for row in rows]
+        column_type, block = _encode_column(values)
+        entries.append(COLUMN_ENTRY.pack(column_type, offset, len(block)))
+        blocks.append(block)
+        offset += len(block)
+
+    packet_id_bytes = str(packet_id).encode("utf-8")
+    header = HEADER.pack(len(rows), column_count, len(packet_id_bytes)) + packet_id_bytes + b"".join(entries)
+    return PREFIX.pack(MAGIC, len(header)) + header + b"".join(blocks)
+
+
+def _encode_column(values: list) -> tuple:
+    if all(type(v) is int and INT64_MIN <= v <= INT64_MAX for v in values):
+        return INT_COLUMN, array("q", values).tobytes()
+    if all(type(v) is str for v in values):
+        encoded = [v.encode("utf-8") for v in values]
+    else:
+        encoded = [json.dumps(v).encode("utf-8") for v in values]
+    offsets = array("I", [0])
+    total = 0
+    for value in encoded:
+        total += len(value)
+        offsets.append(total)
+    column_type = STR_COLUMN if all(type(v) is str for v in values) else JSON_COLUMN
+    return column_type, offsets.tobytes() + b"".join(encoded)
+
+
+def is_columnar(body) -> bool:
+    return isinstance(body, (bytes, bytearray, memoryview)) and bytes(body[:len(MAGIC)]) == MAGIC
+
+
+def packet_id_of(message) -> str:
+    """
+    Devuelve el packet_id de un lote sin decodificarlo entero.
+    """
+    if is_columnar(message):
+        return ColumnarBatch(message).packet_id
+    if isinstance(message, bytes):
+        message = message.decode("utf-8")
+    return message.lstrip().partition("\n")[0].strip()
+
+
+def describe(message) -> tuple:
+    """
+    Devuelve (tipo de mensaje, client_id, cantidad de filas). El client_id
+    es el último campo de las filas, como en getData().
+    """
+    if is_columnar(message):
+        batch = ColumnarBatch(message)
+        if not batch.row_count or not batch.entries:
+            return BATCH_MESSAGE, None, batch.row_count
+        return BATCH_MESSAGE, batch.column(len(batch.entries) - 1)[0], batch.row_count
+    if isinstance(message, bytes):
+        message = message.decode("utf-8")
+    if "fin\n\n" in message:
+        return FIN_MESSAGE, Fin.decode(message).client_id, 0
+    lines = [line for line in message.split("\n")[1:] if line.strip()]
+    client_id = None
+    if lines:
+        try:
+            row = json.loads(lines[0])
+            if isinstance(row, list) and row:
+                client_id = row[-1]
+        except ValueError:
+            pass
+    return BATCH_MESSAGE, client_id, len(lines)
+
+
+def decode_batch(message) -> Union["JsonBatch", "ColumnarBatch"]:
+    if is_columnar(message):
+        return ColumnarBatch(message)
+    if isinstance(message, bytes):
+        message = message.decode("utf-8")
+    return JsonBatch(message)
+
+
+class JsonBatch:
+    """
+    Lote en JSON por líneas. Cada fila se parsea al pedirla.
+    """
+
+    def __init__(self, message: str):
+        lines = message.strip().split("\n")
+        self.packet_id = lines[0].strip()
+        self.lines = [line for line in lines[1:] if line.strip()]
+        self._rows: Optional[list] = None
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def rows(self) -> list:
+        if self._rows is None:
+            self._rows = [json.loads(line) for line in self.lines]
+        return self._rows
+
+    def row(self, index: int) -> list:
+        return self.rows()[index]
+
+    def column(self, index: int) -> list:
+        return [row[index] for row in self.rows()]
+
+    def json_lines(self) -> list[str]:
+        return self.lines
+
+
+class ColumnarBatch:
+    """
+    Lote en formato columnar. Solo se parsea el header al construirlo; cada
+    columna se decodifica la primera vez que se la pide.
+    """
+
+    def __init__(self, body: bytes):
+        self.body = memoryview(body)
+        magic, header_length = PREFIX.unpack_from(self.body, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a columnar batch")
+        position = PREFIX.size
+        self.row_count, column_count, packet_id_length = HEADER.unpack_from(self.body, position)
+        position += HEADER.size
+        self.packet_id = bytes(self.body[position:position + packet_id_length]).decode("utf-8")
+        position += packet_id_length
+        self.entries = [
+            COLUMN_ENTRY.unpack_from(self.body, position + i * COLUMN_ENTRY.size)
+            for i in range(column_count)
+        ]
+        self.data_start = PREFIX.size + header_length
+        self.columns: dict[int, list] = {}
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column(self, index: int) -> list:
+        column = self.columns.get(index)
+        if column is None:
+            column = self._decode_column(index)
+            self.columns[index] = column
+        return column
+
+    def _decode_column(self, index: int) -> list:
+        column_type, offset, length = self.entries[index]
+        block = self.body[self.data_start + offset:self.data_start + offset + length]
+        if column_type == INT_COLUMN:
+            values = array("q")
+            values.frombytes(block)
+            return values.tolist()
+        offsets_size = (self.row_count + 1) * array("I").itemsize
+        offsets = array("I")
+        offsets.frombytes(block[:offsets_size])
+        data = bytes(block[offsets_size:])
+        values = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self.row_count)]
+        if column_type == JSON_COLUMN:
+            return [json.loads(v) for v in values]
+        return values
+
+    def row(self, index: int) -> list:
+        return [self.column(c)[index] for c in range(len(self.entries))]
+
+    def rows(self) -> list:
+        columns = [self.column(c) for c in range(len(self.entries))]
+        return [list(row) for row in zip(*columns)]
+
+    def json_lines(self) -> list[str]:
+        return [json.dumps(row) for row in self.rows()]
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import time
+from typing import Callable
+from common.dedup import DedupIndex
+from common.fault_manager import FaultManager
+
+# Segundos entre checkpoints (0 = apagado: cada entrega se persiste y se confirma sola)
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "0"))
+# Entregas sin ack que fuerzan un checkpoint aunque no haya llegado la marca
+CHECKPOINT_MAX_PENDING = int(os.getenv("CHECKPOINT_MAX_PENDING", "200"))
+
+
+def current_epoch(now: float = None) -> int:
+    """
+    Id del checkpoint vigente: el gateway manda una marca cada vez que cambia.
+    """
+    return int((time.time() if now is None else now) // CHECKPOINT_INTERVAL)
+
+
+class Checkpointer:
+    """
+    Checkpoints locales de un consumidor con estado. En vez de persistir
+    cada entrega, el nodo deja las entregas sin ack y cada tanto guarda una
+    foto de su estado (`snapshot()`) junto con el índice de dedup; recién
+    entonces se confirman. Si el nodo se cae, vuelve a la última foto
+    (`restore(state)`) y el broker le reentrega todo lo que vino después.
+
+    La foto ocupa O(estado) y se escribe una vez por intervalo, no una por
+    lote. Los checkpoints los disparan las marcas que inyecta el gateway
+    (ver `current_epoch`), la cantidad de entregas pendientes o un FIN.
+    """
+
+    def __init__(
+        self,
+        fault_manager: FaultManager,
+        key: str,
+        snapshot: Callable,
+        restore: Callable,
+        max_pending: int = CHECKPOINT_MAX_PENDING,
+    ):
+        self.fault_manager = fault_manager
+        self.key = key
+        self.snapshot = snapshot
+        self.restore = restore
+        self.max_pending = max_pending
+        # Solo en memoria: viaja dentro de la foto
+        self.processed_packets = DedupIndex(None, key)
+        self.pending: list = []  # delivery tags sin ack
+        self.epoch = 0
+        self.init_state()
+
+    def track(self, delivery_tag) -> bool:
+        """
+        Registra una entrega que queda sin ack hasta el próximo checkpoint.
+        Devuelve True si ya hay que tomarlo.
+        """
+        self.pending.append(delivery_tag)
+        return len(self.pending) >= self.max_pending
+
+    def advance(self, epoch: int) -> bool:
+        """
+        Registra la marca del checkpoint `epoch`. Devuelve False si ya se
+        había tomado (llega una marca por cada camino desde el gateway).
+        """
+        if epoch <= self.epoch:
+            return False
+        self.epoch = epoch
+        return True
+
+    def take(self) -> list:
+        """
+        Guarda la foto y devuelve los delivery tags que cubre, para confirmarlos.
+        """
+        data = {"epoch": self.epoch, "state": self.snapshot(), "dedup": self.processed_packets.export()}
+        self.fault_manager.update(self.key, json.dumps(data))
+        self.fault_manager.sync()
+        delivery_tags = self.pending
+        self.pending = []
+        logging.debug(f"Checkpoint {self.epoch} de {self.key}: {len(delivery_tags)} entregas")
+        return delivery_tags
+
+    def reset(self):
+        # Los delivery tags del canal anterior ya no valen: se reentregan
+        self.pending = []
+
+    def init_state(self):
+        if self.key not in self.fault_manager.get_keys(self.key):
+            return
+        state = self.fault_manager.get(self.key)
+        if not state:
+            return
+        data = json.loads(state)
+        self.epoch = data["epoch"]
+        self.processed_packets.load(data["dedup"])
+        self.restore(data["state"])
+        logging.info(f"Checkpoint {self.epoch} restaurado desde {self.key}")
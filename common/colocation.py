@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+from collections import deque
+import pika
+from common.confirms import ConfirmWindow
+from common.memory_engine import MATCH_ALL, MemoryBroker, MemoryEngineConnection
+from common.middleware import QUEUE_MAX_LENGTH, RABBITMQ_HOST, RABBITMQ_PORT
+
+# Entregas de RabbitMQ en vuelo hacia las etapas del contenedor
+BRIDGE_PREFETCH = int(os.getenv("BRIDGE_PREFETCH", "200"))
+# Cada cuánto se confirman en RabbitMQ las entregas ya procesadas (segundos)
+BRIDGE_ACK_INTERVAL = float(os.getenv("BRIDGE_ACK_INTERVAL", "0.02"))
+# Reenvíos a RabbitMQ sin confirmar en vuelo
+BRIDGE_CONFIRM_WINDOW = int(os.getenv("BRIDGE_CONFIRM_WINDOW", "200"))
+
+# Prefijo de las colas en memoria que copian los exchanges de salida
+TAP_PREFIX = "bridge."
+
+
+class Bridge:
+    """
+    Une el broker en memoria de un contenedor con varias etapas co-ubicadas
+    con RabbitMQ, solo en los bordes declarados:
+
+    - `inbound` ({cola: [exchange, tipo]}): colas de RabbitMQ cuyas entregas
+      se pasan a la cola en memoria del mismo nombre, que consume la etapa.
+    - `outbound` ({exchange: tipo}): exchanges con consumidores fuera del
+      contenedor; lo que las etapas publican en ellos se reenvía a RabbitMQ
+      con los mismos headers y routing key, con una ventana de publisher
+      confirms: el reenvío queda sin ack en memoria hasta que se confirma.
+
+    Entre etapas los mensajes viajan en memoria. Cada entrega de entrada
+    entra al broker en memoria con su delivery tag como origin, y se
+    confirma en RabbitMQ cuando ya no queda vivo en memoria nada que pueda
+    depender de ella (su tag es menor al `low_watermark()` del broker). Así
+    una caída del contenedor hace reentregar solo lo que no terminó y la
+    dedup de las etapas descarta lo que ya habían procesado, igual que con
+    contenedores separados.
+    """
+
+    def __init__(self, inbound: dict, outbound: dict, broker: MemoryBroker = None):
+        self.inbound = inbound
+        self.outbound = outbound
+        self.broker = broker or MemoryBroker.instance()
+        self.local = MemoryEngineConnection(self.broker)
+        self.local_channel = self.local.channel()
+        self.connection = None
+        self.channel = None
+        self.confirms: ConfirmWindow = None
+        self.inbound_tags: deque = deque()  # entregas de entrada todavía sin ack
+
+    def setup(self):
+        """
+        Declara los bordes en ambos brokers. Se llama antes de crear las
+        etapas, para que nada de lo que publiquen se pierda.
+        """
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT))
+        self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=BRIDGE_PREFETCH)
+        self.confirms = ConfirmWindow(self.channel, BRIDGE_CONFIRM_WINDOW, self._ack_forwarded)
+        self.confirms.enable()
+        arguments = {"x-max-length": QUEUE_MAX_LENGTH, "x-overflow": "reject-publish"} if QUEUE_MAX_LENGTH > 0 else None
+        for queue, (exchange, exchange_type) in self.inbound.items():
+            self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+            self.channel.queue_declare(queue=queue, durable=True, arguments=arguments)
+            self.channel.queue_bind(exchange=exchange, queue=queue)
+            self.local_channel.queue_declare(queue=queue, durable=True)
+            self.channel.basic_consume(
+                queue=queue,
+                on_message_callback=lambda _ch, method, properties, body, queue=queue: self._on_inbound(
+                    queue, method, properties, body
+                ),
+            )
+            logging.info(f"Bridge: {exchange}/{queue} -> memoria")
+        for exchange, exchange_type in self.outbound.items():
+            self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+            self.local_channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+            tap = f"{TAP_PREFIX}{exchange}"
+            self.local_channel.queue_declare(queue=tap)
+            self.local_channel.queue_bind(queue=tap, exchange=exchange, routing_key=MATCH_ALL)
+            self.local_channel.basic_consume(queue=tap, on_message_callback=self._on_outbound)
+            logging.info(f"Bridge: memoria -> {exchange}")
+
+    def _on_inbound(self, queue: str, method, properties, body):
+        self.broker.publish("", queue, body, properties, origin=method.delivery_tag)
+        self.inbound_tags.append(method.delivery_tag)
+
+    def _on_outbound(self, _channel, method, properties, body):
+        # Corre en el hilo del broker en memoria: pika solo se usa desde su hilo
+        self.connection.add_callback_threadsafe(lambda: self._forward(method, properties, body))
+
+    def _forward(self, method, properties, body):
+        self.confirms.publish(method.exchange, method.routing_key, body, properties)
+        if not self.confirms.hold(method.delivery_tag):
+            self.local_channel.basic_ack(method.delivery_tag)
+
+    def _ack_forwarded(self):
+        # Se llama dentro del ioloop de pika, pero el ack es en memoria
+        for delivery_tag in self.confirms.take_released():
+            self.local_channel.basic_ack(delivery_tag)
+
+    def _ack_inbound(self):
+        watermark = self.broker.low_watermark()
+        last = None
+        while self.inbound_tags and (watermark is None or self.inbound_tags[0] < watermark):
+            last = self.inbound_tags.popleft()
+        if last is not None:
+            self.channel.basic_ack(delivery_tag=last, multiple=True)
+        self.connection.call_later(BRIDGE_ACK_INTERVAL, self._ack_inbound)
+
+    def start(self):
+        """
+        Atiende ambos bordes hasta que se cierre la conexión. Si RabbitMQ se
+        cae el hilo termina y el health check marca el contenedor caído.
+        """
+        local_thread = threading.Thread(target=self.local_channel.start_consuming, daemon=True)
+        local_thread.start()
+        self.connection.call_later(BRIDGE_ACK_INTERVAL, self._ack_inbound)
+        self.channel.start_consuming()
@@ -0,0 +1,48 @@
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Valores de content_encoding con los que viaja un cuerpo comprimido
+ZLIB_CODEC = "zlib"
+LZ4_CODEC = "lz4"
+
+ZLIB_LEVEL = 1
+
+
+def available_codecs() -> list[str]:
+    codecs = [ZLIB_CODEC]
+    if lz4_frame is not None:
+        codecs.append(LZ4_CODEC)
+    return codecs
+
+
+def resolve_codec(codec: str) -> str:
+    """
+    Devuelve el codec pedido si está disponible, o zlib (que siempre lo está).
+    """
+    if codec == LZ4_CODEC and lz4_frame is not None:
+        return LZ4_CODEC
+    return ZLIB_CODEC
+
+
+def compress(body: bytes, codec: str) -> bytes:
+    if codec == LZ4_CODEC:
+        return lz4_frame.compress(body)
+    return zlib.compress(body, ZLIB_LEVEL)
+
+
+def decompress(body: bytes, codec: str) -> bytes:
+    if codec == ZLIB_CODEC:
+        return zlib.decompress(body)
+    if codec == LZ4_CODEC:
+        if lz4_frame is None:
+            raise ValueError("Message compressed with lz4 but lz4 is not installed")
+        return lz4_frame.decompress(body)
+    raise ValueError(f"Unknown content encoding: {codec}")
+
+
+def is_compressed(properties) -> bool:
+    return properties is not None and properties.content_encoding in (ZLIB_CODEC, LZ4_CODEC)
@@ -0,0 +1,208 @@
+import logging
+from collections import OrderedDict, deque
+from typing import Callable
+import pika
+from pika.adapters.blocking_connection import BlockingChannel
+
+# Versiones de pika cuyos internos de BlockingChannel usa BlockingConfirms
+# (la imagen instala pika==1.3.2)
+SUPPORTED_PIKA_VERSIONS = ("1.3.",)
+# Espera antes de reenviar una publicación rechazada (nack), duplicada en
+# cada rechazo seguido: con x-overflow=reject-publish el broker rechaza
+# mientras la cola siga llena
+NACK_RETRY_INITIAL_DELAY = 0.05
+NACK_RETRY_MAX_DELAY = 2.0
+
+
+class ChannelConfirms:
+    """
+    Confirms asincrónicos sobre la API pública de un canal: los motores
+    select y memory exponen `confirm_delivery` con callback de ack/nack y
+    `wait_until`, y se puede publicar desde el callback.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def confirm_delivery(self, ack_nack_callback: Callable, callback: Callable):
+        self.channel.confirm_delivery(ack_nack_callback=ack_nack_callback, callback=callback)
+
+    def wait_until(self, predicate: Callable):
+        self.channel.wait_until(predicate)
+
+    def publish(self, exchange, routing_key, body, properties):
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def republish(self, exchange, routing_key, body, properties):
+        # Desde el callback de confirmación o de un timer
+        self.publish(exchange, routing_key, body, properties)
+
+    def call_later(self, delay: float, callback: Callable):
+        # Los timers de los motores corren en el hilo de los callbacks
+        self.channel.connection.call_later(delay, callback)
+
+
+class BlockingConfirms(ChannelConfirms):
+    """
+    BlockingChannel solo expone confirms sincrónicos (un round trip por
+    publish), así que el callback de ack/nack se registra sobre el canal
+    asincrónico que envuelve. Es el único lugar que toca internos de pika
+    y se niega a arrancar con una versión no probada: con otra, el motor
+    select da lo mismo con la API pública de SelectConnection.
+    """
+
+    def __init__(self, channel: BlockingChannel):
+        if not pika.__version__.startswith(SUPPORTED_PIKA_VERSIONS):
+            raise RuntimeError(
+                f"Pipelined confirms on the blocking engine are only supported on pika "
+                f"{', '.join(v + 'x' for v in SUPPORTED_PIKA_VERSIONS)} (found {pika.__version__}); "
+                f"use MIDDLEWARE_ENGINE=select"
+            )
+        super().__init__(channel)
+
+    def confirm_delivery(self, ack_nack_callback: Callable, callback: Callable):
+        self.channel._impl.confirm_delivery(ack_nack_callback=ack_nack_callback, callback=callback)
+
+    def wait_until(self, predicate: Callable):
+        self.channel._flush_output(predicate)
+
+    def republish(self, exchange, routing_key, body, properties):
+        # Estamos dentro del ioloop: BlockingChannel.basic_publish no es reentrante
+        self.channel._impl.basic_publish(exchange, routing_key, body, properties)
+
+    def call_later(self, delay: float, callback: Callable):
+        # Timer del ioloop: vence también mientras wait_until espera lugar,
+        # cosa que no pasa con los de BlockingConnection.call_later
+        self.channel.connection._impl._adapter_call_later(delay, callback)
+
+
+def confirms_for(channel) -> ChannelConfirms:
+    if isinstance(channel, BlockingChannel):
+        return BlockingConfirms(channel)
+    return ChannelConfirms(channel)
+
+
+class ConfirmWindow:
+    """
+    Publisher confirms con hasta `max_outstanding` publicaciones sin
+    confirmar en vuelo.
+
+    Cada publicación se identifica por su delivery tag de confirmación (el
+    broker las numera desde 1 por canal). Los acks de entrada se retienen
+    detrás de la última publicación hecha al momento del ack y se liberan,
+    en orden, cuando todas las publicaciones anteriores fueron confirmadas.
+    Las publicaciones rechazadas (nack) se vuelven a publicar tras una
+    espera que se duplica con cada rechazo seguido; mientras esperan siguen
+    ocupando lugar en la ventana y reteniendo los acks de atrás.
+    """
+
+    def __init__(self, channel, max_outstanding: int, on_released: Callable = None):
+        self.channel = confirms_for(channel)
+        self.max_outstanding = max_outstanding
+        self.on_released = on_released
+        self.next_seq = 1
+        self.outstanding: OrderedDict[int, tuple] = OrderedDict()
+        # Rechazadas esperando para reenviarse: seq -> (publicación, rechazos)
+        self.retrying: OrderedDict[int, tuple] = OrderedDict()
+        self.attempts: dict[int, int] = {}  # rechazos previos de las reenviadas
+        self.held: deque = deque()  # (seq, input_delivery_tag)
+        self.released: list = []
+
+    def enable(self):
+        """
+        Activa el modo confirm en el canal sin volver sincrónico cada publish.
+        """
+        selected = []
+        self.channel.confirm_delivery(
+            ack_nack_callback=self._on_confirm,
+            callback=lambda _frame: selected.append(True),
+        )
+        self.channel.wait_until(lambda: bool(selected))
+        logging.info(f"Publisher confirms enabled (window={self.max_outstanding})")
+
+    def has_room(self) -> bool:
+        return len(self.outstanding) + len(self.retrying) < self.max_outstanding
+
+    def publish(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties = None):
+        if not self.has_room():
+            self.channel.wait_until(self.has_room)
+        self._publish(exchange, routing_key, body, properties)
+
+    def _publish(self, exchange, routing_key, body, properties):
+        self.channel.publish(exchange, routing_key, body, properties)
+        self.outstanding[self.next_seq] = (exchange, routing_key, body, properties)
+        self.next_seq += 1
+
+    def hold(self, delivery_tag) -> bool:
+        """
+        Retiene el ack de una entrega hasta que se confirme todo lo publicado
+        antes. Devuelve False si no hay nada pendiente y puede confirmarse ya.
+        """
+        if not self.outstanding and not self.retrying and not self.held:
+            return False
+        self.held.append((self.next_seq - 1, delivery_tag))
+        self._release()
+        return True
+
+    def pending(self) -> bool:
+        return bool(self.outstanding or self.retrying or self.held)
+
+    def wait_all(self):
+        self.channel.wait_until(lambda: not self.outstanding and not self.retrying)
+
+    def unconfirmed(self) -> list:
+        """
+        Publicaciones sin confirmar (exchange, routing_key, body, properties)
+        en orden, para reenviarlas por otro canal.
+        """
+        entries = list(self.outstanding.items()) + [(seq, entry) for seq, (entry, _) in self.retrying.items()]
+        return [entry for _, entry in sorted(entries, key=lambda item: item[0])]
+
+    def take_released(self) -> list:
+        released = self.released
+        self.released = []
+        return released
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [seq for seq in self.outstanding if seq <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.outstanding else []
+
+        if isinstance(method, pika.spec.Basic.Nack):
+            for seq in tags:
+                entry = self.outstanding.pop(seq)
+                attempts = self.attempts.pop(seq, 0)
+                delay = min(NACK_RETRY_MAX_DELAY, NACK_RETRY_INITIAL_DELAY * 2 ** attempts)
+                logging.warning(f"Publish {seq} to {entry[0]}/{entry[1]} nacked, republishing in {delay:.2f}s")
+                self.retrying[seq] = (entry, attempts + 1)
+                self.channel.call_later(delay, lambda seq=seq: self._republish(seq))
+        else:
+            for seq in tags:
+                self.outstanding.pop(seq, None)
+                self.attempts.pop(seq, None)
+        self._release()
+
+    def _republish(self, seq):
+        if seq not in self.retrying:
+            return
+        (exchange, routing_key, body, properties), attempts = self.retrying.pop(seq)
+        new_seq = self.next_seq
+        self.channel.republish(exchange, routing_key, body, properties)
+        self.outstanding[new_seq] = (exchange, routing_key, body, properties)
+        self.attempts[new_seq] = attempts
+        self.next_seq += 1
+        self.held = deque(
+            (new_seq if held_seq >= seq else held_seq, tag) for held_seq, tag in self.held
+        )
+
+    def _release(self):
+        firsts = [seq for seq in (next(iter(self.outstanding), None), min(self.retrying, default=None)) if seq is not None]
+        oldest = min(firsts, default=None)
+        released = False
+        while self.held and (oldest is None or self.held[0][0] < oldest):
+            self.released.append(self.held.popleft()[1])
+            released = True
+        if released and self.on_released is not None:
+            self.on_released()
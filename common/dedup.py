@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from common.fault_manager import FaultManager
+
+# Duración de cada segmento del journal (segundos)
+SEGMENT_SECONDS = 30
+# Segmentos que se conservan antes de descartarlos (4 * 30s = 2 minutos)
+RETAINED_SEGMENTS = 4
+# Secuencias fuera de orden que se toleran por productor; el Middleware
+# la agranda hasta cubrir su prefetch
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "1024"))
+
+
+class ProducerWatermark:
+    """
+    High-water mark de un productor: todas las secuencias <= hwm ya se
+    vieron; las que llegaron adelantadas quedan en `pending` hasta que el
+    hueco se completa o queda fuera de la ventana.
+    """
+
+    def __init__(self, window: int, hwm: int = 0, pending=()):
+        self.window = window
+        self.hwm = hwm
+        self.pending: set[int] = set(pending)
+
+    def seen(self, seq: int) -> bool:
+        return seq <= self.hwm or seq in self.pending
+
+    def add(self, seq: int):
+        if seq <= self.hwm:
+            return
+        self.pending.add(seq)
+        while self.hwm + 1 in self.pending:
+            self.hwm += 1
+            self.pending.remove(self.hwm)
+        if seq - self.hwm > self.window:
+            # Los huecos que quedaron fuera de la ventana no van a llegar
+            self.hwm = seq - self.window
+            self.pending = {s for s in self.pending if s > self.hwm}
+
+
+class DedupIndex:
+    """
+    Índice de paquetes procesados para un consumidor, en dos capas.
+
+    Por (productor, secuencia): un high-water mark por productor más una
+    ventana de secuencias fuera de orden. Ocupa O(ventana) por productor y
+    no vence, así que descarta las reentregas del broker por viejas que sean.
+
+    Por packet_id: un lote que el gateway duplica a propósito, o que un
+    nodo sin estado reenvía después de caerse, sale con otra secuencia pero
+    con el mismo packet_id. Cada packet_id se registra en el segmento
+    (intervalo de tiempo) en el que se marcó; un dict packet_id -> segmento
+    resuelve la consulta en O(1). El journal se persiste en el FaultManager
+    partido por segmento (`{prefix}_{segmento}`, una línea por paquete:
+    packet_id, productor y secuencia): expirar es borrar segmentos enteros.
+    Antes de borrarlos se guardan los watermarks, que no vencen.
+    """
+
+    def __init__(
+        self,
+        fault_manager: Optional[FaultManager],
+        prefix: str,
+        segment_seconds: int = SEGMENT_SECONDS,
+        retained_segments: int = RETAINED_SEGMENTS,
+        window: int = DEDUP_WINDOW,
+    ):
+        self.fault_manager = fault_manager
+        self.prefix = prefix
+        self.segment_seconds = segment_seconds
+        self.retained_segments = retained_segments
+        self.window = window
+        self.watermarks: dict[str, ProducerWatermark] = {}
+        self.segments: dict[int, set[str]] = {}
+        self.index: dict[str, int] = {}  # packet_id -> segmento en el que se marcó
+        self.lock = threading.Lock()
+        self.init_state()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _segment_for(self, now: float) -> int:
+        return int(now // self.segment_seconds)
+
+    def _segment_key(self, segment: int) -> str:
+        return f"{self.prefix}_{segment}"
+
+    def _watermarks_key(self) -> str:
+        return f"{self.prefix}_watermarks"
+
+    def seen(self, packet_id: str, producer: str = None, seq: int = None) -> bool:
+        if producer is not None and seq is not None:
+            watermark = self.watermarks.get(producer)
+            if watermark is not None and watermark.seen(seq):
+                return True
+        return packet_id in self.index
+
+    def mark(self, packet_id: str, producer: str = None, seq: int = None):
+        self.mark_many([packet_id], [(producer, seq)])
+
+    def mark_many(self, packet_ids: list, sequences: list = None):
+        """
+        Registra varios paquetes con una única escritura al journal.
+        `sequences` trae el (productor, secuencia) de cada uno, o None.
+        """
+        if sequences is None:
+            sequences = [(None, None)] * len(packet_ids)
+        with self.lock:
+            segment = self._segment_for(time.time())
+            lines = []
+            for packet_id, (producer, seq) in zip(packet_ids, sequences):
+                self._add(packet_id, segment)
+                if producer is not None and seq is not None:
+                    self._add_seq(producer, seq)
+                    lines.append(f"{packet_id}\t{producer}\t{seq}")
+                else:
+                    lines.append(packet_id)
+            if self.fault_manager is not None and lines:
+                self.fault_manager.append(self._segment_key(segment), "\n".join(lines))
+
+    def _add_seq(self, producer: str, seq: int):
+        watermark = self.watermarks.get(producer)
+        if watermark is None:
+            watermark = ProducerWatermark(self.window)
+            self.watermarks[producer] = watermark
+        watermark.add(seq)
+
+    def _add_line(self, line: str, segment: int):
+        packet_id, _, sequence = line.partition("\t")
+        self._add(packet_id, segment)
+        if sequence:
+            producer, _, seq = sequence.rpartition("\t")
+            self._add_seq(producer, int(seq))
+
+    def _add(self, packet_id: str, segment: int):
+        previous = self.index.get(packet_id)
+        if previous is not None and previous != segment:
+            # Se volvió a marcar: vence con el segmento nuevo
+            self.segments[previous].discard(packet_id)
+        self.index[packet_id] = segment
+        self.segments.setdefault(segment, set()).add(packet_id)
+
+    def expire(self, now: float = None):
+        """
+        Descarta los segmentos más viejos que la retención configurada.
+        """
+        with self.lock:
+            oldest = self._segment_for(time.time() if now is None else now) - self.retained_segments + 1
+            for segment in [s for s in self.segments if s < oldest]:
+                for packet_id in self.segments.pop(segment):
+                    if self.index.get(packet_id) == segment:
+                        del self.index[packet_id]
+            if self.fault_manager is None:
+                return
+            expired = []
+            for key in self.fault_manager.get_keys(f"{self.prefix}_"):
+                segment = self._parse_segment(key)
+                if segment is not None and segment < oldest:
+                    expired.append(key)
+            if not expired:
+                return
+            # Las secuencias de los segmentos que se borran siguen en el watermark
+            self.fault_manager.update(self._watermarks_key(), json.dumps(self._export_watermarks()))
+            for key in expired:
+                self.fault_manager.delete_key(key)
+
+    def _export_watermarks(self) -> dict:
+        return {
+            producer: [watermark.hwm, sorted(watermark.pending)]
+            for producer, watermark in self.watermarks.items()
+        }
+
+    def _load_watermarks(self, watermarks: dict):
+        for producer, (hwm, pending) in watermarks.items():
+            self.watermarks[producer] = ProducerWatermark(self.window, hwm, pending)
+
+    def export(self) -> dict:
+        """
+        Foto del índice en memoria, para guardarla dentro de un checkpoint.
+        """
+        with self.lock:
+            return {
+                "segments": {str(segment): sorted(ids) for segment, ids in self.segments.items() if ids},
+                "watermarks": self._export_watermarks(),
+            }
+
+    def load(self, snapshot: dict):
+        """
+        Restaura una foto tomada con `export`.
+        """
+        with self.lock:
+            for segment, ids in sorted(snapshot["segments"].items(), key=lambda item: int(item[0])):
+                for packet_id in ids:
+                    self._add(packet_id, int(segment))
+            self._load_watermarks(snapshot["watermarks"])
+
+    def _parse_segment(self, key: str) -> Optional[int]:
+        suffix = key[len(self.prefix) + 1:]
+        return int(suffix) if suffix.isdigit() else None
+
+    def init_state(self):
+        if self.fault_manager is None:
+            return
+        if self.fault_manager.get_keys(self._watermarks_key()):
+            state = self.fault_manager.get(self._watermarks_key())
+            if state:
+                self._load_watermarks(json.loads(state))
+        segments = []
+        for key in self.fault_manager.get_keys(f"{self.prefix}_"):
+            segment = self._parse_segment(key)
+            if segment is not None:
+                segments.append((segment, key))
+        for segment, key in sorted(segments):
+            state = self.fault_manager.get(key)
+            if not state:
+                continue
+            for line in state.split("\n"):
+                if line:
+                    self._add_line(line, segment)
+        logging.info(
+            f"Dedup {self.prefix}: {len(self.index)} paquetes en {len(segments)} segmentos "
+            f"y {len(self.watermarks)} productores restaurados"
+        )
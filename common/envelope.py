@@ -0,0 +1,230 @@
+import os
+import threading
+from typing import Optional
+from common import batch_codec
+from common.fault_manager import FaultManager
+from common.packet_fin import Fin
+
+# Tipos de mensaje
+DATA_MESSAGE = "data"
+FIN_MESSAGE = "fin"
+# Marca de checkpoint: sin cuerpo, el id del checkpoint viaja en x-batch-id
+BARRIER_MESSAGE = "barrier"
+# Cancelación de un cliente que se desconectó a mitad de la carga: sin cuerpo, como el FIN
+CANCEL_MESSAGE = "cancel"
+
+# Headers AMQP del sobre
+TYPE_HEADER = "x-type"
+PACKET_ID_HEADER = "x-packet-id"
+CLIENT_ID_HEADER = "x-client-id"
+BATCH_ID_HEADER = "x-batch-id"
+ROWS_HEADER = "x-rows"
+PRODUCER_HEADER = "x-producer"
+SEQ_HEADER = "x-seq"
+ORIGIN_HEADER = "x-origin"
+
+FIN_PREFIX = "fin\n\n"
+
+# Dónde se guardan los contadores de secuencia, aparte del estado del nodo
+SEQUENCER_STORAGE = os.getenv("SEQUENCER_STORAGE", "../persistence/sequencer/")
+# Secuencias que se reservan por escritura: tras un reinicio se sigue desde el bloque siguiente
+SEQUENCE_BLOCK = int(os.getenv("SEQUENCE_BLOCK", "1000"))
+
+
+class Envelope:
+    """
+    Metadatos de un mensaje que viajan en `BasicProperties.headers`: tipo,
+    packet_id, client_id, productor y número de secuencia. El consumidor
+    despacha, deduplica y detecta el FIN sin mirar el payload; un FIN es
+    un mensaje sin cuerpo, solo con headers.
+    """
+
+    def __init__(
+        self,
+        message_type: str,
+        packet_id: str = None,
+        client_id: str = None,
+        batch_id: str = None,
+        rows: int = None,
+        producer: str = None,
+        seq: int = None,
+        origin: str = None,
+    ):
+        self.message_type = message_type
+        self.packet_id = packet_id
+        self.client_id = client_id
+        self.batch_id = batch_id
+        self.rows = rows
+        self.producer = producer
+        self.seq = seq
+        # Nodo que manda un FIN; `producer` es uno por exchange y routing key de salida
+        self.origin = origin
+
+    @property
+    def is_fin(self) -> bool:
+        return self.message_type == FIN_MESSAGE
+
+    @staticmethod
+    def for_fin(fin: Fin) -> "Envelope":
+        return Envelope(
+            FIN_MESSAGE, packet_id=FIN_MESSAGE, client_id=str(fin.client_id), batch_id=str(fin.batch_id), origin=fin.producer
+        )
+
+    @property
+    def is_barrier(self) -> bool:
+        return self.message_type == BARRIER_MESSAGE
+
+    @property
+    def is_cancel(self) -> bool:
+        return self.message_type == CANCEL_MESSAGE
+
+    @staticmethod
+    def for_cancel(client_id) -> "Envelope":
+        return Envelope(CANCEL_MESSAGE, client_id=str(client_id))
+
+    @staticmethod
+    def for_barrier(checkpoint_id: int) -> "Envelope":
+        return Envelope(BARRIER_MESSAGE, batch_id=str(checkpoint_id))
+
+    @staticmethod
+    def for_batch(packet_id, rows: list) -> "Envelope":
+        # El client_id es el último campo de las filas, como en getData()
+        client_id = str(rows[0][-1]) if rows and rows[0] else None
+        return Envelope(DATA_MESSAGE, packet_id=str(packet_id), client_id=client_id, rows=len(rows))
+
+    @staticmethod
+    def for_body(body) -> "Envelope":
+        """
+        Sobre de un mensaje armado por el nodo (send/send_to_queue): solo
+        mira el inicio del cuerpo.
+        """
+        if isinstance(body, str) and body.startswith(FIN_PREFIX):
+            return Envelope.for_fin(Fin.decode(body))
+        if batch_codec.is_columnar(body):
+            return Envelope(DATA_MESSAGE, packet_id=batch_codec.packet_id_of(body))
+        end = body.find(b"\n" if isinstance(body, (bytes, bytearray)) else "\n")
+        if end < 0:
+            return Envelope(DATA_MESSAGE)
+        packet_id = body[:end]
+        if isinstance(packet_id, (bytes, bytearray)):
+            packet_id = bytes(packet_id).decode("utf-8")
+        return Envelope(DATA_MESSAGE, packet_id=packet_id.strip())
+
+    def fin(self) -> Fin:
+        return Fin(self.batch_id, self.client_id, self.origin)
+
+    def to_headers(self) -> dict:
+        headers = {TYPE_HEADER: self.message_type}
+        for name, value in (
+            (PACKET_ID_HEADER, self.packet_id),
+            (CLIENT_ID_HEADER, self.client_id),
+            (BATCH_ID_HEADER, self.batch_id),
+            (ROWS_HEADER, self.rows),
+            (PRODUCER_HEADER, self.producer),
+            (SEQ_HEADER, self.seq),
+            (ORIGIN_HEADER, self.origin),
+        ):
+            if value is not None:
+                headers[name] = value
+        return headers
+
+    @staticmethod
+    def from_properties(properties) -> Optional["Envelope"]:
+        """
+        Sobre de un mensaje recibido; None si no lo trae (productor viejo).
+        """
+        headers = getattr(properties, "headers", None)
+        if not headers or TYPE_HEADER not in headers:
+            return None
+        return Envelope(
+            _text(headers[TYPE_HEADER]),
+            packet_id=_text(headers.get(PACKET_ID_HEADER)),
+            client_id=_text(headers.get(CLIENT_ID_HEADER)),
+            batch_id=_text(headers.get(BATCH_ID_HEADER)),
+            rows=headers.get(ROWS_HEADER),
+            producer=_text(headers.get(PRODUCER_HEADER)),
+            seq=headers.get(SEQ_HEADER),
+            origin=_text(headers.get(ORIGIN_HEADER)),
+        )
+
+
+def _text(value) -> Optional[str]:
+    # pika entrega los strings de los headers como bytes
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+class SequenceCounter:
+    """
+    Contador de un productor que sobrevive a los reinicios: reserva las
+    secuencias de a `block` y guarda en el FaultManager el fin del bloque
+    reservado. Al arrancar sigue desde ahí, así una secuencia no se repite
+    aunque el nodo se caiga a mitad de un bloque (a lo sumo queda un hueco).
+    """
+
+    def __init__(self, fault_manager: FaultManager, producer: str, block: int = SEQUENCE_BLOCK):
+        self.fault_manager = fault_manager
+        self.producer = producer
+        self.key = f"sequencer_{producer}"
+        self.block = block
+        self.lock = threading.Lock()
+        stored = fault_manager.get(self.key) if self.key in fault_manager.get_keys(self.key) else None
+        self.next = int(stored) if stored else 1
+        self.limit = self.next
+
+    def take(self) -> int:
+        with self.lock:
+            if self.next >= self.limit:
+                self.limit = self.next + self.block
+                self.fault_manager.update(self.key, str(self.limit))
+                self.fault_manager.sync()
+            seq = self.next
+            self.next += 1
+            return seq
+
+
+_counters: dict[str, SequenceCounter] = {}
+_counters_lock = threading.Lock()
+_storage: Optional[FaultManager] = None
+
+
+def _counter_for(producer: str, node_name: str) -> SequenceCounter:
+    # Uno por productor y por proceso: los Middleware de un mismo nodo que
+    # publican en el mismo exchange (p. ej. el pool del gateway) lo comparten
+    global _storage
+    with _counters_lock:
+        counter = _counters.get(producer)
+        if counter is None:
+            if _storage is None:
+                _storage = FaultManager(SEQUENCER_STORAGE, f"_{node_name}")
+            counter = SequenceCounter(_storage, producer)
+            _counters[producer] = counter
+        return counter
+
+
+class Sequencer:
+    """
+    Identidad de productor y números de secuencia de un Middleware. Cada
+    exchange y routing key de salida es un productor
+    `{node_name}/{exchange}/{routing_key}`, con el mismo nombre en cada
+    arranque, y su contador continúa después de un reinicio (ver
+    SequenceCounter): el par (productor, secuencia) no se repite nunca.
+    Con un productor por routing key cada cola recibe secuencias sin
+    huecos, en el orden del canal, y el watermark del consumidor (ver
+    DedupIndex) avanza sin esperar la ventana.
+    """
+
+    def __init__(self, node_name: str):
+        self.node_name = node_name
+        self.counters: dict[tuple, SequenceCounter] = {}
+
+    def stamp(self, envelope: Envelope, exchange: str, routing_key: str = "") -> Envelope:
+        counter = self.counters.get((exchange, routing_key))
+        if counter is None:
+            producer = f"{self.node_name}/{exchange}/{routing_key}" if routing_key else f"{self.node_name}/{exchange}"
+            counter = _counter_for(producer, self.node_name)
+            self.counters[(exchange, routing_key)] = counter
+        envelope.producer = counter.producer
+        envelope.seq = counter.take()
+        return envelope
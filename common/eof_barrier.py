@@ -0,0 +1,167 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Callable
+from common.fault_manager import FaultManager
+from common.packet_fin import Fin
+
+# Clientes completados que se recuerdan para ignorar sus FIN reentregados
+COMPLETED_WINDOW = 1024
+
+
+class ClientBarrier:
+    """
+    Estado de la barrera para un cliente: los FIN recibidos por productor,
+    con los lotes que cada uno dice haber mandado, y los lotes recibidos
+    (con sus packet_id, si el nodo los informa).
+    """
+
+    def __init__(self, fins: dict = None):
+        self.fins: dict[str, int] = fins or {}
+        self.received = 0
+        self.packets: set[str] = set()
+
+    def expected_batches(self) -> int:
+        return sum(self.fins.values())
+
+
+class EofBarrier:
+    """
+    Fin de stream por cliente para un nodo con `producers` productores
+    aguas arriba. Se completa cuando llegó el FIN de cada productor y, con
+    `count_batches`, también todos los lotes que anunciaron (el batch_id
+    del FIN es la cantidad de lotes que ese productor le mandó a este nodo);
+    recién entonces llama a `on_complete(client_id)`, una sola vez.
+
+    Los FIN se reconocen por su productor: un FIN reentregado no cuenta dos
+    veces. Los FIN sin productor (de nodos viejos) cuentan cada uno como uno
+    distinto. Con `fault_manager` los FIN recibidos sobreviven un reinicio,
+    y también los lotes contados con su packet_id: un lote reentregado
+    después de la caída no se cuenta dos veces.
+
+    De los clientes completados se recuerdan los últimos `completed_window`,
+    para ignorar un FIN reentregado después de mandar el resultado; los más
+    viejos se olvidan.
+
+    Se usa desde el hilo que consume del Middleware, como el resto del estado
+    del nodo.
+    """
+
+    def __init__(
+        self,
+        producers: int,
+        on_complete: Callable,
+        count_batches: bool = False,
+        fault_manager: FaultManager = None,
+        key: str = "eof_barrier",
+        completed_window: int = COMPLETED_WINDOW,
+    ):
+        self.producers = producers
+        self.on_complete = on_complete
+        self.count_batches = count_batches
+        self.fault_manager = fault_manager
+        self.key = key
+        self.clients: dict[str, ClientBarrier] = {}
+        self.completed_window = completed_window
+        self.completed: OrderedDict[str, None] = OrderedDict()
+        self.init_state()
+
+    def batch_received(self, client_id, count: int = 1, packet_id: str = None) -> bool:
+        """
+        Registra `count` lotes recibidos del cliente, o el lote `packet_id`
+        si se indica (una sola vez). Devuelve True si con ellos se completó
+        la barrera.
+        """
+        client_id = str(client_id)
+        if client_id in self.completed:
+            return False
+        barrier = self._client(client_id)
+        if packet_id is not None:
+            if packet_id in barrier.packets:
+                return False
+            barrier.packets.add(packet_id)
+            if self.fault_manager is not None:
+                self.fault_manager.append(self._batches_key(client_id), packet_id)
+        barrier.received += count
+        return self._check(client_id)
+
+    def fin_received(self, fin: Fin) -> bool:
+        """
+        Registra el FIN de un productor. Devuelve True si con él se
+        completó la barrera.
+        """
+        client_id = str(fin.client_id)
+        if client_id in self.completed:
+            logging.info(f"FIN repetido para el cliente {client_id}, la barrera ya se completó")
+            return False
+        barrier = self._client(client_id)
+        producer = fin.producer or f"#{len(barrier.fins)}"
+        if producer not in barrier.fins:
+            barrier.fins[producer] = int(fin.batch_id) if self.count_batches else 0
+            if self.fault_manager is not None:
+                self.fault_manager.update(f"{self.key}_{client_id}", json.dumps(barrier.fins))
+        logging.info(f"FIN de {producer} para el cliente {client_id}: {len(barrier.fins)}/{self.producers}")
+        return self._check(client_id)
+
+    def is_complete(self, client_id) -> bool:
+        return str(client_id) in self.completed
+
+    def forget(self, client_id):
+        client_id = str(client_id)
+        self.completed.pop(client_id, None)
+        barrier = self.clients.pop(client_id, None)
+        if barrier is not None:
+            self._delete_state(client_id, barrier)
+
+    def _batches_key(self, client_id: str) -> str:
+        return f"{self.key}.batches_{client_id}"
+
+    def _delete_state(self, client_id: str, barrier: ClientBarrier):
+        if self.fault_manager is None:
+            return
+        if barrier.fins:
+            self.fault_manager.delete_key(f"{self.key}_{client_id}")
+        if barrier.packets:
+            self.fault_manager.delete_key(self._batches_key(client_id))
+
+    def _client(self, client_id: str) -> ClientBarrier:
+        if client_id not in self.clients:
+            self.clients[client_id] = ClientBarrier()
+        return self.clients[client_id]
+
+    def _check(self, client_id: str) -> bool:
+        barrier = self.clients[client_id]
+        if len(barrier.fins) < self.producers:
+            return False
+        if self.count_batches and barrier.received < barrier.expected_batches():
+            return False
+        self.completed[client_id] = None
+        if len(self.completed) > self.completed_window:
+            self.completed.popitem(last=False)
+        self.on_complete(client_id)
+        # Se borra después del callback: si el nodo se cae en el medio, el
+        # FIN sin ack se reentrega y la barrera se vuelve a completar
+        del self.clients[client_id]
+        self._delete_state(client_id, barrier)
+        return True
+
+    def init_state(self):
+        if self.fault_manager is None:
+            return
+        for key in self.fault_manager.get_keys(f"{self.key}_"):
+            state = self.fault_manager.get(key)
+            if not state:
+                continue
+            client_id = key[len(self.key) + 1:]
+            self.clients[client_id] = ClientBarrier(json.loads(state))
+            logging.info(f"Barrera del cliente {client_id} restaurada: {len(self.clients[client_id].fins)} FIN")
+        prefix = self._batches_key("")
+        for key in self.fault_manager.get_keys(prefix):
+            state = self.fault_manager.get(key)
+            if not state:
+                continue
+            client_id = key[len(prefix):]
+            barrier = self._client(client_id)
+            barrier.packets.update(packet_id for packet_id in state.split("\n") if packet_id)
+            barrier.received = len(barrier.packets)
+            logging.info(f"Barrera del cliente {client_id}: {barrier.received} lotes restaurados")
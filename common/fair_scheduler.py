@@ -0,0 +1,77 @@
+from collections import deque
+
+
+class FairScheduler:
+    """
+    Round-robin ponderado entre los clientes con entregas pendientes. Cada
+    cliente tiene su propia fila (se respeta el orden de sus mensajes, así
+    su FIN sale después de sus lotes) y en cada turno se le atienden hasta
+    `weight` entregas antes de pasar al siguiente.
+
+    Un cliente con poco volumen espera a lo sumo un turno de cada uno de los
+    demás, en lugar de todo lo que haya llegado antes que él.
+    """
+
+    def __init__(self, weights: dict = None, default_weight: int = 1):
+        self.weights = {str(client_id): max(1, int(weight)) for client_id, weight in (weights or {}).items()}
+        self.default_weight = max(1, default_weight)
+        self.lanes: dict[str, deque] = {}
+        self.turns: deque = deque()  # clientes activos, el primero es el del turno
+        self.served = 0  # entregas atendidas en el turno actual
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def weight(self, client_id: str) -> int:
+        return self.weights.get(client_id, self.default_weight)
+
+    def push(self, client_id, item):
+        client_id = str(client_id)
+        lane = self.lanes.get(client_id)
+        if lane is None:
+            lane = deque()
+            self.lanes[client_id] = lane
+            self.turns.append(client_id)
+        lane.append(item)
+        self.size += 1
+
+    def pop(self):
+        """
+        Próxima entrega a procesar, o None si no hay ninguna.
+        """
+        if not self.turns:
+            return None
+        client_id = self.turns[0]
+        lane = self.lanes[client_id]
+        item = lane.popleft()
+        self.size -= 1
+        self.served += 1
+        if not lane:
+            del self.lanes[client_id]
+            self.turns.popleft()
+            self.served = 0
+        elif self.served >= self.weight(client_id):
+            self.turns.rotate(-1)
+            self.served = 0
+        return item
+
+    def drop(self, client_id) -> list:
+        """
+        Saca y devuelve todas las entregas pendientes de un cliente.
+        """
+        client_id = str(client_id)
+        lane = self.lanes.pop(client_id, None)
+        if lane is None:
+            return []
+        if self.turns[0] == client_id:
+            self.served = 0
+        self.turns.remove(client_id)
+        self.size -= len(lane)
+        return list(lane)
+
+    def clear(self):
+        self.lanes = {}
+        self.turns.clear()
+        self.served = 0
+        self.size = 0
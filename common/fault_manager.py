@@ -5,6 +5,8 @@ import uuid
 import threading
 from typing import Any, List, Optional, Dict
 import logging
+import time
+from common import metrics
 
 #TRANSLATOR_FILE = "translator.json"
 #TRANSLATOR_LOCK = threading.Lock()
@@ -25,6 +27,10 @@ class FaultManager:
         self._keys_index: dict[str, dict[str, str]] = {}
         self.locks = {}  # Diccionario para mantener los bloqueos por archivo
         self.locks_lock = threading.Lock()  # Lock para el diccionario de locks
+        self._dirty_paths: set[str] = set()  # Archivos escritos desde el último sync
+        # Protege _keys_index y el archivo de índice: el nodo y el Middleware
+        # pueden usar el mismo FaultManager desde hilos distintos
+        self.index_lock = threading.RLock()
         
         self.init_state()
         
@@ -84,6 +90,8 @@ class FaultManager:
                     f.write(final_data)
                     f.flush()
                     #os.fsync(f.fileno())
+                with self.locks_lock:
+                    self._dirty_paths.add(path)
             except Exception as e:
                 logging.error(f"Error appending to {path}: {e}")
                 
@@ -98,11 +106,16 @@ class FaultManager:
     #         fcntl.flock(persistent_file, fcntl.LOCK_UN)            
                 
     def append(self, key: str, value: str):
+        if metrics.ENABLED:
+            start = time.perf_counter()
         try:
             path = f'{self.storage_dir}/{self._get_internal_key(key)}'
             self._append(path, value)
         except Exception as e:
             logging.error(f"Error appending value: {value} for key: {key}: {e}")
+        if metrics.ENABLED:
+            metrics.registry.observe("fault_manager_seconds", time.perf_counter() - start, op="append")
+            metrics.registry.increment("fault_manager_bytes", len(value), op="append")
 
     def _write(self, path: str, data: str):
         lock = self._get_lock(path)
@@ -119,55 +132,99 @@ class FaultManager:
                     f.flush()
                     #os.fsync(f.fileno())
                 os.replace(temp_path, path)
+                with self.locks_lock:
+                    self._dirty_paths.add(path)
             except Exception as e:
                 logging.error(f"Error writing to {path}: {e}")
                 if os.path.exists(temp_path):
                     os.remove(temp_path)
 
 
+    def sync(self):
+        """
+        Hace fsync de los archivos escritos desde la última llamada, para
+        amortizar el costo entre varias escrituras.
+        """
+        if metrics.ENABLED:
+            with metrics.registry.timer("fault_manager_seconds", op="sync"):
+                self._sync()
+        else:
+            self._sync()
+
+    def _sync(self):
+        with self.locks_lock:
+            paths = self._dirty_paths
+            self._dirty_paths = set()
+        for path in paths:
+            lock = self._get_lock(path)
+            with lock:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    logging.error(f"Error syncing {path}: {e}")
+
     def _get_internal_key(self, key: str) -> str:
-        internal_key = self._keys_index.get(key)
-        if internal_key is None:
-            logging.info(f"Generating internal key for key: {key}")
-            internal_key = str(uuid.uuid4())
-            self._keys_index[key] = internal_key
-            self._append(f'{self.storage_dir}/{self.key_index_prefix}',
-                         json.dumps([key, internal_key]))
-        return internal_key
+        with self.index_lock:
+            internal_key = self._keys_index.get(key)
+            if internal_key is None:
+                logging.info(f"Generating internal key for key: {key}")
+                internal_key = str(uuid.uuid4())
+                self._keys_index[key] = internal_key
+                self._append(f'{self.storage_dir}/{self.key_index_prefix}',
+                             json.dumps([key, internal_key]))
+            return internal_key
+
 
+    def discard(self, key: str):
+        """
+        Borra la clave solo si existe: delete_key sobre una clave que no
+        existe la agrega al índice.
+        """
+        with self.index_lock:
+            if key in self._keys_index:
+                self.delete_key(key)
 
     def delete_key(self, key: str):
-        try:
-            path = f'{self.storage_dir}/{self._get_internal_key(key)}'
-            os.remove(path)
-            self._keys_index.pop(key)
-            logging.info(f"Key deleted: {key}")
-            
-            updated_keys = [json.dumps([k, v]) for k, v in self._keys_index.items()]
-            if len(updated_keys) == 0:
-                logging.info(f"No keys left. Deleting keys index file.")
-                os.remove(f'{self.storage_dir}/{self.key_index_prefix}')
-            else:
-                logging.info(f"Updating keys index file.")
-                temp_path = f'{self.storage_dir}/{self.key_index_prefix}_{AUX_FILE}'
-                with open(temp_path, 'wb') as f:
-                    for item in updated_keys:
-                        data = item.encode()
-                        length = len(data)
-                        length_bytes = struct.pack('>I', length)
-                        final_data = length_bytes + data + SEPARATOR
-                        f.write(final_data)
-                    f.flush()
-                    #os.fsync(f.fileno())
-                os.replace(temp_path, f'{self.storage_dir}/{self.key_index_prefix}')
-        except Exception as e:
-            logging.error(f"Error deleting key: {key}: {e}")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        temp_path = f'{self.storage_dir}/{self.key_index_prefix}_{AUX_FILE}'
+        # Con el lock tomado no se agregan claves mientras se reescribe el índice
+        with self.index_lock:
+            try:
+                path = f'{self.storage_dir}/{self._get_internal_key(key)}'
+                os.remove(path)
+                self._keys_index.pop(key)
+                logging.info(f"Key deleted: {key}")
+
+                updated_keys = [json.dumps([k, v]) for k, v in self._keys_index.items()]
+                if len(updated_keys) == 0:
+                    logging.info(f"No keys left. Deleting keys index file.")
+                    os.remove(f'{self.storage_dir}/{self.key_index_prefix}')
+                else:
+                    logging.info(f"Updating keys index file.")
+                    with open(temp_path, 'wb') as f:
+                        for item in updated_keys:
+                            data = item.encode()
+                            length = len(data)
+                            length_bytes = struct.pack('>I', length)
+                            final_data = length_bytes + data + SEPARATOR
+                            f.write(final_data)
+                        f.flush()
+                        #os.fsync(f.fileno())
+                    os.replace(temp_path, f'{self.storage_dir}/{self.key_index_prefix}')
+            except Exception as e:
+                logging.error(f"Error deleting key: {key}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
 
 
     def get_keys(self, prefix: str) -> List[str]:
-        keys = [key for key in self._keys_index.keys() if key.startswith(prefix)]
+        with self.index_lock:
+            keys = [key for key in self._keys_index.keys() if key.startswith(prefix)]
         logging.info(f"Keys found with prefix '{prefix}': {keys}")
         return keys
 
@@ -208,8 +265,13 @@ class FaultManager:
                 return None
 
     def update(self, key: str, value: str):
+        if metrics.ENABLED:
+            start = time.perf_counter()
         try:
             path = f'{self.storage_dir}/{self._get_internal_key(key)}'
             self._write(path, value)
         except Exception as e:
             logging.error(f"Error updating key: {key}: {e}")
+        if metrics.ENABLED:
+            metrics.registry.observe("fault_manager_seconds", time.perf_counter() - start, op="update")
+            metrics.registry.increment("fault_manager_bytes", len(value), op="update")
@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import threading
+from common.middleware import Middleware
+
+# Exchange fanout por el que los acumuladores avisan las claves ya resueltas
+RESOLVED_KEYS_EXCHANGE = "resolved_keys"
+# Con "false" los filtros no escuchan los avisos y procesan todas las filas
+RESOLVED_KEYS_FEEDBACK = os.getenv("RESOLVED_KEYS_FEEDBACK", "true").lower() == "true"
+
+
+def resolved_notice(client_id, keys: list = None, done: bool = False) -> str:
+    """
+    Aviso de claves resueltas de un cliente; `done` indica que el cliente
+    terminó (o se canceló) y los filtros pueden olvidarlo.
+    """
+    return json.dumps({"resolved_keys": {"client_id": str(client_id), "keys": [str(k) for k in keys or []], "done": done}})
+
+
+class ResolvedKeys:
+    """
+    Claves ya resueltas por cliente (p. ej. juegos que ya superaron el
+    límite de reseñas) según los avisos de un nodo de más abajo. Un filtro
+    de más arriba las consulta para no procesar ni mandar filas que ya no
+    cambian el resultado: el acumulador las descartaría igual.
+
+    Se actualiza desde el hilo del listener y se lee desde el del nodo;
+    cada cliente tiene un frozenset que se reemplaza entero, así la lectura
+    no necesita lock y el set se puede mandar a un worker.
+    """
+
+    def __init__(self):
+        self.keys: dict[str, frozenset] = {}
+        self.lock = threading.Lock()
+
+    def resolved(self, client_id) -> frozenset:
+        return self.keys.get(str(client_id), frozenset())
+
+    def apply(self, data: str):
+        notice = json.loads(data)["resolved_keys"]
+        client_id = notice["client_id"]
+        with self.lock:
+            if notice["done"]:
+                self.keys.pop(client_id, None)
+                return
+            self.keys[client_id] = self.resolved(client_id) | frozenset(notice["keys"])
+        logging.info(f"Claves resueltas del cliente {client_id}: {len(self.keys[client_id])}")
+
+    def listen(self, queue: str, instance_id=0) -> threading.Thread:
+        """
+        Consume los avisos en un hilo con su propia conexión. Cada filtro
+        usa su propia cola, atada al exchange fanout.
+        """
+        def consume():
+            middleware = Middleware(
+                input_queues={queue: RESOLVED_KEYS_EXCHANGE},
+                intance_id=instance_id,
+                callback=self.apply,
+                eofCallback=lambda _: None,
+            )
+            middleware.start()
+
+        thread = threading.Thread(target=consume, name="resolved_keys_listener", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from typing import Callable
+import pika
+from common import metrics
+
+# Cada cuánto se consulta el largo de las colas observadas (segundos)
+FLOW_CHECK_INTERVAL = 0.5
+
+
+class QueueProbe:
+    """
+    Largo de colas (mensajes listos sin entregar) medido con
+    `queue_declare(passive=True)` sobre un canal propio, porque un 404 del
+    declare pasivo cierra el canal.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = None
+
+    def depth(self, queue: str) -> int:
+        try:
+            if self.channel is None or not self.channel.is_open:
+                self.channel = self.connection.channel()
+            frame = self.channel.queue_declare(queue=queue, passive=True)
+            return frame.method.message_count
+        except pika.exceptions.AMQPChannelError:
+            # La cola todavía no fue creada por su consumidor
+            self.channel = None
+            return 0
+
+
+class FlowController:
+    """
+    Control de flujo por créditos de los publicadores: el crédito es el
+    espacio que queda en las colas de los consumidores lentos, medido con
+    `queue_declare(passive=True)` (mensajes listos sin entregar) y
+    descontado en cada publicación hasta la próxima medición.
+
+    Cuando alguna cola observada supera `high_watermark` las publicaciones
+    se bloquean hasta que todas bajan de `low_watermark`. La histéresis
+    evita que el publicador alterne entre frenar y publicar en cada lote.
+    """
+
+    def __init__(
+        self,
+        connection,
+        queues: list[str],
+        high_watermark: int,
+        low_watermark: int,
+        check_interval: float = FLOW_CHECK_INTERVAL,
+        pump: Callable = None,
+    ):
+        self.probe = QueueProbe(connection)
+        self.queues = list(queues)
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.check_interval = check_interval
+        # Atiende la conexión mientras se espera (heartbeats); sin él se duerme
+        self.pump = pump
+        self.last_check = 0.0
+        self.credits = 0
+
+    def lag(self) -> int:
+        """
+        Mayor cantidad de mensajes encolados entre las colas observadas.
+        """
+        return max((self.probe.depth(queue) for queue in self.queues), default=0)
+
+    def acquire(self, stop_event: threading.Event = None) -> bool:
+        """
+        Llamado antes de cada publicación. Cada consulta otorga tantos
+        créditos como lugar quede bajo `high_watermark`; sin créditos (o
+        pasado `check_interval`) se vuelve a medir y, si las colas están
+        llenas, se bloquea hasta que se vacíen. Devuelve False, sin crédito,
+        si `stop_event` se activa mientras espera.
+        """
+        now = time.monotonic()
+        if self.credits > 0 and now - self.last_check < self.check_interval:
+            self.credits -= 1
+            return True
+        lag = self.lag()
+        if lag >= self.high_watermark:
+            lag = self._wait_for_drain(lag, stop_event)
+            if lag is None:
+                return False
+        self.last_check = time.monotonic()
+        self.credits = self.high_watermark - lag - 1
+        return True
+
+    def _wait_for_drain(self, lag: int, stop_event: threading.Event = None):
+        logging.info(f"Backpressure: {lag} mensajes encolados aguas abajo, pausando publicaciones")
+        start = time.monotonic()
+        while lag > self.low_watermark:
+            if stop_event is not None and stop_event.is_set():
+                logging.info("Backpressure: espera interrumpida, el publicador se detiene")
+                return None
+            self._wait()
+            lag = self.lag()
+        waited = time.monotonic() - start
+        logging.info(f"Backpressure: reanudando publicaciones tras {waited:.2f}s")
+        if metrics.ENABLED:
+            metrics.registry.observe("flow_wait_seconds", waited)
+            metrics.registry.increment("flow_pauses_total")
+        return lag
+
+    def _wait(self):
+        if self.pump is not None:
+            self.pump(time_limit=self.check_interval)
+        else:
+            time.sleep(self.check_interval)
@@ -1,5 +1,11 @@
 from common.packet import Packet
 
+# Posición de cada campo en getData(), para leer columnas de un lote
+GAME_REVIEW_GAME_ID_FIELD = 0
+GAME_REVIEW_GAME_NAME_FIELD = 1
+GAME_REVIEW_TEXT_FIELD = 2
+GAME_REVIEW_CLIENT_ID_FIELD = 3
+
 
 class GameReview(Packet):
     def __init__(self, game_id, game_name, review_text, client_id):
@@ -1,6 +1,8 @@
+import json
 import socket
 import logging
 import threading
+from common import metrics
 
 HEALTH_CHECK_PORT = 7777
 
@@ -17,7 +19,12 @@ class HealthCheckServer:
             try:
                 client_socket, addr = self.socket.accept()
                 logging.info(f"Health check request from {addr}.")
-                client_socket.recv(1)
+                request = client_socket.recv(1)
+
+                if request == metrics.METRICS_REQUEST:
+                    self._send_metrics(client_socket)
+                    client_socket.close()
+                    continue
 
                 are_alive = [t.is_alive() for t in self.threads_to_check]
                 print(are_alive)
@@ -31,6 +38,10 @@ class HealthCheckServer:
             except Exception as e:
                 logging.error(f"Error handling health check request: {e}")
 
+    def _send_metrics(self, client_socket):
+        payload = json.dumps(metrics.registry.snapshot()).encode("utf-8")
+        client_socket.sendall(len(payload).to_bytes(4, byteorder="big") + payload)
+
     def start_in_thread(self):
         thread = threading.Thread(target=self.start)
         thread.start()
@@ -0,0 +1,71 @@
+import logging
+import os
+import random
+import time
+from typing import Callable
+import pika
+from common import metrics
+from common.flow_control import QueueProbe
+
+# Cada cuánto se vuelve a medir el largo de las colas destino (segundos)
+ROUTING_REFRESH_INTERVAL = float(os.getenv("ROUTING_REFRESH_INTERVAL", "0.5"))
+
+
+class LoadAwareRouter:
+    """
+    Elige la cola destino de cada lote entre instancias equivalentes con
+    "power of two choices": toma dos colas al azar y se queda con la de
+    menor carga estimada. Comparar solo dos evita las instancias atrasadas
+    sin que todos los lotes persigan a la más vacía.
+
+    La carga de una cola es su largo medido más lo que se le mandó desde la
+    última medición, así una ráfaga entre mediciones no va toda al mismo
+    destino.
+    """
+
+    def __init__(
+        self,
+        connection_of: Callable,
+        queues: list[str],
+        refresh_interval: float = ROUTING_REFRESH_INTERVAL,
+        rng: random.Random = None,
+    ):
+        # La conexión se pide en cada medición: cambia si el Middleware reconecta
+        self.connection_of = connection_of
+        self.queues = list(queues)
+        self.refresh_interval = refresh_interval
+        self.rng = rng or random.Random()
+        self.probe: QueueProbe = None
+        self.measured = {queue: 0 for queue in self.queues}
+        self.sent = {queue: 0 for queue in self.queues}
+        self.last_refresh = 0.0
+
+    def load(self, queue: str) -> int:
+        return self.measured[queue] + self.sent[queue]
+
+    def choose(self) -> str:
+        self._refresh()
+        if len(self.queues) == 1:
+            queue = self.queues[0]
+        else:
+            first, second = self.rng.sample(self.queues, 2)
+            queue = first if self.load(first) <= self.load(second) else second
+        self.sent[queue] += 1
+        if metrics.ENABLED:
+            metrics.registry.increment("routed_batches_total", queue=queue)
+        return queue
+
+    def _refresh(self):
+        if time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+        connection = self.connection_of()
+        if self.probe is None or self.probe.connection is not connection:
+            self.probe = QueueProbe(connection)
+        try:
+            for queue in self.queues:
+                self.measured[queue] = self.probe.depth(queue)
+                self.sent[queue] = 0
+        except pika.exceptions.AMQPError as e:
+            # Se sigue con la última estimación; el Middleware se ocupa de la conexión
+            logging.warning(f"No se pudo medir el largo de las colas destino: {e}")
+        self.last_refresh = time.monotonic()
@@ -0,0 +1,392 @@
+import itertools
+import threading
+import weakref
+from collections import deque
+from typing import Callable, Optional
+import pika
+from common.select_engine import QueuedEventsConnection, DELIVERY, CONTROL, CLOSED, STOP
+
+FANOUT = "fanout"
+DIRECT = "direct"
+# Routing key de binding que recibe todo lo publicado en el exchange (como "#" en un topic)
+MATCH_ALL = "#"
+
+
+class MemoryQueue:
+    """
+    Cola del broker en memoria. Los mensajes se guardan como
+    (exchange, routing_key, body, properties, redelivered, origin).
+    """
+
+    def __init__(self, name: str, durable: bool):
+        self.name = name
+        self.durable = durable
+        self.messages: deque = deque()
+        self.consumers: list = []  # (channel, consumer_tag, callback, auto_ack)
+        self.next_consumer = 0
+
+
+class MemoryBroker:
+    """
+    Broker en memoria que emula lo que el sistema usa de RabbitMQ:
+    exchanges fanout y direct (más el exchange por defecto), colas, acks,
+    prefetch y reentrega de los mensajes sin ack al cerrar un canal.
+
+    Todas las conexiones del proceso comparten la instancia de `instance()`,
+    así que los nodos pueden correr como hilos de un mismo proceso.
+
+    Un mensaje puede llevar un `origin`: la entrega externa más vieja de la
+    que puede depender (ver common/colocation.py). Lo que publica una
+    conexión hereda el menor origin de lo que esa conexión tiene sin ack.
+    `low_watermark()` es el menor origin todavía vivo (encolado o sin ack).
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.exchanges: dict[str, tuple] = {}  # nombre -> (tipo, set de (cola, routing_key))
+        self.queues: dict[str, MemoryQueue] = {}
+        self.consumer_tags = itertools.count(1)
+        self.queue_names = itertools.count(1)
+        self.channels = weakref.WeakSet()
+        self.live_origins: dict[int, int] = {}  # origin -> mensajes vivos que lo llevan
+
+    @classmethod
+    def instance(cls) -> "MemoryBroker":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = MemoryBroker()
+            return cls._instance
+
+    def exchange_declare(self, exchange: str, exchange_type: str, passive: bool = False):
+        with self.lock:
+            if exchange in self.exchanges:
+                return
+            if passive:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+            if exchange_type not in (FANOUT, DIRECT):
+                raise ValueError(f"Exchange type not supported in memory: {exchange_type}")
+            self.exchanges[exchange] = (exchange_type, set())
+
+    def queue_declare(self, queue: str, passive: bool = False, durable: bool = False) -> MemoryQueue:
+        with self.lock:
+            if not queue:
+                queue = f"amq.gen-{next(self.queue_names)}"
+            memory_queue = self.queues.get(queue)
+            if memory_queue is None:
+                if passive:
+                    raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+                memory_queue = MemoryQueue(queue, durable)
+                self.queues[queue] = memory_queue
+            return memory_queue
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: Optional[str] = None):
+        with self.lock:
+            if exchange not in self.exchanges:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+            if queue not in self.queues:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+            # Igual que pika: sin routing key se usa el nombre de la cola
+            self.exchanges[exchange][1].add((queue, queue if routing_key is None else routing_key))
+
+    def queue_purge(self, queue: str) -> int:
+        with self.lock:
+            memory_queue = self.queues[queue]
+            count = len(memory_queue.messages)
+            for message in memory_queue.messages:
+                self.release(message)
+            memory_queue.messages.clear()
+            return count
+
+    def queue_delete(self, queue: str):
+        with self.lock:
+            memory_queue = self.queues.pop(queue, None)
+            if memory_queue is not None:
+                for message in memory_queue.messages:
+                    self.release(message)
+            for _, bindings in self.exchanges.values():
+                for binding in [b for b in bindings if b[0] == queue]:
+                    bindings.discard(binding)
+
+    def publish(self, exchange: str, routing_key: str, body, properties, origin: Optional[int] = None):
+        with self.lock:
+            for memory_queue in self._route(exchange, routing_key):
+                if origin is not None:
+                    self.live_origins[origin] = self.live_origins.get(origin, 0) + 1
+                memory_queue.messages.append((exchange, routing_key, body, properties, False, origin))
+                self._dispatch(memory_queue)
+
+    def release(self, message: tuple):
+        """
+        El mensaje dejó de estar vivo: se confirmó o se descartó.
+        """
+        origin = message[5]
+        if origin is None:
+            return
+        with self.lock:
+            count = self.live_origins[origin] - 1
+            if count:
+                self.live_origins[origin] = count
+            else:
+                del self.live_origins[origin]
+
+    def low_watermark(self) -> Optional[int]:
+        """
+        Menor origin de los mensajes vivos; None si no queda ninguno.
+        """
+        with self.lock:
+            return min(self.live_origins) if self.live_origins else None
+
+    def _route(self, exchange: str, routing_key: str) -> list:
+        if exchange == "":
+            memory_queue = self.queues.get(routing_key)
+            return [memory_queue] if memory_queue is not None else []
+        if exchange not in self.exchanges:
+            raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+        exchange_type, bindings = self.exchanges[exchange]
+        names = {
+            queue for queue, key in bindings
+            if exchange_type == FANOUT or key == routing_key or key == MATCH_ALL
+        }
+        # Los mensajes que no matchean ninguna cola se descartan, como en RabbitMQ
+        return [self.queues[name] for name in sorted(names) if name in self.queues]
+
+    def consume(self, queue: str, channel: "MemoryEngineChannel", callback: Callable, auto_ack: bool) -> str:
+        with self.lock:
+            if queue not in self.queues:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+            consumer_tag = f"ctag-{next(self.consumer_tags)}"
+            self.queues[queue].consumers.append((channel, consumer_tag, callback, auto_ack))
+            self._dispatch(self.queues[queue])
+            return consumer_tag
+
+    def cancel(self, consumer_tag: str):
+        with self.lock:
+            for memory_queue in self.queues.values():
+                memory_queue.consumers = [c for c in memory_queue.consumers if c[1] != consumer_tag]
+
+    def requeue(self, queue: str, message: tuple):
+        """
+        Devuelve un mensaje sin ack al frente de su cola, marcado como reentregado.
+        """
+        with self.lock:
+            memory_queue = self.queues.get(queue)
+            if memory_queue is None:
+                self.release(message)
+                return
+            exchange, routing_key, body, properties, _, origin = message
+            memory_queue.messages.appendleft((exchange, routing_key, body, properties, True, origin))
+
+    def idle(self) -> bool:
+        """
+        True si no quedan mensajes encolados ni entregas sin ack: todo lo
+        publicado en el broker terminó de procesarse.
+        """
+        with self.lock:
+            return not any(q.messages for q in self.queues.values()) and not any(
+                channel.unacked for channel in list(self.channels)
+            )
+
+    def dispatch_all(self):
+        with self.lock:
+            for memory_queue in self.queues.values():
+                self._dispatch(memory_queue)
+
+    def _dispatch(self, memory_queue: MemoryQueue):
+        # Reparte round-robin entre los consumidores con lugar en su prefetch
+        while memory_queue.messages and memory_queue.consumers:
+            consumers = memory_queue.consumers
+            for offset in range(len(consumers)):
+                index = (memory_queue.next_consumer + offset) % len(consumers)
+                channel, consumer_tag, callback, auto_ack = consumers[index]
+                if auto_ack or channel.has_room():
+                    break
+            else:
+                return
+            memory_queue.next_consumer = (index + 1) % len(consumers)
+            channel.deliver(memory_queue.name, consumer_tag, callback, memory_queue.messages.popleft(), auto_ack)
+
+
+class MemoryEngineConnection(QueuedEventsConnection):
+    """
+    Conexión al broker en memoria con la interfaz de BlockingConnection que
+    usa el Middleware. Sirve para correr el pipeline entero en un proceso,
+    sin RabbitMQ, para benchmarks y profiling.
+    """
+
+    def __init__(self, broker: MemoryBroker = None):
+        super().__init__()
+        self.broker = broker or MemoryBroker.instance()
+        self.channels: list["MemoryEngineChannel"] = []
+        self.closed = False
+        self.channel_numbers = itertools.count(1)
+
+    @property
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def channel(self) -> "MemoryEngineChannel":
+        channel = MemoryEngineChannel(self, next(self.channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    def origin(self) -> Optional[int]:
+        """
+        Origin de lo que publica esta conexión: el menor entre sus entregas sin ack.
+        """
+        with self.broker.lock:
+            if not self.broker.live_origins:
+                return None
+            origins = [
+                message[5] for channel in self.channels
+                for _, message in channel.unacked.values() if message[5] is not None
+            ]
+            return min(origins) if origins else None
+
+    def call_later(self, delay: float, callback: Callable):
+        timer = threading.Timer(delay, lambda: self.events.put((CONTROL, callback)))
+        timer.daemon = True
+        timer.start()
+
+    def close(self):
+        if self.closed:
+            return
+        for channel in self.channels:
+            channel.close()
+        self.closed = True
+        self.events.put((CLOSED, pika.exceptions.ConnectionClosedByClient(200, "Normal shutdown")))
+
+
+class MemoryEngineChannel:
+    """
+    Canal del broker en memoria con la interfaz de BlockingChannel que usa
+    el Middleware.
+    """
+
+    def __init__(self, connection: MemoryEngineConnection, channel_number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.prefetch_count = 0
+        self.next_delivery_tag = 1
+        self.unacked: dict[int, tuple] = {}  # delivery_tag -> (cola, mensaje)
+        self.consumer_tags: list[str] = []
+        self.confirm_callback: Callable = None
+        self.next_publish_seq = 1
+        self.is_open = True
+        with self.broker.lock:
+            self.broker.channels.add(self)
+
+    def has_room(self) -> bool:
+        return self.is_open and (self.prefetch_count == 0 or len(self.unacked) < self.prefetch_count)
+
+    def basic_qos(self, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False, auto_delete=False, arguments=None):
+        memory_queue = self.broker.queue_declare(queue, passive=passive, durable=durable)
+        with self.broker.lock:
+            method = pika.spec.Queue.DeclareOk(
+                queue=memory_queue.name,
+                message_count=len(memory_queue.messages),
+                consumer_count=len(memory_queue.consumers),
+            )
+        return pika.frame.Method(self.channel_number, method)
+
+    def exchange_declare(self, exchange, exchange_type="direct", passive=False, durable=False):
+        self.broker.exchange_declare(exchange, exchange_type, passive=passive)
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self.broker.queue_bind(queue, exchange, routing_key)
+
+    def queue_purge(self, queue):
+        return self.broker.queue_purge(queue)
+
+    def queue_delete(self, queue):
+        self.broker.queue_delete(queue)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        consumer_tag = self.broker.consume(queue, self, on_message_callback, auto_ack)
+        self.consumer_tags.append(consumer_tag)
+        return consumer_tag
+
+    def deliver(self, queue: str, consumer_tag: str, callback: Callable, message: tuple, auto_ack: bool):
+        # Se llama con el lock del broker tomado
+        exchange, routing_key, body, properties, redelivered, _ = message
+        delivery_tag = self.next_delivery_tag
+        self.next_delivery_tag += 1
+        if auto_ack:
+            self.broker.release(message)
+        else:
+            self.unacked[delivery_tag] = (queue, message)
+        method = pika.spec.Basic.Deliver(
+            consumer_tag=consumer_tag,
+            delivery_tag=delivery_tag,
+            redelivered=redelivered,
+            exchange=exchange,
+            routing_key=routing_key,
+        )
+        self.connection.events.put((DELIVERY, lambda: callback(self, method, properties, body)))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.broker.publish(exchange, routing_key, body, properties or pika.BasicProperties(), self.connection.origin())
+        if self.confirm_callback is not None:
+            frame = pika.frame.Method(self.channel_number, pika.spec.Basic.Ack(delivery_tag=self.next_publish_seq))
+            self.next_publish_seq += 1
+            self.connection.events.put((CONTROL, lambda: self.confirm_callback(frame)))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        with self.broker.lock:
+            for tag in self._tags(delivery_tag, multiple):
+                self.broker.release(self.unacked.pop(tag)[1])
+            self.broker.dispatch_all()
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        with self.broker.lock:
+            for tag in reversed(self._tags(delivery_tag, multiple)):
+                queue, message = self.unacked.pop(tag)
+                if requeue:
+                    self.broker.requeue(queue, message)
+                else:
+                    self.broker.release(message)
+            self.broker.dispatch_all()
+
+    def _tags(self, delivery_tag, multiple) -> list:
+        if multiple:
+            return sorted(tag for tag in self.unacked if delivery_tag == 0 or tag <= delivery_tag)
+        return [delivery_tag] if delivery_tag in self.unacked else []
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self.confirm_callback = ack_nack_callback
+        if callback is not None:
+            callback(None)
+
+    def wait_until(self, predicate: Callable):
+        self.connection.wait_until(predicate)
+
+    def start_consuming(self):
+        self.connection.consume_events()
+
+    def stop_consuming(self):
+        for consumer_tag in self.consumer_tags:
+            self.broker.cancel(consumer_tag)
+        self.consumer_tags = []
+        self.connection.events.put((STOP, None))
+
+    def close(self):
+        if not self.is_open:
+            return
+        with self.broker.lock:
+            for consumer_tag in self.consumer_tags:
+                self.broker.cancel(consumer_tag)
+            self.consumer_tags = []
+            self.is_open = False
+            # Lo que quedó sin ack vuelve a su cola, en el orden original
+            for tag in sorted(self.unacked, reverse=True):
+                queue, message = self.unacked.pop(tag)
+                self.broker.requeue(queue, message)
+            self.broker.dispatch_all()
@@ -0,0 +1,138 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Con las métricas desactivadas los puntos de medición solo chequean este flag
+ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# Límites superiores de los buckets de los histogramas (segundos): 50us a ~6.5s
+BUCKETS = [0.00005 * 2 ** i for i in range(18)]
+
+# Byte que pide las métricas en el puerto del health check
+METRICS_REQUEST = b"M"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimación del cuantil `q` por el límite superior de su bucket.
+        """
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                (f"{BUCKETS[i]:g}" if i < len(BUCKETS) else "+Inf"): count
+                for i, count in enumerate(self.counts) if count
+            },
+        }
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas del nodo, identificados por nombre y labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": ENABLED,
+                "uptime_seconds": time.time() - self.started,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+
+registry = MetricsRegistry()
+
+
+def fetch(host: str, port: int) -> dict:
+    """
+    Pide las métricas de un nodo por el puerto del health check.
+    """
+    with socket.create_connection((host, port), timeout=5) as s:
+        s.sendall(METRICS_REQUEST)
+        length = int.from_bytes(_recv_exactly(s, 4), byteorder="big")
+        return json.loads(_recv_exactly(s, length).decode("utf-8"))
+
+
+def _recv_exactly(s: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = s.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed while reading metrics")
+        data += chunk
+    return data
+
+
+if __name__ == "__main__":
+    from common.healthcheck import HEALTH_CHECK_PORT
+
+    for host in sys.argv[1:]:
+        print(json.dumps({host: fetch(host, HEALTH_CHECK_PORT)}, indent=2))
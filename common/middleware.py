@@ -2,16 +2,111 @@ import pika
 import logging
 import time
 from common.fault_manager import FaultManager
+from common.dedup import DEDUP_WINDOW, DedupIndex
+from common.confirms import ConfirmWindow
+from common.select_engine import SelectEngineConnection
+from common.memory_engine import MemoryEngineConnection
+from common import compression
+from common import batch_codec
+from common import metrics
+from common.partitioning import HashRing
+from common.flow_control import FlowController
+from common.envelope import Envelope, Sequencer
+from common.checkpoint import Checkpointer, CHECKPOINT_INTERVAL, CHECKPOINT_MAX_PENDING
+from common.output_batcher import OutputBatcher
+from common.fair_scheduler import FairScheduler
+from common.load_routing import LoadAwareRouter
 from typing import Callable
-from datetime import datetime, timedelta
-import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import json
+import os
+import socket
 
 RABBITMQ_HOST = "rabbitmq"
 RABBITMQ_PORT = 5672
 
 REQUEUE = 2
 
+# Cada cuánto se descartan los segmentos vencidos del índice de dedup
+DEDUP_EXPIRE_INTERVAL = 60
+
+# Ventana de mensajes en vuelo y de acks agrupados (configurable por nodo)
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "1"))
+ACK_WINDOW = int(os.getenv("ACK_WINDOW", "1"))
+# Cada cuánto se confirman los acks pendientes si la ventana no se llenó (segundos)
+ACK_FLUSH_INTERVAL = 0.5
+# Modo batch_callback: entregas que se agrupan por llamada y espera máxima del grupo (ms)
+BATCH_DELIVERY_SIZE = int(os.getenv("BATCH_DELIVERY_SIZE", "50"))
+BATCH_DELIVERY_LINGER_MS = int(os.getenv("BATCH_DELIVERY_LINGER_MS", "50"))
+# Lotes de salida combinados (solo nodos sin estado): espera máxima desde la
+# primera fila (ms, 0 desactiva) y rango del presupuesto adaptativo de bytes
+OUTPUT_BATCH_LINGER_MS = int(os.getenv("OUTPUT_BATCH_LINGER_MS", "0"))
+OUTPUT_BATCH_MIN_BYTES = int(os.getenv("OUTPUT_BATCH_MIN_BYTES", "4096"))
+OUTPUT_BATCH_MAX_BYTES = int(os.getenv("OUTPUT_BATCH_MAX_BYTES", "65536"))
+# Prefetch mínimo con lotes combinados: los acks quedan retenidos hasta publicar
+OUTPUT_BATCH_MIN_PREFETCH = 100
+# Pool de workers para callbacks de CPU: cantidad (0 = en el hilo de pika) y tipo
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "0"))
+PROCESS_WORKERS = "process"
+THREAD_WORKERS = "thread"
+WORKER_POOL_MODE = os.getenv("WORKER_POOL_MODE", PROCESS_WORKERS)
+# Reparto round-robin entre clientes de las entregas en vuelo (ver FairScheduler)
+FAIR_SCHEDULING = os.getenv("FAIR_SCHEDULING", "false").lower() == "true"
+# Entregas en vuelo para repartir: la equidad vale dentro de esta ventana
+FAIR_PREFETCH = int(os.getenv("FAIR_PREFETCH", "200"))
+# Entregas por turno de cada client_id, p. ej. {"1": 2}; el resto, una
+FAIR_WEIGHTS = json.loads(os.getenv("FAIR_WEIGHTS", "{}"))
+
+# Publicaciones sin confirmar en vuelo (0 desactiva publisher confirms)
+CONFIRM_WINDOW = int(os.getenv("CONFIRM_WINDOW", "0"))
+
+# Reconexión ante caídas del broker: espera inicial y máxima entre intentos (segundos)
+RECONNECT_INITIAL_DELAY = float(os.getenv("RECONNECT_INITIAL_DELAY", "0.1"))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", "5"))
+# Errores que indican que se perdió la conexión o el canal (y no un error del nodo)
+CONNECTION_ERRORS = (
+    pika.exceptions.AMQPConnectionError,
+    pika.exceptions.ChannelClosed,
+    pika.exceptions.ChannelWrongStateError,
+)
+
+# Motor de conexión: "blocking" (BlockingConnection), "select" (SelectConnection con ioloop propio)
+# o "memory" (broker en memoria, para correr el pipeline en un proceso)
+BLOCKING_ENGINE = "blocking"
+SELECT_ENGINE = "select"
+MEMORY_ENGINE = "memory"
+MIDDLEWARE_ENGINE = os.getenv("MIDDLEWARE_ENGINE", BLOCKING_ENGINE)
+
+# Nombre estable del nodo con el que salen sus FIN (ver common/eof_barrier.py);
+# el hostname del contenedor se mantiene entre reinicios
+NODE_NAME = os.getenv("NODE_NAME", socket.gethostname())
+
+# Salida particionada por hash consistente: routing keys de las particiones
+# (una por instancia del stage siguiente) y campo de la fila usado como clave
+PARTITIONS = json.loads(os.getenv("PARTITIONS", "[]"))
+PARTITION_KEY_FIELD = int(os.getenv("PARTITION_KEY_FIELD", "0"))
+# Claves pesadas (fracción de las filas) repartidas entre HOT_KEY_SPLITS sub-particiones; 0 = apagado
+HOT_KEY_SPLITS = int(os.getenv("HOT_KEY_SPLITS", "0"))
+HOT_KEY_THRESHOLD = float(os.getenv("HOT_KEY_THRESHOLD", "0.01"))
+# Los consumidores de la salida particionada son shards parciales con un merge detrás (requisito de HOT_KEY_SPLITS)
+PARTITIONS_MERGED = os.getenv("PARTITIONS_MERGED", "false").lower() == "true"
+
+# Control de flujo: colas de los consumidores lentos que se observan antes de
+# publicar y largos (mensajes listos) a partir de los que se frena y se reanuda
+FLOW_WATCH_QUEUES = json.loads(os.getenv("FLOW_WATCH_QUEUES", "[]"))
+FLOW_HIGH_WATERMARK = int(os.getenv("FLOW_HIGH_WATERMARK", "1000"))
+FLOW_LOW_WATERMARK = int(os.getenv("FLOW_LOW_WATERMARK", "500"))
+# Largo máximo de las colas declaradas (0 = sin límite). Al llenarse el broker
+# rechaza las publicaciones (nack), que ConfirmWindow reintenta con backoff: tiene que
+# configurarse igual en todos los nodos que declaran la cola.
+QUEUE_MAX_LENGTH = int(os.getenv("QUEUE_MAX_LENGTH", "0"))
+
+# Exchanges cuyos mensajes se comprimen ("" es el exchange por defecto) y tamaño mínimo en bytes
+COMPRESS_EXCHANGES = json.loads(os.getenv("COMPRESS_EXCHANGES", "[]"))
+COMPRESSION_THRESHOLD = int(os.getenv("COMPRESSION_THRESHOLD", "4096"))
+COMPRESSION_CODEC = os.getenv("COMPRESSION_CODEC", compression.ZLIB_CODEC)
+
 class Middleware:
     def __init__(
         self,
@@ -25,13 +120,112 @@ class Middleware:
         amount_output_instances: int = 1,
         exchange_output_type: str = "fanout",
         exchange_input_type: str = "fanout",
+        prefetch_count: int = None,
+        ack_window: int = None,
+        confirm_window: int = None,
+        compressed_exchanges: list[str] = None,
+        batch_callback: Callable = None,
+        batch_size: int = None,
+        batch_linger_ms: int = None,
+        partitions: list[str] = None,
+        partition_key_field: int = None,
+        flow_watch_queues: list[str] = None,
+        output_linger_ms: int = None,
+        worker_function: Callable = None,
+        worker_initializer: Callable = None,
+        worker_context: Callable = None,
+        workers: int = None,
+        fair_scheduling: bool = None,
+        snapshot: Callable = None,
+        restore: Callable = None,
+        cancelCallback: Callable = None,
+        cancel_producers: int = 1,
+        producer_name: str = None,
     ):
+        fair_scheduling = FAIR_SCHEDULING if fair_scheduling is None else fair_scheduling
+        workers = WORKER_POOL_SIZE if workers is None else workers
+        output_linger_ms = OUTPUT_BATCH_LINGER_MS if output_linger_ms is None else output_linger_ms
+        if faultManager is not None and output_linger_ms > 0:
+            # Un nodo con estado marca sus entradas como procesadas antes de
+            # que salgan las filas combinadas: podría perderlas
+            raise ValueError("Output batching is only supported on stateless nodes (without faultManager)")
+        checkpointing = CHECKPOINT_INTERVAL > 0 and snapshot is not None and faultManager is not None
+        if checkpointing and (fair_scheduling or (worker_function is not None and workers > 0)):
+            # Una marca se confirmaría antes que las entregas en vuelo
+            raise ValueError("Checkpoints are only supported on the single-threaded path (without fair scheduling or workers)")
         self.exchange_output_type = exchange_output_type
         self.echange_input_type = exchange_input_type   
         self.amount_output_instances = amount_output_instances
         self.connection = self._connect_with_retries()
-        self.channel = self.connection.channel()
-        self.channel.basic_qos(prefetch_count=1)
+        self.ack_window = max(1, ack_window or ACK_WINDOW)
+        self.scheduler: FairScheduler = None
+        self.fair_scheduled = False
+        if fair_scheduling:
+            self.scheduler = FairScheduler(FAIR_WEIGHTS)
+            # Las entregas se procesan fuera de orden: un ack múltiple
+            # confirmaría las de otros clientes que siguen esperando
+            self.ack_window = 1
+        self.batch_callback = batch_callback
+        self.batch_size = max(1, batch_size or BATCH_DELIVERY_SIZE) if batch_callback is not None else 1
+        self.batch_linger = (batch_linger_ms if batch_linger_ms is not None else BATCH_DELIVERY_LINGER_MS) / 1000
+        self.pending_batch: list = []  # (mensaje, delivery_tag, sobre)
+        self.batch_generation = 0
+        self.output_linger_ms = output_linger_ms
+        self.worker_pool: Executor = None
+        self.in_flight: deque = deque()  # (future, mensaje, method, sobre) en orden de entrega
+        self.workers_drain_scheduled = False
+        if worker_function is not None and workers > 0:
+            executor = ProcessPoolExecutor if WORKER_POOL_MODE == PROCESS_WORKERS else ThreadPoolExecutor
+            self.worker_pool = executor(max_workers=workers, initializer=worker_initializer)
+            logging.info(f"Worker pool: {workers} {WORKER_POOL_MODE} workers")
+        elif worker_initializer is not None:
+            worker_initializer()
+        # Con CHECKPOINT_INTERVAL y `snapshot`/`restore` el nodo no persiste
+        # cada entrega: las confirma por checkpoint (ver Checkpointer)
+        self.checkpointing = checkpointing
+        if self.checkpointing:
+            # La dedup y el ack van por checkpoint: cada entrega usa el callback individual
+            self.batch_callback = None
+            self.batch_size = 1
+        # El broker deja de entregar al llegar a prefetch_count sin ack
+        self.prefetch_count = max(prefetch_count or PREFETCH_COUNT, self.ack_window, self.batch_size)
+        if self.worker_pool is not None:
+            # Dos lotes por worker: uno procesándose y otro esperando
+            self.prefetch_count = max(self.prefetch_count, 2 * workers)
+        if self.output_linger_ms > 0:
+            self.prefetch_count = max(self.prefetch_count, OUTPUT_BATCH_MIN_PREFETCH)
+        if self.scheduler is not None:
+            self.prefetch_count = max(self.prefetch_count, FAIR_PREFETCH)
+        if self.checkpointing:
+            # Las entregas esperan al checkpoint: el broker no puede frenarse antes
+            self.prefetch_count = max(self.prefetch_count, 2 * CHECKPOINT_MAX_PENDING)
+        self.worker_limit = 2 * workers
+        self.pending_acks = 0
+        self.last_delivery_tag = None
+        partitions = PARTITIONS if partitions is None else partitions
+        self.partitioner = HashRing(
+            partitions, hot_key_splits=HOT_KEY_SPLITS, hot_key_threshold=HOT_KEY_THRESHOLD, merged=PARTITIONS_MERGED
+        ) if partitions else None
+        self.partition_key_field = PARTITION_KEY_FIELD if partition_key_field is None else partition_key_field
+        self.compressed_exchanges = set(COMPRESS_EXCHANGES if compressed_exchanges is None else compressed_exchanges)
+        self.compression_codec = compression.resolve_codec(COMPRESSION_CODEC)
+        self.sequencer = Sequencer(producer_name or NODE_NAME)
+        self.confirms: ConfirmWindow = None
+        self.drain_scheduled = False
+        self.confirm_window = CONFIRM_WINDOW if confirm_window is None else confirm_window
+        self._open_channel()
+        # Publicaciones que no llegaron a salir por una caída de la conexión
+        self.unsent: list = []
+        self.connection_lost = False
+        self.stopping = False
+        self.queue_arguments = (
+            {"x-max-length": QUEUE_MAX_LENGTH, "x-overflow": "reject-publish"} if QUEUE_MAX_LENGTH > 0 else None
+        )
+        self.flow: FlowController = None
+        self.flow_watch_queues = FLOW_WATCH_QUEUES if flow_watch_queues is None else flow_watch_queues
+        self.input_queue_config = input_queues
+        self.declared_exchanges: dict[str, str] = {}
+        self._init_flow()
         self.input_queues: dict[str, str] = {}
         for queue, exchange in input_queues.items():
             self.input_queues_aux = queue 
@@ -39,23 +233,44 @@ class Middleware:
         self.output_exchanges = output_exchanges
         self.intance_id = intance_id
         self.fault_manager = faultManager
-        self.processed_packets = []
+        self.processed_packets: DedupIndex = None
+        self.snapshot = snapshot
+        self.restore = restore
+        self.checkpointer: Checkpointer = None
+        # Última marca de checkpoint reenviada por un nodo sin checkpoints
+        self.last_barrier = 0
+        self.cancelCallback = cancelCallback
+        self.cancel_producers = cancel_producers
+        # Clientes cancelados -> productores de los que ya se procesó el cancel
+        self.cancelled_clients: dict[str, set] = {}
         self.init_state()
-        self.callback = callback
-        self.eofCallback = eofCallback
+        self.output_batcher: OutputBatcher = None
+        if self.output_linger_ms > 0:
+            self.output_batcher = OutputBatcher(
+                self._publish_batch, self._ack_ready, self.output_linger_ms / 1000,
+                OUTPUT_BATCH_MIN_BYTES, OUTPUT_BATCH_MAX_BYTES,
+            )
+        self.worker_function = worker_function
+        # Argumento extra de worker_function, calculado en el hilo de pika por mensaje
+        self.worker_context = worker_context
+        if worker_function is not None and self.worker_pool is None:
+            # Sin pool la función corre en el hilo de pika, igual que un callback
+            if worker_context is not None:
+                self.callback = lambda mensaje: callback(worker_function(mensaje, worker_context(mensaje)))
+            else:
+                self.callback = lambda mensaje: callback(worker_function(mensaje))
+        else:
+            self.callback = callback
+        # Un consumidor sin eofCallback (p. ej. el merge de shards) no espera FIN
+        self.eofCallback = eofCallback or self._unexpected_fin
         self.auto_ack = False #sacarlo
         self._init_input_queues(input_queues)
         self._init_output_queues()
-        self.start_persistence_cleaner()
         
     def _connect_with_retries(self, retries=5, delay=5):
         for attempt in range(retries):
             try:
-                connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT)
-                )
-                logging.info("Successfully connected to RabbitMQ")
-                return connection
+                return self._open_connection()
             except pika.exceptions.AMQPConnectionError as e:
                 logging.warning(f"Connection attempt {attempt + 1} failed: {e}")
                 if attempt < retries - 1:
@@ -64,11 +279,97 @@ class Middleware:
                     logging.error("Max retries reached. Could not connect to RabbitMQ.")
                     raise
 
+    def _open_connection(self):
+        parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT)
+        if MIDDLEWARE_ENGINE == MEMORY_ENGINE:
+            connection = MemoryEngineConnection()
+        elif MIDDLEWARE_ENGINE == SELECT_ENGINE:
+            connection = SelectEngineConnection(parameters)
+        else:
+            connection = pika.BlockingConnection(parameters)
+        logging.info(f"Successfully connected to RabbitMQ ({MIDDLEWARE_ENGINE} engine)")
+        return connection
+
+    def _open_channel(self):
+        self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        if self.confirm_window > 0:
+            self.confirms = ConfirmWindow(self.channel, self.confirm_window, self._schedule_drain)
+            self.confirms.enable()
+
+    def _init_flow(self):
+        if not self.flow_watch_queues:
+            return
+        # Un publicador puro atiende su conexión mientras espera; uno que
+        # consume no puede procesar eventos dentro de su propio callback
+        pump = None if self.input_queue_config else self.connection.process_data_events
+        self.flow = FlowController(
+            self.connection, self.flow_watch_queues, FLOW_HIGH_WATERMARK, FLOW_LOW_WATERMARK, pump=pump
+        )
+
+    def _on_connection_lost(self, error: Exception):
+        if not self.connection_lost:
+            logging.warning(f"Conexión con el broker perdida: {error}")
+        self.connection_lost = True
+
+    def _reconnect(self):
+        """
+        Reabre la conexión con backoff exponencial, vuelve a declarar colas,
+        exchanges y consumos y reenvía lo publicado que no se confirmó. El
+        estado en memoria del nodo se conserva: las entregas que quedaron
+        sin ack las reenvía el broker y el índice de dedup descarta las que
+        ya se habían procesado.
+        """
+        unsent = (self.confirms.unconfirmed() if self.confirms is not None else []) + self.unsent
+        self.unsent = []
+        delay = RECONNECT_INITIAL_DELAY
+        while not self.stopping:
+            try:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                self.connection = self._open_connection()
+                self._open_channel()
+                self.input_queues = {}
+                self._init_input_queues(self.input_queue_config)
+                self._init_output_queues()
+                for exchange, exchange_type in self.declared_exchanges.items():
+                    self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+                break
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"Reconexión fallida: {e}. Reintentando en {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        if self.stopping:
+            return
+
+        # Los delivery tags del canal anterior ya no valen
+        self.pending_acks = 0
+        self.last_delivery_tag = None
+        self.pending_batch = []
+        self.batch_generation += 1
+        if self.output_batcher is not None:
+            self.output_batcher.reset()
+        # Los resultados en curso se descartan: sus entradas se reciben de nuevo
+        self.in_flight.clear()
+        if self.checkpointer is not None:
+            self.checkpointer.reset()
+        if self.scheduler is not None:
+            self.scheduler.clear()
+            self.fair_scheduled = False
+        self.drain_scheduled = False
+        self.connection_lost = False
+        self._init_flow()
+        for exchange, routing_key, body, properties in unsent:
+            self._send(exchange, routing_key, body, properties)
+        logging.info(f"Reconectado al broker, {len(unsent)} publicaciones reenviadas")
+
     def _init_input_queues(self, input_queues):
         for queue, exchange in input_queues.items():
             queue_name = f"{queue}_{self.intance_id}"
 
-            self.channel.queue_declare(queue=queue_name, durable=True)
+            self.channel.queue_declare(queue=queue_name, durable=True, arguments=self.queue_arguments)
             if exchange:
                 self.channel.exchange_declare(
                     exchange=exchange, exchange_type=self.echange_input_type
@@ -91,149 +392,768 @@ class Middleware:
         logging.info("Creating output queues")
         if self.amount_output_instances <= 1:
             for queue in self.output_queues:
-                self.channel.queue_declare(queue=queue, durable=True)
+                self.channel.queue_declare(queue=queue, durable=True, arguments=self.queue_arguments)
         if self.amount_output_instances > 1:
                 for queue in self.output_queues:
                     logging.info(f"Creating output queues {queue}_0")
-                    self.channel.queue_declare(queue=f"{queue}_0", durable=True)
+                    self.channel.queue_declare(queue=f"{queue}_0", durable=True, arguments=self.queue_arguments)
 
         for exchange in self.output_exchanges:
             self.channel.exchange_declare(exchange=exchange, exchange_type=self.exchange_output_type)
 
-    def send_to_requeue_positive(self, queue: str, data: str):
-        self.channel.basic_publish(
-            exchange="", routing_key="positive_review_queue_1", body=data
+    def _publish(self, exchange: str, routing_key: str, body, envelope: Envelope = None):
+        if envelope is None:
+            envelope = Envelope.for_body(body)
+        if envelope.is_fin:
+            # El FIN viaja solo en los headers
+            body = b""
+        if envelope.is_fin or envelope.is_cancel:
+            # Un FIN o cancel reenviado (el nodo pasa el que recibió) sale a nombre de este nodo
+            envelope.origin = NODE_NAME
+        if self.flow is not None:
+            self.flow.acquire()
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            self._do_publish(exchange, routing_key, body, envelope)
+            metrics.registry.observe("publish_seconds", time.perf_counter() - start, exchange=exchange)
+            metrics.registry.increment("published_bytes", len(body), exchange=exchange)
+        else:
+            self._do_publish(exchange, routing_key, body, envelope)
+
+    def _do_publish(self, exchange: str, routing_key: str, body, envelope: Envelope):
+        content_type = batch_codec.COLUMNAR_CONTENT_TYPE if batch_codec.is_columnar(body) else None
+        content_encoding = None
+        if exchange in self.compressed_exchanges and len(body) >= COMPRESSION_THRESHOLD:
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            body = compression.compress(body, self.compression_codec)
+            content_encoding = self.compression_codec
+        properties = pika.BasicProperties(
+            content_type=content_type,
+            content_encoding=content_encoding,
+            headers=self.sequencer.stamp(envelope, exchange, routing_key).to_headers(),
         )
+        self._send(exchange, routing_key, body, properties)
+
+    def _send(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties):
+        if self.connection_lost:
+            self.unsent.append((exchange, routing_key, body, properties))
+            return
+        try:
+            if self.confirms is not None:
+                self.confirms.publish(exchange, routing_key, body, properties)
+            else:
+                self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+        except CONNECTION_ERRORS as e:
+            self._on_connection_lost(e)
+            self.unsent.append((exchange, routing_key, body, properties))
+            if not self.input_queue_config:
+                # Un publicador puro se recupera en el momento; uno que consume,
+                # al volver de su callback (en start)
+                self._reconnect()
+
+    def send_to_requeue_positive(self, queue: str, data: str):
+        self._publish("", "positive_review_queue_1", data)
         logging.debug("Sent to requeue %s: %s", queue, data)
 
     def send_to_requeue_negative(self, queue: str, data: str):
-        self.channel.basic_publish(
-            exchange="", routing_key="negative_review_queue_1", body=data
-        )
+        self._publish("", "negative_review_queue_1", data)
         logging.debug("Sent to requeue %s: %s", queue, data)
 
     def _create_callback_wrapper(self, callback, eofCallback):
 
         def callback_wrapper(ch, method, properties, body):
-            mensaje_str = body.decode("utf-8")
-            
-            if self.fault_manager is not None:
-                self._callback_with_state(mensaje_str, method, callback, eofCallback)
+            envelope = Envelope.from_properties(properties)
+            if envelope is not None and envelope.is_barrier:
+                self._on_barrier(envelope, method)
+                if self.connection_lost:
+                    raise pika.exceptions.AMQPConnectionError("Connection lost during callback")
+                return
+            if envelope is not None and envelope.is_cancel:
+                self._on_cancel(envelope, method)
+                if self.connection_lost:
+                    raise pika.exceptions.AMQPConnectionError("Connection lost during callback")
+                return
+            if envelope is not None and envelope.is_fin:
+                # Los callbacks de EOF siguen recibiendo el FIN serializado
+                self._route(envelope.fin().encode(), method, callback, eofCallback, envelope)
+                if self.connection_lost:
+                    raise pika.exceptions.AMQPConnectionError("Connection lost during callback")
+                return
+            if metrics.ENABLED:
+                start = time.perf_counter()
+            if compression.is_compressed(properties):
+                body = compression.decompress(body, properties.content_encoding)
+            # Los lotes columnares se entregan como bytes; el resto, como texto
+            if properties is not None and properties.content_type == batch_codec.COLUMNAR_CONTENT_TYPE:
+                mensaje_str = body
             else:
-                self._do_callback(mensaje_str, callback, eofCallback, method)
-                self.ack(method.delivery_tag)
+                mensaje_str = body.decode("utf-8")
+            if metrics.ENABLED:
+                metrics.registry.observe("decode_seconds", time.perf_counter() - start)
+                metrics.registry.increment("received_bytes", len(body))
+
+            self._route(mensaje_str, method, callback, eofCallback, envelope)
+            if self.connection_lost:
+                # Se perdió la conexión durante el callback: start reconecta
+                raise pika.exceptions.AMQPConnectionError("Connection lost during callback")
 
         return callback_wrapper
+
+    def _route(self, mensaje_str, method, callback, eofCallback, envelope: Envelope):
+        if self.scheduler is not None:
+            self._enqueue_fair(mensaje_str, method, envelope)
+        elif self.worker_pool is not None:
+            self._submit(mensaje_str, method, envelope)
+        else:
+            self._dispatch(mensaje_str, method, callback, eofCallback, envelope)
+
+    def _enqueue_fair(self, mensaje_str, method, envelope: Envelope):
+        """
+        Encola la entrega en la fila de su cliente. Se procesa una por vuelta
+        del loop de eventos, así las entregas que el broker tiene en vuelo
+        llegan a encolarse y se intercalan entre clientes.
+        """
+        if envelope is not None:
+            client_id = envelope.client_id
+        else:
+            _, client_id, _ = batch_codec.describe(mensaje_str)
+        self.scheduler.push(client_id, (mensaje_str, method, envelope))
+        self._schedule_fair()
+
+    def _schedule_fair(self):
+        if not self.fair_scheduled and len(self.scheduler):
+            self.fair_scheduled = True
+            self.connection.add_callback_threadsafe(self._serve_fair)
+
+    def _serve_fair(self):
+        self.fair_scheduled = False
+        if self.worker_pool is not None and len(self.in_flight) >= self.worker_limit:
+            # _drain_workers vuelve a programar el turno al liberar lugar
+            return
+        item = self.scheduler.pop()
+        if item is None:
+            return
+        mensaje_str, method, envelope = item
+        if self.worker_pool is not None:
+            self._submit(mensaje_str, method, envelope)
+        else:
+            self._dispatch(mensaje_str, method, self.callback, self.eofCallback, envelope)
+        if self.connection_lost:
+            raise pika.exceptions.AMQPConnectionError("Connection lost during callback")
+        self._schedule_fair()
+
+    def _dispatch(self, mensaje_str, method, callback, eofCallback, envelope: Envelope):
+        if self.batch_callback is not None:
+            self._add_to_batch(mensaje_str, method, callback, eofCallback, envelope)
+        else:
+            self._handle_message(mensaje_str, method, callback, eofCallback, envelope)
+
+    def _submit(self, mensaje_str, method, envelope: Envelope):
+        """
+        Manda el mensaje al pool de workers. Los resultados se entregan al
+        callback (que publica) y las entradas se confirman en orden de
+        entrega, así la salida y la dedup por packet_id quedan como con un
+        solo hilo. El FIN espera a que terminen los lotes anteriores.
+        """
+        future = None
+        if not self._is_fin(mensaje_str, envelope) and not self._is_control(envelope):
+            if self.worker_context is not None:
+                future = self.worker_pool.submit(self.worker_function, mensaje_str, self.worker_context(mensaje_str))
+            else:
+                future = self.worker_pool.submit(self.worker_function, mensaje_str)
+            future.add_done_callback(self._on_worker_done)
+        self.in_flight.append((future, mensaje_str, method, envelope))
+        self._drain_workers()
+
+    def _on_worker_done(self, _future):
+        # Corre en un hilo del pool: el resto se hace en el hilo de pika
+        if not self.workers_drain_scheduled:
+            self.workers_drain_scheduled = True
+            self.connection.add_callback_threadsafe(self._drain_workers)
+
+    def _drain_workers(self):
+        self.workers_drain_scheduled = False
+        while self.in_flight:
+            future, mensaje_str, method, envelope = self.in_flight[0]
+            if future is not None and not future.done():
+                break
+            self.in_flight.popleft()
+            if future is None:
+                self._handle_message(mensaje_str, method, self.callback, self.eofCallback, envelope)
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Error en worker: {e}")
+                self.ack(method.delivery_tag)
+                continue
+            self._handle_message(mensaje_str, method, lambda _: self.callback(result), self.eofCallback, envelope)
+        if self.scheduler is not None:
+            self._schedule_fair()
+
+    @staticmethod
+    def _is_fin(mensaje_str, envelope: Envelope) -> bool:
+        if envelope is not None:
+            return envelope.is_fin
+        # Mensaje sin sobre (productor viejo): se busca el FIN en el cuerpo
+        return isinstance(mensaje_str, str) and "fin\n\n" in mensaje_str
+
+    @staticmethod
+    def _is_cancel(envelope: Envelope) -> bool:
+        return envelope is not None and envelope.is_cancel
+
+    @staticmethod
+    def _is_control(envelope: Envelope) -> bool:
+        # Cancel o marca de checkpoint: no llegan al callback del nodo
+        return envelope is not None and (envelope.is_cancel or envelope.is_barrier)
+
+    @staticmethod
+    def _packet_id(mensaje_str, envelope: Envelope) -> str:
+        if envelope is not None and envelope.packet_id is not None:
+            return envelope.packet_id
+        return batch_codec.packet_id_of(mensaje_str)
+
+    @staticmethod
+    def _sequence(envelope: Envelope) -> tuple:
+        if envelope is None:
+            return None, None
+        return envelope.producer, envelope.seq
+
+    def _handle_message(self, mensaje_str, method, callback, eofCallback, envelope: Envelope = None):
+        if self.output_batcher is not None:
+            self.output_batcher.begin()
+        if self._is_cancel(envelope):
+            self._process_cancel(envelope, method.delivery_tag)
+            return
+        if envelope is not None and envelope.is_barrier:
+            self._process_barrier(int(envelope.batch_id), method.delivery_tag)
+            return
+        if self.cancelled_clients and envelope is not None and envelope.client_id in self.cancelled_clients:
+            logging.info(f"Descartando entrega del cliente cancelado {envelope.client_id}")
+            self._skip(method.delivery_tag)
+            return
+        if self.checkpointer is not None:
+            self._callback_with_checkpoint(mensaje_str, method, callback, eofCallback, envelope)
+        elif self.fault_manager is not None:
+            self._callback_with_state(mensaje_str, method, callback, eofCallback, envelope)
+        else:
+            self._do_callback(mensaje_str, callback, eofCallback, envelope)
+            self.ack(method.delivery_tag)
+            if self._is_fin(mensaje_str, envelope):
+                self.flush_acks()
+
+    def _add_to_batch(self, mensaje_str, method, callback, eofCallback, envelope: Envelope = None):
+        if self._is_fin(mensaje_str, envelope) or self._is_control(envelope):
+            # El FIN (o cancel, o marca) se procesa después de todo lo recibido antes que él
+            self._flush_batch()
+            self._handle_message(mensaje_str, method, callback, eofCallback, envelope)
+            return
+        self.pending_batch.append((mensaje_str, method.delivery_tag, envelope))
+        if len(self.pending_batch) >= self.batch_size:
+            self._flush_batch()
+        elif len(self.pending_batch) == 1:
+            generation = self.batch_generation
+            self.connection.call_later(self.batch_linger, lambda: self._flush_batch(generation))
+
+    def _flush_batch(self, generation: int = None):
+        """
+        Entrega el grupo pendiente al batch_callback, registra sus packet_id
+        con una sola escritura y los confirma con un único ack múltiple.
+        """
+        if generation is not None and generation != self.batch_generation:
+            return
+        if not self.pending_batch:
+            return
+        pending = self.pending_batch
+        self.pending_batch = []
+        self.batch_generation += 1
+
+        messages = []
+        packet_ids = []
+        sequences = []
+        for mensaje_str, _, envelope in pending:
+            if self.cancelled_clients and envelope is not None and envelope.client_id in self.cancelled_clients:
+                # Se confirma con el resto del grupo, sin procesarla
+                continue
+            if self.fault_manager is not None:
+                packet_id = self._packet_id(mensaje_str, envelope)
+                sequence = self._sequence(envelope)
+                if packet_id in packet_ids or self.processed_packets.seen(packet_id, *sequence):
+                    logging.info(f"Paquete {packet_id} ya ha sido procesado, saltando...")
+                    continue
+                packet_ids.append(packet_id)
+                sequences.append(sequence)
+            messages.append(mensaje_str)
+
+        if messages:
+            if self.output_batcher is not None:
+                self.output_batcher.begin()
+            self._do_batch_callback(messages)
+        if packet_ids:
+            self.processed_packets.mark_many(packet_ids, sequences)
+        self._ack_many([delivery_tag for _, delivery_tag, _ in pending])
+
+    def _do_batch_callback(self, messages: list):
+        if metrics.ENABLED:
+            with metrics.registry.timer("batch_callback_seconds"):
+                self.batch_callback(messages)
+            metrics.registry.increment("batched_messages_total", len(messages))
+        else:
+            self.batch_callback(messages)
+
+    def _ack_many(self, delivery_tags: list):
+        if self.confirms is not None or self.output_batcher is not None or self.scheduler is not None:
+            # Cada ack queda retenido hasta que se confirme lo publicado antes
+            for delivery_tag in delivery_tags:
+                self.ack(delivery_tag)
+            return
+        self.pending_acks += len(delivery_tags)
+        self.last_delivery_tag = delivery_tags[-1]
+        self.flush_acks()
     
-    def _do_callback(self, mensaje_str, callback, eofCallback, method):
-        if "fin\n\n" in mensaje_str:
+    @staticmethod
+    def _unexpected_fin(mensaje_str):
+        logging.warning(f"FIN recibido por un consumidor sin eofCallback, se descarta: {mensaje_str!r}")
+
+    def _do_callback(self, mensaje_str, callback, eofCallback, envelope: Envelope = None):
+        if metrics.ENABLED:
+            self._do_callback_measured(mensaje_str, callback, eofCallback, envelope)
+            return
+        if self._is_fin(mensaje_str, envelope):
             eofCallback(mensaje_str)
         else:
             callback(mensaje_str)
+
+    def _do_callback_measured(self, mensaje_str, callback, eofCallback, envelope: Envelope = None):
+        if envelope is not None and (envelope.is_fin or envelope.rows is not None):
+            message_type = batch_codec.FIN_MESSAGE if envelope.is_fin else batch_codec.BATCH_MESSAGE
+            client_id, rows = envelope.client_id, envelope.rows or 0
+        else:
+            message_type, client_id, rows = batch_codec.describe(mensaje_str)
+        client = str(client_id)
+        start = time.perf_counter()
+        try:
+            if message_type == batch_codec.FIN_MESSAGE:
+                eofCallback(mensaje_str)
+            else:
+                callback(mensaje_str)
+        finally:
+            metrics.registry.observe("callback_seconds", time.perf_counter() - start, type=message_type, client=client)
+            metrics.registry.increment("messages_total", type=message_type, client=client)
+            metrics.registry.increment("rows_total", rows, client=client)
     
-    def _callback_with_state(self, mensaje_str, method, callback, eofCallback):
-        mensaje_str_aux = mensaje_str.strip().split("\n")
-        packet_id = mensaje_str_aux[0]
-        #logging.info(f"Paquete recibido con ID: {packet_id}")
-        if packet_id in self.processed_packets and not "fin" in packet_id:
+    def _callback_with_state(self, mensaje_str, method, callback, eofCallback, envelope: Envelope = None):
+        is_fin = self._is_fin(mensaje_str, envelope)
+        packet_id = None if is_fin else self._packet_id(mensaje_str, envelope)
+        sequence = self._sequence(envelope)
+        if not is_fin and self.processed_packets.seen(packet_id, *sequence):
             logging.info(f"Paquete {packet_id} ya ha sido procesado, saltando...")
             self.ack(method.delivery_tag)
             return
-        
-        self._do_callback(mensaje_str, callback, eofCallback, method)
-        
-        now = datetime.now()
-        #logging.info(f"Paquete {packet_id} procesado a las {now}")
-    
-        self.fault_manager.append(f"middleware_{self.intance_id}_{self.input_queues_aux}_fin", f'{packet_id}_{now.strftime("%Y%m%d%H%M%S")}')
-        self.processed_packets.append(f'{packet_id}')
+
+        self._do_callback(mensaje_str, callback, eofCallback, envelope)
+
+        if not is_fin:
+            self.processed_packets.mark(packet_id, *sequence)
         self.ack(method.delivery_tag)
-        
+        if is_fin:
+            self.flush_acks()
+
+    def _callback_with_checkpoint(self, mensaje_str, method, callback, eofCallback, envelope: Envelope = None):
+        """
+        Como `_callback_with_state`, pero sin escribir nada: la entrega queda
+        sin ack hasta el próximo checkpoint. Un FIN lo fuerza, así lo que
+        dispara sale con el estado que lo produjo ya guardado.
+        """
+        is_fin = self._is_fin(mensaje_str, envelope)
+        packet_id = None if is_fin else self._packet_id(mensaje_str, envelope)
+        sequence = self._sequence(envelope)
+        if not is_fin and self.processed_packets.seen(packet_id, *sequence):
+            logging.info(f"Paquete {packet_id} ya ha sido procesado, saltando...")
+        else:
+            self._do_callback(mensaje_str, callback, eofCallback, envelope)
+            if not is_fin:
+                self.processed_packets.mark(packet_id, *sequence)
+        if self.checkpointer.track(method.delivery_tag) or is_fin:
+            self.checkpoint()
+
+    def _on_barrier(self, envelope: Envelope, method):
+        """
+        Marca de checkpoint. Va detrás de las entregas anteriores (lotes
+        agrupados, pool de workers) para que su ack salga en orden; con el
+        scheduler no espera turno, porque allí cada ack es individual.
+        """
+        if self.scheduler is not None:
+            self._handle_message(None, method, self.callback, self.eofCallback, envelope)
+        else:
+            self._route(None, method, self.callback, self.eofCallback, envelope)
+
+    def _process_barrier(self, checkpoint_id: int, delivery_tag):
+        """
+        Un nodo con checkpoints toma uno con la primera marca de cada id
+        (llega una por cada camino desde el gateway); los demás solo la
+        confirman. La marca sigue aguas abajo.
+        """
+        if self.checkpointer is not None:
+            self.checkpointer.track(delivery_tag)
+            new = self.checkpointer.advance(checkpoint_id)
+            if new:
+                self.checkpoint()
+        else:
+            self.ack(delivery_tag)
+            new = checkpoint_id > self.last_barrier
+            self.last_barrier = max(self.last_barrier, checkpoint_id)
+        if new and CHECKPOINT_INTERVAL > 0:
+            self.send_barrier(checkpoint_id)
+
+    def _on_cancel(self, envelope: Envelope, method):
+        """
+        Llega la cancelación de un cliente: desde ya se descartan sus
+        entregas (las que esperan en el scheduler, enseguida; las que están
+        agrupadas o en el pool, al salir) y el cancel se procesa en orden,
+        como un FIN.
+        """
+        self.cancelled_clients.setdefault(envelope.client_id, set())
+        if self.scheduler is not None:
+            for _, dropped, _ in self.scheduler.drop(envelope.client_id):
+                self._skip(dropped.delivery_tag)
+        self._route(None, method, self.callback, self.eofCallback, envelope)
+
+    def _process_cancel(self, envelope: Envelope, delivery_tag):
+        """
+        Cancel de un productor. Con el primero se libera el estado del
+        cliente en el nodo (`cancelCallback`) y el cancel sigue aguas abajo.
+        Cuando llegó el de cada uno de los `cancel_producers` ya no queda
+        nada del cliente en camino y se lo vuelve a aceptar (puede
+        reconectarse con el mismo id).
+        """
+        client_id = envelope.client_id
+        origins = self.cancelled_clients.setdefault(client_id, set())
+        first = not origins
+        origins.add(envelope.origin or f"#{len(origins)}")
+        if first:
+            logging.info(f"Cliente {client_id} cancelado, liberando su estado")
+            if self.cancelCallback is not None:
+                self.cancelCallback(client_id)
+            self.send_cancel(client_id)
+        if len(origins) >= self.cancel_producers:
+            del self.cancelled_clients[client_id]
+        if self.fault_manager is not None:
+            key = f"middleware_{self.intance_id}_{self.input_queues_aux}_cancel_{client_id}"
+            if client_id in self.cancelled_clients:
+                self.fault_manager.update(key, json.dumps(sorted(origins)))
+            else:
+                self.fault_manager.discard(key)
+        self._skip(delivery_tag)
+        self.flush_acks()
+
+    def _skip(self, delivery_tag):
+        # Entrega descartada sin procesar: se confirma como las demás
+        if self.checkpointer is not None:
+            if self.checkpointer.track(delivery_tag):
+                self.checkpoint()
+        else:
+            self.ack(delivery_tag)
+
+    def checkpoint(self):
+        """
+        Guarda la foto del estado y confirma las entregas que cubre.
+        """
+        if self.checkpointer is None or not self.checkpointer.pending:
+            return
+        # Lo publicado por las entregas tiene que salir antes de confirmarlas
+        self.flush_output()
+        for delivery_tag in self.checkpointer.take():
+            self.ack(delivery_tag)
+        self.flush_acks()
+
+    def _schedule_checkpoint(self):
+        # Sin marcas (un camino que no las reenvía) el checkpoint sale igual por tiempo
+        def tick():
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logging.error(f"Error taking checkpoint: {e}")
+            self.connection.call_later(CHECKPOINT_INTERVAL, tick)
+        self.connection.call_later(CHECKPOINT_INTERVAL, tick)
 
     def ack(self, delivery_tag):
-        self.channel.basic_ack(delivery_tag=delivery_tag)
+        if metrics.ENABLED:
+            with metrics.registry.timer("ack_seconds"):
+                self._ack(delivery_tag)
+        else:
+            self._ack(delivery_tag)
+
+    def _ack(self, delivery_tag):
+        if self.output_batcher is not None and self.output_batcher.hold(delivery_tag):
+            # Se confirma cuando se publiquen las filas combinadas pendientes
+            return
+        self._ack_ready(delivery_tag)
+
+    def _ack_ready(self, delivery_tag):
+        if self.confirms is not None:
+            # Los acks tienen que salir en orden de entrega
+            self._drain_confirmed()
+            if self.confirms.hold(delivery_tag):
+                return
+        self._ack_now(delivery_tag)
+
+    def _ack_now(self, delivery_tag):
+        if self.ack_window <= 1:
+            self._basic_ack(delivery_tag)
+            return
+        self.pending_acks += 1
+        self.last_delivery_tag = delivery_tag
+        if self.pending_acks >= self.ack_window:
+            self.flush_acks()
+
+    def flush_acks(self):
+        """
+        Confirma de una vez todas las entregas pendientes con `multiple=True`,
+        después de bajar a disco el estado persistido que las cubre.
+        """
+        if self.pending_acks == 0:
+            return
+        if self.fault_manager is not None:
+            self.fault_manager.sync()
+        self._basic_ack(self.last_delivery_tag, multiple=True)
+        self.pending_acks = 0
+        self.last_delivery_tag = None
+
+    def _basic_ack(self, delivery_tag, multiple: bool = False):
+        # Sin conexión el ack se pierde: el broker reenvía la entrega y el
+        # índice de dedup la descarta
+        if self.connection_lost:
+            return
+        try:
+            self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+        except CONNECTION_ERRORS as e:
+            self._on_connection_lost(e)
+
+    def _schedule_drain(self):
+        # Se invoca desde el callback de confirmación, dentro del ioloop:
+        # los acks se envían después, desde un contexto seguro.
+        if not self.drain_scheduled:
+            self.drain_scheduled = True
+            self.connection.add_callback_threadsafe(self._drain_confirmed)
+
+    def _drain_confirmed(self):
+        """
+        Envía los acks de entrada cuyas publicaciones ya fueron confirmadas.
+        """
+        self.drain_scheduled = False
+        for delivery_tag in self.confirms.take_released():
+            self._ack_now(delivery_tag)
+        if not self.confirms.pending():
+            self.flush_acks()
+
+    def _schedule_ack_flush(self):
+        def flush():
+            try:
+                if self.confirms is not None:
+                    self._drain_confirmed()
+                self.flush_acks()
+            except Exception as e:
+                logging.error(f"Error flushing acks: {e}")
+            self.connection.call_later(ACK_FLUSH_INTERVAL, flush)
+        self.connection.call_later(ACK_FLUSH_INTERVAL, flush)
 
     def start(self):
         logging.info("Middleware Started!")
-        try:
-            if self.input_queues:
-                self.channel.start_consuming()
-        except OSError:
-            logging.debug("Middleware shutdown")
-        except pika.exceptions.ConnectionClosedByBroker:
-            logging.debug("Connection closed")
+        while True:
+            try:
+                if self.input_queues:
+                    if self.ack_window > 1:
+                        self._schedule_ack_flush()
+                    if self.checkpointer is not None:
+                        self._schedule_checkpoint()
+                    if self.processed_packets is not None:
+                        self._schedule_expiry()
+                    self.channel.start_consuming()
+            except OSError:
+                logging.debug("Middleware shutdown")
+                return
+            except CONNECTION_ERRORS as e:
+                if not self.stopping:
+                    self._on_connection_lost(e)
+            if self.stopping or not self.connection_lost:
+                logging.debug("Middleware stopped")
+                return
+            self._reconnect()
 
     def send(self, data: str, instance_id: int = None, routing_key: str = ""):
+        # Lo combinado sale antes, así el FIN no se adelanta a las filas
+        self.flush_output()
+        envelope = Envelope.for_body(data)
         if self.amount_output_instances > 1:
             for queue in self.output_queues:
-                self.send_to_queue(f"{queue}_0", data)
+                self._publish("", f"{queue}_0", data, envelope)
+        # Con salida particionada los mensajes sin lote (FIN, resultados) van a todas las particiones
+        routing_keys = self.partitioner.partitions if self.partitioner is not None and not routing_key else [routing_key]
         for exchange in self.output_exchanges:
-            self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=data)
+            for key in routing_keys:
+                self._publish(exchange, key, data, envelope)
             #logging.info("Sent to exchange %s: %s - %s", exchange, routing_key,data)
 
+    def send_barrier(self, checkpoint_id: int, exchange: str = None, routing_key: str = ""):
+        """
+        Publica una marca de checkpoint (ver `_send_control`).
+        """
+        self._send_control(Envelope.for_barrier(checkpoint_id), exchange, routing_key)
+
+    def send_cancel(self, client_id, exchange: str = None, routing_key: str = ""):
+        """
+        Publica la cancelación de un cliente (ver `_send_control`).
+        """
+        self._send_control(Envelope.for_cancel(client_id), exchange, routing_key)
+
+    def _send_control(self, envelope: Envelope, exchange: str = None, routing_key: str = ""):
+        """
+        Publica un mensaje de control, sin cuerpo. Sin `exchange` sigue los
+        caminos de un FIN: colas de salida y los exchanges de salida con
+        `routing_key` (o todas las particiones); con `exchange`, solo a esa
+        routing key.
+        """
+        self.flush_output()
+        if exchange is not None:
+            self._publish(exchange, routing_key, b"", envelope)
+            return
+        if self.amount_output_instances > 1:
+            for queue in self.output_queues:
+                self._publish("", f"{queue}_0", b"", envelope)
+        routing_keys = self.partitioner.partitions if self.partitioner is not None and not routing_key else [routing_key]
+        for output_exchange in self.output_exchanges:
+            for key in routing_keys:
+                self._publish(output_exchange, key, b"", envelope)
+
+    def send_batch(self, packet_id, rows: list, routing_key: str = ""):
+        """
+        Publica un lote de filas codificándolo una vez por codec, según el
+        codec configurado para cada cola o exchange de salida.
+
+        Con salida particionada (y sin routing key explícita) el lote se
+        parte según la clave de cada fila y cada parte se publica con la
+        routing key de su partición, conservando el packet_id.
+        """
+        if self.partitioner is not None and not routing_key:
+            for partition, partition_rows in self.partitioner.split(rows, self.partition_key_field).items():
+                if metrics.ENABLED:
+                    metrics.registry.increment("partition_rows_total", len(partition_rows), partition=partition)
+                self._send_batch(packet_id, partition_rows, partition)
+            return
+        self._send_batch(packet_id, rows, routing_key)
+
+    def _send_batch(self, packet_id, rows: list, routing_key: str):
+        if self.output_batcher is None:
+            self._publish_batch(packet_id, rows, routing_key)
+            return
+        if self.output_batcher.add(routing_key, packet_id, rows):
+            self.connection.call_later(self.output_batcher.linger, self._flush_output_safely)
+
+    def flush_output(self):
+        """
+        Publica todas las filas combinadas pendientes.
+        """
+        if self.output_batcher is not None:
+            self.output_batcher.flush()
+
+    def _flush_output_safely(self):
+        try:
+            self.flush_output()
+        except Exception as e:
+            logging.error(f"Error flushing output batches: {e}")
+
+    def _publish_batch(self, packet_id, rows: list, routing_key: str):
+        encoded = {}
+        envelope = Envelope.for_batch(packet_id, rows)
+
+        def encode_for(*destinations):
+            codec = batch_codec.codec_for(*destinations)
+            if codec not in encoded:
+                encoded[codec] = batch_codec.encode_batch(packet_id, rows, codec)
+            return encoded[codec]
+
+        if self.amount_output_instances > 1:
+            for queue in self.output_queues:
+                self._publish("", f"{queue}_0", encode_for(queue), envelope)
+        for exchange in self.output_exchanges:
+            self._publish(exchange, routing_key, encode_for(routing_key, exchange), envelope)
+
+    def send_to_exchange(self, exchange: str, data: str, routing_key: str = ""):
+        self.flush_output()
+        self._publish(exchange, routing_key, data)
+
+    def declare_exchange(self, exchange: str, exchange_type: str):
+        self.declared_exchanges[exchange] = exchange_type
+        self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+
+    def load_aware_router(self, queues: list[str]) -> LoadAwareRouter:
+        """
+        Router que reparte entre `queues` (routing keys de instancias
+        equivalentes) según su largo, medido sobre la conexión del Middleware.
+        """
+        return LoadAwareRouter(lambda: self.connection, queues)
+
     def send_to_queue(self, queue: str, data: str):
-        self.channel.basic_publish(exchange="", routing_key=queue, body=data)
+        self.flush_output()
+        self._publish("", queue, data)
         logging.debug("Sent to queue %s: %s", queue, data)
         
     def stop(self):
+        self.stopping = True
         if self.input_queues:
             self.channel.stop_consuming()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown(wait=False, cancel_futures=True)
+        self.flush_output()
+        self.checkpoint()
+        if self.confirms is not None:
+            self.confirms.wait_all()
+            self._drain_confirmed()
+        self.flush_acks()
         if self.channel:
             self.channel.close()
         self.connection.close()
         logging.info("Middleware stopped consuming messages")
         
     def init_state(self):
-        if self.fault_manager is not None:
-            for key in self.fault_manager.get_keys(f"middleware_{self.intance_id}_{self.input_queues_aux}_fin"):
-                packet_id = self.fault_manager.get(key)
-                packets = packet_id.strip().split("\n")
-                self.processed_packets = packets
-                
-                #logging.info(f"Restaurando estado para el paquete {packet_id}")
-            #logging.info(f'Paquetes procesados: {self.processed_packets}')
-        
+        if self.fault_manager is None:
+            return
+        legacy_key = f"middleware_{self.intance_id}_{self.input_queues_aux}_fin"
+        if self.fault_manager.get_keys(legacy_key):
+            logging.info(f"Descartando journal de dedup anterior: {legacy_key}")
+            self.fault_manager.delete_key(legacy_key)
+        cancel_prefix = f"middleware_{self.intance_id}_{self.input_queues_aux}_cancel_"
+        for key in self.fault_manager.get_keys(cancel_prefix):
+            state = self.fault_manager.get(key)
+            if state:
+                self.cancelled_clients[key[len(cancel_prefix):]] = set(json.loads(state))
+        if self.checkpointing:
+            self.checkpointer = Checkpointer(
+                self.fault_manager, f"middleware_{self.intance_id}_{self.input_queues_aux}_checkpoint",
+                self.snapshot, self.restore,
+            )
+            self.processed_packets = self.checkpointer.processed_packets
+            return
+        # La ventana cubre lo que el prefetch deja procesar fuera de orden
+        self.processed_packets = DedupIndex(
+            self.fault_manager, f"middleware_{self.intance_id}_{self.input_queues_aux}_dedup",
+            window=max(DEDUP_WINDOW, 2 * self.prefetch_count),
+        )
+
     def clean_persistence(self):
         """
-        Remove processed packets older than 2 minutes from the persistence directory.
+        Remove dedup segments older than the retention window.
         """
-        updated_aux = []
-        for key in self.fault_manager.get_keys(f"middleware_{self.intance_id}_{self.input_queues_aux}_fin"):
-            state = self.fault_manager.get(key)
-            if state is not None:
-                now = datetime.now()
-                packets = state.strip().split("\n")
-                #logging.info(f"Restaurando estado para el paquete {state}")
-                for packet in packets:
-                    packet_time_str = packet.split("_")[-1]
-                    if not packet_time_str:
-                        logging.warning(f"Empty packet time string for packet: {packet}")
-                        continue
-                    packet_time = datetime.strptime(packet_time_str, "%Y%m%d%H%M%S")
-                    if now - packet_time <= timedelta(minutes=2):
-                        updated_aux.append(packet)
-                    else:
-                        pass
-                        #logging.info(f"Removed outdated packet: {packet}")
-                updated_aux_str = '\n'.join(updated_aux)
-                self.fault_manager.update(f"middleware_{self.intance_id}_{self.input_queues_aux}_fin", updated_aux_str)
-        
-            aux = []
-            for packet in updated_aux:
-                aux.append(packet.split("_")[0])
-            self.processed_packets = aux
-        
-    def start_persistence_cleaner(self):
-        if self.fault_manager is not None:
-            def cleaner():
-                while True:
-                    try:
-                        time.sleep(60)
-                        self.clean_persistence()
-                    except Exception as e:
-                        logging.error(f"Error while cleaning persistence: {e}")
-            cleaner_thread = threading.Thread(target=cleaner)
-            cleaner_thread.start()
-            logging.info("Persistence cleaner started")
-    
-        
\ No newline at end of file
+        self.processed_packets.expire()
+
+    def _schedule_expiry(self):
+        # Corre en el hilo de pika, entre entregas: no compite con las marcas del índice
+        def expire():
+            try:
+                self.clean_persistence()
+            except Exception as e:
+                logging.error(f"Error while cleaning persistence: {e}")
+            self.connection.call_later(DEDUP_EXPIRE_INTERVAL, expire)
+        self.connection.call_later(DEDUP_EXPIRE_INTERVAL, expire)
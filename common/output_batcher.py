@@ -0,0 +1,157 @@
+import json
+import time
+import uuid
+from collections import deque
+from typing import Callable
+
+# Espacio de nombres de los packet_id de los lotes combinados
+PACKET_ID_NAMESPACE = uuid.UUID("5b0f3d1e-7c55-4b7a-9f38-3f0d6a51c2e4")
+
+# Suavizado de la tasa observada (peso de la última medición)
+RATE_SMOOTHING = 0.2
+
+
+class OutputGroup:
+    """
+    Filas pendientes de un destino (routing key, client_id).
+    """
+
+    def __init__(self, first_sequence: int):
+        self.rows: list = []
+        self.packet_ids: list = []
+        self.bytes = 0
+        # Entrega más vieja (en orden de procesamiento) que aportó filas:
+        # su ack y los siguientes esperan a este lote
+        self.first_sequence = first_sequence
+
+
+class OutputBatcher:
+    """
+    Junta las filas que el nodo publica con `send_batch` por routing key y
+    client_id, y las publica en un solo lote al llegar al presupuesto de
+    bytes o al vencer `linger` desde la primera fila.
+
+    El presupuesto se adapta a la tasa con la que el nodo produce filas
+    para cada destino (que sigue a la tasa con la que consume su entrada):
+    apunta a lo que se acumula en un `linger`, entre `min_bytes` y
+    `max_bytes`. Así un flujo rápido sale en lotes llenos y uno lento no
+    paga el linger completo en cada lote.
+
+    Los acks de entrada se retienen hasta que se publiquen todas las filas
+    que aportaron, para no perder filas combinadas si el nodo se cae.
+    """
+
+    def __init__(
+        self,
+        publish: Callable,
+        release_ack: Callable,
+        linger: float,
+        min_bytes: int,
+        max_bytes: int,
+    ):
+        self.publish = publish
+        self.release_ack = release_ack
+        self.linger = linger
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.groups: dict[tuple, OutputGroup] = {}
+        # Tasa observada (bytes/s) y última medición por destino
+        self.rates: dict[tuple, float] = {}
+        self.last_add: dict[tuple, float] = {}
+        self.held_acks: deque = deque()  # (secuencia, delivery_tag)
+        # Número de la entrega en proceso, en orden de procesamiento (que no
+        # siempre es el de los delivery tags)
+        self.sequence = 0
+
+    def begin(self):
+        """
+        Marca el inicio del procesamiento de una entrega (o grupo de entregas).
+        """
+        self.sequence += 1
+
+    def budget(self, key: tuple) -> int:
+        rate = self.rates.get(key)
+        if rate is None:
+            return self.max_bytes
+        return int(min(self.max_bytes, max(self.min_bytes, rate * self.linger)))
+
+    def add(self, routing_key: str, packet_id, rows: list) -> bool:
+        """
+        Agrega las filas de un lote. Devuelve True si hay que programar el
+        timer de linger (se abrió el primer grupo pendiente).
+        """
+        was_empty = not self.groups
+        by_client: dict = {}
+        for row in rows:
+            by_client.setdefault(str(row[-1]) if row else None, []).append(row)
+        row_bytes = len(json.dumps(rows[0])) if rows else 0
+        for client_id, client_rows in by_client.items():
+            key = (routing_key, client_id)
+            # Si el lote mezcla clientes cada parte necesita su propio id
+            part_id = str(packet_id) if len(by_client) == 1 else f"{packet_id}:{client_id}"
+            size = row_bytes * len(client_rows)
+            self._observe(key, size)
+            group = self.groups.get(key)
+            if group is None:
+                group = OutputGroup(self.sequence)
+                self.groups[key] = group
+            group.rows.extend(client_rows)
+            group.packet_ids.append(part_id)
+            group.bytes += size
+            if group.bytes >= self.budget(key):
+                self._flush_group(key)
+        return was_empty and bool(self.groups)
+
+    def _observe(self, key: tuple, size: int):
+        now = time.monotonic()
+        last = self.last_add.get(key)
+        self.last_add[key] = now
+        if last is None:
+            return
+        rate = size / max(now - last, 1e-3)
+        previous = self.rates.get(key)
+        self.rates[key] = rate if previous is None else (1 - RATE_SMOOTHING) * previous + RATE_SMOOTHING * rate
+
+    def hold(self, delivery_tag) -> bool:
+        """
+        Retiene el ack de una entrega mientras haya filas sin publicar de
+        ella o de entregas anteriores.
+        """
+        if not self.groups:
+            return False
+        self.held_acks.append((self.sequence, delivery_tag))
+        return True
+
+    def flush(self):
+        for key in list(self.groups):
+            self._flush_group(key)
+
+    def _flush_group(self, key: tuple):
+        group = self.groups.pop(key)
+        self.publish(self._packet_id(group, key), group.rows, key[0])
+        self._release_acks()
+
+    def _release_acks(self):
+        if not self.groups:
+            while self.held_acks:
+                self.release_ack(self.held_acks.popleft()[1])
+            return
+        oldest = min(group.first_sequence for group in self.groups.values())
+        while self.held_acks and self.held_acks[0][0] < oldest:
+            self.release_ack(self.held_acks.popleft()[1])
+
+    @staticmethod
+    def _packet_id(group: OutputGroup, key: tuple) -> str:
+        # Un lote de una sola entrada conserva su packet_id; uno combinado
+        # recibe uno determinístico, igual si se reprocesan las mismas entradas
+        if len(group.packet_ids) == 1:
+            return group.packet_ids[0]
+        return str(uuid.uuid5(PACKET_ID_NAMESPACE, f"{key}|{'|'.join(group.packet_ids)}"))
+
+    def reset(self):
+        """
+        Descarta lo pendiente tras perder la conexión: las entregas que lo
+        originaron se reciben de nuevo y se vuelven a procesar.
+        """
+        self.groups = {}
+        self.held_acks.clear()
@@ -1,13 +1,17 @@
 class Fin():
-    def __init__(self, batch_id, client_id):
+    def __init__(self, batch_id, client_id, producer=None):
         self.batch_id = batch_id
         self.client_id = client_id
+        # Nodo que manda el FIN, para que la barrera del consumidor no lo cuente dos veces
+        self.producer = producer
         
     @staticmethod    
     def decode(message):
         res = message.split("\n\n")
-        return Fin(res[1], res[2])
+        return Fin(res[1], res[2], res[3] if len(res) > 3 and res[3] else None)
     #Revisar DECODE
 
     def encode(self):
-        return f"fin\n\n{self.batch_id}\n\n{self.client_id}\n\n"
\ No newline at end of file
+        if self.producer:
+            return f"fin\n\n{self.batch_id}\n\n{self.client_id}\n\n{self.producer}\n\n"
+        return f"fin\n\n{self.batch_id}\n\n{self.client_id}\n\n"
@@ -0,0 +1,143 @@
+import bisect
+import hashlib
+
+# Puntos por partición en el anillo; más puntos reparten las claves más parejo
+VIRTUAL_NODES = 64
+# Contadores del detector de claves pesadas
+HOT_KEY_CAPACITY = 64
+# Filas vistas antes de declarar una clave pesada (con pocas filas todas lo parecen)
+HOT_KEY_MIN_ROWS = 1000
+
+
+def _hash(key: str) -> int:
+    # Estable entre procesos (a diferencia de hash()), para que todos los
+    # productores asignen cada clave a la misma partición
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], byteorder="big")
+
+
+class HeavyHitters:
+    """
+    Claves más frecuentes del flujo con Space-Saving: `capacity` contadores;
+    una clave sin contador reemplaza a la de menor cuenta y hereda esa
+    cuenta como error. Una clave es pesada si su cuenta garantizada (cuenta
+    menos error) supera la fracción `threshold` de las filas vistas.
+    """
+
+    def __init__(self, threshold: float, capacity: int = HOT_KEY_CAPACITY, min_rows: int = HOT_KEY_MIN_ROWS):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.min_rows = min_rows
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.total = 0
+
+    def add(self, key: str, count: int = 1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            victim = min(self.counts, key=self.counts.get)
+            error = self.counts.pop(victim)
+            del self.errors[victim]
+        self.counts[key] = error + count
+        self.errors[key] = error
+
+    def is_hot(self, key: str) -> bool:
+        if self.total < self.min_rows or key not in self.counts:
+            return False
+        return self.counts[key] - self.errors[key] >= self.threshold * self.total
+
+
+class HashRing:
+    """
+    Hashing consistente de claves (p. ej. app_id) a particiones (routing
+    keys de las colas de cada instancia). Cada partición es dueña de los
+    rangos del anillo que preceden a sus puntos; agregar o sacar una mueve
+    solo las claves de sus rangos.
+
+    Con `hot_key_splits` > 1 las filas de las claves pesadas (un juego con
+    una fracción `hot_key_threshold` de las filas) se reparten por turno
+    entre `hot_key_splits` particiones, su dueña y las siguientes, para que
+    un solo juego no cargue una sola instancia. Las
+    filas no cambian: el consumidor que cuenta por clave tiene cuentas
+    parciales de esos juegos y el merge posterior las suma. Por eso solo se
+    admite con `merged`, cuando los consumidores corren como shards
+    parciales con un merge detrás (un acumulador que no suma cuentas
+    parciales, como el de nombres o el de percentil, daría mal).
+    """
+
+    def __init__(
+        self,
+        partitions: list[str],
+        virtual_nodes: int = VIRTUAL_NODES,
+        hot_key_splits: int = 0,
+        hot_key_threshold: float = 0.01,
+        merged: bool = False,
+    ):
+        if not partitions:
+            raise ValueError("HashRing needs at least one partition")
+        if hot_key_splits > 1 and not merged:
+            raise ValueError("hot key splitting needs consumers that run as partial shards with a merge")
+        self.partitions = list(partitions)
+        self.hot_key_splits = hot_key_splits
+        self.heavy_hitters = HeavyHitters(hot_key_threshold) if hot_key_splits > 1 else None
+        # Turno de cada clave pesada entre sus particiones
+        self.salts: dict[str, int] = {}
+        points = sorted(
+            (_hash(f"{partition}#{i}"), partition)
+            for partition in self.partitions
+            for i in range(virtual_nodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [partition for _, partition in points]
+
+    def partition_for(self, key) -> str:
+        index = bisect.bisect(self.hashes, _hash(str(key))) % len(self.hashes)
+        return self.owners[index]
+
+    def split(self, rows: list, key_field: int) -> dict[str, list]:
+        """
+        Reparte las filas de un lote según la partición de su campo `key_field`.
+        """
+        hot = self._hot_keys(rows, key_field) if self.heavy_hitters is not None else ()
+        partitioned: dict[str, list] = {}
+        owners: dict[str, str] = {}
+        for row in rows:
+            key = str(row[key_field])
+            if key in hot:
+                partition = self._hot_partition(key)
+                partitioned.setdefault(partition, []).append(row)
+                continue
+            partition = owners.get(key)
+            if partition is None:
+                partition = self.partition_for(key)
+                owners[key] = partition
+            partitioned.setdefault(partition, []).append(row)
+        return partitioned
+
+    def _hot_partition(self, key: str) -> str:
+        """
+        Partición de la próxima fila de una clave pesada: por turno entre la
+        dueña de la clave y las `hot_key_splits` - 1 siguientes.
+        """
+        start = self.partitions.index(self.partition_for(key))
+        salt = self.salts.get(key, 0)
+        self.salts[key] = (salt + 1) % min(self.hot_key_splits, len(self.partitions))
+        return self.partitions[(start + salt) % len(self.partitions)]
+
+    def _hot_keys(self, rows: list, key_field: int) -> set:
+        """
+        Suma las claves del lote al detector y devuelve las que son pesadas.
+        """
+        counts: dict[str, int] = {}
+        for row in rows:
+            key = str(row[key_field])
+            counts[key] = counts.get(key, 0) + 1
+        for key, count in counts.items():
+            self.heavy_hitters.add(key, count)
+        if len(self.salts) > self.heavy_hitters.capacity:
+            # Solo las claves que el detector sigue contando pueden ser pesadas
+            self.salts = {key: salt for key, salt in self.salts.items() if key in self.heavy_hitters.counts}
+        return {key for key in counts if self.heavy_hitters.is_hot(key)}
@@ -2,6 +2,14 @@ import csv
 
 from common.packet import Packet
 
+# Posición de cada campo en getData(), para leer columnas de un lote
+REVIEW_GAME_ID_FIELD = 0
+REVIEW_APP_NAME_FIELD = 1
+REVIEW_TEXT_FIELD = 2
+REVIEW_SCORE_FIELD = 3
+REVIEW_ID_FIELD = 4
+REVIEW_CLIENT_ID_FIELD = 5
+
 class Review(Packet):
     def __init__(self, game_id, app_name, review_text, review_score, id, client_id):
         super().__init__(client_id)
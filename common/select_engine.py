@@ -0,0 +1,264 @@
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Callable
+import pika
+
+# Tipos de eventos que el ioloop le pasa al hilo que procesa los mensajes
+DELIVERY = 0
+CONTROL = 1
+CLOSED = 2
+STOP = 3
+
+# Tiempo máximo de espera de una operación sincrónica sobre el broker (segundos)
+SYNC_TIMEOUT = 30
+
+
+class QueuedEventsConnection:
+    """
+    Base de los motores que entregan mensajes a través de una cola de
+    eventos: los callbacks de los nodos corren en el hilo que llama a
+    `start_consuming`, de a uno y en orden de entrega.
+    """
+
+    def __init__(self):
+        self.events: queue.Queue = queue.Queue()
+        self.deferred: deque = deque()
+
+    def add_callback_threadsafe(self, callback: Callable):
+        self.events.put((CONTROL, callback))
+
+    def process_data_events(self, time_limit=0):
+        self._run_events(timeout=time_limit)
+
+    def wait_until(self, predicate: Callable):
+        """
+        Procesa eventos de control (confirms, timers) hasta que `predicate`
+        se cumpla. Las entregas que lleguen mientras tanto se difieren.
+        """
+        while not predicate():
+            self._run_events(timeout=None)
+
+    def _run_events(self, timeout):
+        try:
+            kind, item = self.events.get(timeout=timeout) if timeout != 0 else self.events.get_nowait()
+        except queue.Empty:
+            return
+        if kind == DELIVERY:
+            self.deferred.append(item)
+        elif kind == CONTROL:
+            item()
+        elif kind == CLOSED:
+            self._raise_closed(item)
+
+    def _raise_closed(self, reason):
+        if isinstance(reason, pika.exceptions.ConnectionClosedByClient):
+            return
+        if isinstance(reason, Exception):
+            raise reason
+        raise pika.exceptions.ConnectionClosedByBroker(0, str(reason))
+
+    def consume_events(self):
+        """
+        Loop principal del hilo de procesamiento: entrega mensajes y corre
+        timers hasta `stop_consuming` o el cierre de la conexión.
+        """
+        while True:
+            if self.deferred:
+                self.deferred.popleft()()
+                continue
+            kind, item = self.events.get()
+            if kind == DELIVERY:
+                item()
+            elif kind == CONTROL:
+                item()
+            elif kind == CLOSED:
+                self._raise_closed(item)
+                return
+            elif kind == STOP:
+                return
+
+
+class SelectEngineConnection(QueuedEventsConnection):
+    """
+    Motor basado en pika.SelectConnection con la misma interfaz que
+    BlockingConnection expone al Middleware.
+
+    El ioloop corre en un hilo propio y atiende I/O, heartbeats y timers
+    sin bloquearse. Los callbacks de los nodos corren en el hilo que llama
+    a `start_consuming`, de a uno y en orden de entrega; las publicaciones
+    y acks que hacen se encolan en el ioloop (respetando el orden).
+    """
+
+    def __init__(self, parameters: pika.ConnectionParameters):
+        super().__init__()
+        self.opened = threading.Event()
+        self.open_error = None
+        self.close_reason = None
+        self.impl = pika.SelectConnection(
+            parameters=parameters,
+            on_open_callback=self._on_open,
+            on_open_error_callback=self._on_open_error,
+            on_close_callback=self._on_close,
+        )
+        self.loop_thread = threading.Thread(target=self.impl.ioloop.start, name="pika-ioloop", daemon=True)
+        self.loop_thread.start()
+        self.opened.wait()
+        if self.open_error is not None:
+            raise pika.exceptions.AMQPConnectionError(self.open_error)
+
+    def _on_open(self, _connection):
+        self.opened.set()
+
+    def _on_open_error(self, _connection, error):
+        self.open_error = error
+        self.impl.ioloop.stop()
+        self.opened.set()
+
+    def _on_close(self, _connection, reason):
+        self.close_reason = reason
+        self.events.put((CLOSED, reason))
+        self.impl.ioloop.stop()
+
+    @property
+    def is_closed(self) -> bool:
+        return self.close_reason is not None
+
+    def in_loop(self, callback: Callable):
+        """
+        Ejecuta `callback` dentro del ioloop (seguro desde cualquier hilo).
+        """
+        if threading.current_thread() is self.loop_thread:
+            callback()
+        else:
+            self.impl.ioloop.add_callback_threadsafe(callback)
+
+    def call_sync(self, starter: Callable, channel: "SelectEngineChannel" = None):
+        """
+        Ejecuta en el ioloop una operación asincrónica de pika y espera su
+        respuesta. `starter` recibe el callback que debe pasarle a pika. Si
+        el broker cierra `channel` (p. ej. un 404) se levanta el motivo.
+        """
+        done = threading.Event()
+        result = []
+
+        def on_done(frame=None):
+            result.append(frame)
+            done.set()
+
+        self.in_loop(lambda: starter(on_done))
+        while not done.wait(timeout=0.1):
+            if self.is_closed:
+                raise pika.exceptions.ConnectionClosed(0, str(self.close_reason))
+            if channel is not None and channel.close_reason is not None:
+                channel._raise_closed()
+            if not self.loop_thread.is_alive():
+                raise pika.exceptions.AMQPConnectionError("ioloop stopped")
+        return result[0]
+
+    def channel(self) -> "SelectEngineChannel":
+        impl = self.call_sync(lambda on_open: self.impl.channel(on_open_callback=on_open))
+        return SelectEngineChannel(self, impl)
+
+    def call_later(self, delay: float, callback: Callable):
+        self.in_loop(lambda: self.impl.ioloop.call_later(delay, lambda: self.events.put((CONTROL, callback))))
+
+    def close(self):
+        if not self.is_closed:
+            self.in_loop(self.impl.close)
+        self.loop_thread.join(timeout=SYNC_TIMEOUT)
+
+
+class SelectEngineChannel:
+    """
+    Canal del motor select con la interfaz de BlockingChannel que usa el
+    Middleware.
+    """
+
+    def __init__(self, engine: SelectEngineConnection, impl):
+        self.engine = engine
+        self.impl = impl
+        self.consumer_tags: list[str] = []
+        self.close_reason = None
+        impl.add_on_close_callback(self._on_close)
+
+    def _on_close(self, _channel, reason):
+        self.close_reason = reason
+
+    def _raise_closed(self):
+        if isinstance(self.close_reason, Exception):
+            raise self.close_reason
+        raise pika.exceptions.ChannelClosed(0, str(self.close_reason))
+
+    @property
+    def is_open(self) -> bool:
+        return self.impl.is_open
+
+    @property
+    def connection(self) -> SelectEngineConnection:
+        return self.engine
+
+    def basic_qos(self, prefetch_count=0):
+        self.engine.call_sync(lambda cb: self.impl.basic_qos(prefetch_count=prefetch_count, callback=cb))
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False, auto_delete=False, arguments=None):
+        return self.engine.call_sync(lambda cb: self.impl.queue_declare(
+            queue, passive=passive, durable=durable, exclusive=exclusive,
+            auto_delete=auto_delete, arguments=arguments, callback=cb,
+        ), channel=self)
+
+    def exchange_declare(self, exchange, exchange_type="direct", passive=False, durable=False):
+        return self.engine.call_sync(lambda cb: self.impl.exchange_declare(
+            exchange, exchange_type=exchange_type, passive=passive, durable=durable, callback=cb,
+        ), channel=self)
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        return self.engine.call_sync(lambda cb: self.impl.queue_bind(
+            queue, exchange, routing_key=routing_key, arguments=arguments, callback=cb,
+        ), channel=self)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        def on_message(_channel, method, properties, body):
+            self.engine.events.put((DELIVERY, lambda: on_message_callback(self, method, properties, body)))
+
+        consumer_tag = self.engine.call_sync(lambda cb: self.impl.basic_consume(
+            queue, on_message, auto_ack=auto_ack, callback=cb,
+        )).method.consumer_tag
+        self.consumer_tags.append(consumer_tag)
+        return consumer_tag
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.engine.in_loop(lambda: self.impl.basic_publish(exchange, routing_key, body, properties, mandatory))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.engine.in_loop(lambda: self.impl.basic_ack(delivery_tag=delivery_tag, multiple=multiple))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.engine.in_loop(lambda: self.impl.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue))
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        # Los confirms se procesan en el hilo de los callbacks, igual que el
+        # resto del estado del Middleware
+        def on_confirm(frame):
+            self.engine.events.put((CONTROL, lambda: ack_nack_callback(frame)))
+
+        self.engine.call_sync(lambda cb: self.impl.confirm_delivery(on_confirm, callback=cb))
+        if callback is not None:
+            callback(None)
+
+    def wait_until(self, predicate: Callable):
+        self.engine.wait_until(predicate)
+
+    def start_consuming(self):
+        self.engine.consume_events()
+
+    def stop_consuming(self):
+        for consumer_tag in self.consumer_tags:
+            self.engine.in_loop(lambda tag=consumer_tag: self.impl.basic_cancel(tag))
+        self.consumer_tags = []
+        self.engine.events.put((STOP, None))
+
+    def close(self):
+        if self.impl.is_open:
+            self.engine.in_loop(self.impl.close)
@@ -0,0 +1,76 @@
+import json
+import logging
+from typing import Callable
+from common.eof_barrier import EofBarrier
+from common.fault_manager import FaultManager
+from common.packet_fin import Fin
+
+
+class PartialCountsMerger:
+    """
+    Merge de un conteo particionado por clave (p. ej. reseñas por juego).
+    Cada shard manda, al terminar un cliente, sus cuentas parciales como
+    {clave: {"name": ..., "count": ...}}; las de una misma clave se suman,
+    porque con las claves pesadas repartidas (ver HashRing) un juego puede
+    tener cuentas en varios shards. Cuando llegaron las de los `shards`
+    llama a `on_complete(client_id, counts)`.
+
+    Los parciales se persisten tal como llegan; uno reentregado del mismo
+    shard no se suma dos veces.
+    """
+
+    def __init__(self, shards: int, on_complete: Callable, fault_manager: FaultManager = None, key: str = "shard_merge"):
+        self.on_complete = on_complete
+        self.fault_manager = fault_manager
+        self.key = key
+        self.counts: dict[str, dict] = {}
+        self.shards_seen: dict[str, set] = {}
+        self.eof_barrier = EofBarrier(shards, self._complete)
+        self.init_state()
+
+    def add(self, client_id, shard: str, counts: dict, persist: bool = True):
+        client_id = str(client_id)
+        seen = self.shards_seen.setdefault(client_id, set())
+        if shard in seen or self.eof_barrier.is_complete(client_id):
+            logging.info(f"Parcial repetido del shard {shard} para el cliente {client_id}")
+            return
+        seen.add(shard)
+        if persist and self.fault_manager is not None:
+            self.fault_manager.append(f"{self.key}_{client_id}", json.dumps({"shard": shard, "counts": counts}))
+        merged = self.counts.setdefault(client_id, {})
+        for key, entry in counts.items():
+            if key in merged:
+                merged[key]["count"] += entry["count"]
+            else:
+                merged[key] = dict(entry)
+        self.eof_barrier.fin_received(Fin(0, client_id, shard))
+
+    def forget(self, client_id):
+        """
+        Descarta los parciales de un cliente cancelado.
+        """
+        client_id = str(client_id)
+        self.counts.pop(client_id, None)
+        self.shards_seen.pop(client_id, None)
+        self.eof_barrier.forget(client_id)
+        if self.fault_manager is not None:
+            self.fault_manager.discard(f"{self.key}_{client_id}")
+
+    def _complete(self, client_id: str):
+        self.on_complete(client_id, self.counts.pop(client_id, {}))
+        self.shards_seen.pop(client_id, None)
+        if self.fault_manager is not None:
+            self.fault_manager.delete_key(f"{self.key}_{client_id}")
+
+    def init_state(self):
+        if self.fault_manager is None:
+            return
+        for key in self.fault_manager.get_keys(self.key):
+            state = self.fault_manager.get(key)
+            if not state:
+                continue
+            client_id = key[len(self.key) + 1:]
+            for line in state.strip().split("\n"):
+                partial = json.loads(line)
+                self.add(client_id, partial["shard"], partial["counts"], persist=False)
+            logging.info(f"Merge del cliente {client_id} restaurado: {len(self.shards_seen.get(client_id, ()))} shards")
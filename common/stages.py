@@ -0,0 +1,75 @@
+import importlib.util
+import json
+import os
+
+# Raíz donde están los directorios de los nodos: el repo, o /src en las imágenes
+NODES_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _json(env: dict, key: str, default):
+    value = env.get(key)
+    return json.loads(value) if value else default
+
+
+# Nodos que se pueden construir dentro de otro proceso (runtime co-ubicado,
+# benchmarks): módulo de su directorio y cómo construirlos a partir de su
+# entorno, lo mismo que hace el main.py de cada uno
+STAGES = {
+    "genre_filter": (
+        "filter",
+        lambda module, env: module.GenreFilter(
+            _json(env, "INPUT_QUEUES", {}), _json(env, "OUTPUT_EXCHANGES", []), _json(env, "INSTANCE_ID", 0), env.get("GENRE")
+        ),
+    ),
+    "range_filter": (
+        "filter",
+        lambda module, env: module.RangeFilter(
+            2010, 2019, _json(env, "INPUT_QUEUES", {}), _json(env, "OUTPUT_EXCHANGES", []), _json(env, "INSTANCE_ID", 0)
+        ),
+    ),
+    "top10_indie_counter": (
+        "counter",
+        lambda module, env: module.Top10IndieCounter(
+            input_queues=_json(env, "INPUT_QUEUES", {}),
+            output_exchanges=_json(env, "OUTPUT_EXCHANGES", []),
+            instance_id=_json(env, "INSTANCE_ID", 0),
+        ),
+    ),
+    "game_review_filter": (
+        "filter",
+        lambda module, env: module.GameReviewFilter(
+            _json(env, "INPUT_GAMES_QUEUE", []),
+            _json(env, "INPUT_REVIEWS_QUEUE", []),
+            _json(env, "OUTPUT_EXCHANGES", []),
+            [],
+            "1",
+            _json(env, "PREVIOUS_REVIEW_NODES", []),
+            int(env.get("AMOUNT_OF_LANGUAGE_FILTERS", "0")),
+            env.get("LOAD_AWARE_ROUTING", "false").lower() == "true",
+        ),
+    ),
+    "percentile_accumulator": (
+        "accumulator",
+        lambda module, env: module.PercentileAccumulator(
+            _json(env, "INPUT_QUEUES", []),
+            _json(env, "OUTPUT_EXCHANGES", []),
+            env.get("INSTANCE_ID", "1"),
+            int(env.get("PERCENTILE", "90")),
+        ),
+    ),
+}
+
+
+def load_stage(name: str, node: str, env: dict):
+    """
+    Construye un nodo con el código de su directorio. Varios nodos tienen
+    un `filter.py`, así que cada uno se carga con un nombre de módulo propio.
+    """
+    if node not in STAGES:
+        raise ValueError(f"Node {node} can't be built as a stage")
+    module_file, build = STAGES[node]
+    path = os.path.join(NODES_ROOT, node, f"{module_file}.py")
+    spec = importlib.util.spec_from_file_location(f"{name}_{module_file}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return build(module, env)
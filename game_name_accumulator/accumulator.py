@@ -2,11 +2,14 @@ import json
 import logging
 from collections import defaultdict
 from common.game_review import GameReview
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
+from common.eof_barrier import EofBarrier
 from common.packet_fin import Fin
 from common.middleware import Middleware
 from common.healthcheck import HealthCheckServer
 from common.fault_manager import FaultManager
+from common.feedback import RESOLVED_KEYS_EXCHANGE, RESOLVED_KEYS_FEEDBACK, resolved_notice
 
 class GameNamesAccumulator:
     def __init__(self, input_queues, output_exchanges, instance_id, reviews_low_limit, previous_language_nodes):
@@ -34,9 +37,14 @@ class GameNamesAccumulator:
             self._callBack,
             self._finCallBack,
             self.fault_manager,
+            cancelCallback=self._cancelCallBack,
+            cancel_producers=int(previous_language_nodes),
         )
-        self.total_fin = int(previous_language_nodes)
-        self.received_fin:dict = {}
+        if RESOLVED_KEYS_FEEDBACK:
+            # Avisa a los language filters qué juegos ya no necesitan más reseñas
+            self.middleware.declare_exchange(RESOLVED_KEYS_EXCHANGE, "fanout")
+        # Un FIN por cada language filter
+        self.eof_barrier = EofBarrier(int(previous_language_nodes), self._send_final_check, fault_manager=self.fault_manager)
         self.data_to_store = ''
         self.counter = 0
         
@@ -106,6 +114,7 @@ class GameNamesAccumulator:
                 sent_games.append(game_id)
                 games.pop(game_id)
                 self.datasent_by_client[client_id] = True
+                self._notify_resolved(client_id, [game_id])
             
             game_data = {
                 'game_id': game_id,
@@ -135,31 +144,52 @@ class GameNamesAccumulator:
         """
         try:
             fin = Fin.decode(data)
-            client_id = int(fin.client_id)
-            logging.info(f"Fin de la transmisión recibido para el cliente {client_id}")
-            if client_id not in self.received_fin:
-                self.received_fin[client_id] = 1
-            else:
-                self.received_fin[client_id] += 1
-            if self.received_fin[client_id] == self.total_fin:
-                logging.info(f"Fin de la transmisión recibido para el cliente {client_id} y todos los nodos de lenguaje")
-                if not self.datasent_by_client[client_id]:
-                    message = {"game_exceeding_limit": {"client_id " + str(client_id): []}}
-                    self.middleware.send(json.dumps(message))
-                message2 ={"final_check_low_limit": {"client_id " +  str(client_id): True}}
-                self.middleware.send(json.dumps(message2))
-                self.fault_manager.delete_key(f'game_names_accumulator_{str(client_id)}')
-            
+            logging.info(f"Fin de la transmisión recibido para el cliente {fin.client_id}")
+            self.eof_barrier.fin_received(fin)
         except Exception as e:
             logging.error(f"Error al procesar el mensaje de fin: {e}")
 
+    def _send_final_check(self, client_id):
+        """
+        Llegó el FIN de todos los nodos de lenguaje: cierra los resultados del cliente.
+        """
+        client_id = int(client_id)
+        logging.info(f"Fin de la transmisión recibido para el cliente {client_id} y todos los nodos de lenguaje")
+        if not self.datasent_by_client[client_id]:
+            message = {"game_exceeding_limit": {"client_id " + str(client_id): []}}
+            self.middleware.send(json.dumps(message))
+        message2 ={"final_check_low_limit": {"client_id " +  str(client_id): True}}
+        self.middleware.send(json.dumps(message2))
+        self.fault_manager.delete_key(f'game_names_accumulator_{str(client_id)}')
+        self._notify_resolved(client_id, done=True)
+
+    def _cancelCallBack(self, client_id):
+        """
+        El cliente se canceló: se descartan sus cuentas y los FIN que ya llegaron.
+        """
+        self.eof_barrier.forget(client_id)
+        client_id = int(client_id)
+        self.games_by_client.pop(client_id, None)
+        self.sent_games_by_client.pop(client_id, None)
+        self.datasent_by_client.pop(client_id, None)
+        self.fault_manager.discard(f'game_names_accumulator_{client_id}')
+        self._notify_resolved(client_id, done=True)
+
+    def _notify_resolved(self, client_id, game_ids: list = None, done: bool = False):
+        """
+        Avisa a los filtros de más arriba que las reseñas de `game_ids` ya no
+        cambian el resultado (el juego ya se envió), o que el cliente terminó.
+        """
+        if RESOLVED_KEYS_FEEDBACK:
+            self.middleware.send_to_exchange(RESOLVED_KEYS_EXCHANGE, resolved_notice(client_id, game_ids, done))
+
     def _callBack(self, data):
         """
         Callback para procesar los mensajes recibidos.
         """
         try:
-            aux = data.strip().split("\n")
-            packet_id = aux[0]
+            batch = decode_batch(data)
+            packet_id = batch.packet_id
             self.data_to_store = ''
             if packet_id in self.last_packet_id:
                 logging.info(f"Paquete {packet_id} ya ha sido procesado, saltando...")
@@ -167,8 +197,8 @@ class GameNamesAccumulator:
                 return
             self.counter += 1
             logging.info(f"Contador de paquetes: {self.counter}")
-            for row in aux[1:]:
-                game = GameReview.decode(json.loads(row))
+            for row in batch.rows():
+                game = GameReview.decode(row)
                 self.process_game(game, packet_id)
             self.fault_manager.append(f'game_names_accumulator_{game.client_id}', self.data_to_store)
         except Exception as e:
@@ -3,10 +3,13 @@ import logging
 import os
 import threading
 from common.game import Game
-from common.game_review import GameReview
+from common.game_review import GameReview, GAME_REVIEW_GAME_ID_FIELD
+from common.feedback import RESOLVED_KEYS_FEEDBACK, ResolvedKeys
 from common.middleware import Middleware
 from common.packet_fin import Fin
-from common.review import Review
+from common.review import Review, REVIEW_CLIENT_ID_FIELD
+from common.batch_codec import decode_batch
+from common.eof_barrier import EofBarrier
 from common.fault_manager import FaultManager
 import uuid
 
@@ -20,6 +23,7 @@ class GameReviewFilter:
         instance_id,
         previous_review_nodes,
         amount_of_language_filters,
+        load_aware_routing=False,
     ):
         """
         :param input_queues: Lista de colas de entrada (e.g., ['action_games_queue', 'positive_reviews_queue']).
@@ -38,16 +42,28 @@ class GameReviewFilter:
         self.sended_fin: dict = {}
         self.reviews_to_add: dict = {}  # {client_id: [reviews]}
         self.previous_review_nodes = previous_review_nodes
-        self.nodes_completed: dict = {}  # {client_id: nodes_completed_count}
         self.review_file_size: dict = {}  # {client_id: file_size_count}
-        self.batch_counter: dict = {} 
-        self.total_batches: dict = {} 
         self.last_processed_packet: dict = {} 
         self.amount_of_language_filters = amount_of_language_filters
         self.fault_manager = FaultManager("../persistence/", self.reviews_input_queue[0])
+        # FIN de reviews de todos los nodos anteriores y todos sus lotes
+        self.review_barrier = EofBarrier(
+            previous_review_nodes,
+            self._reviews_completed,
+            count_batches=True,
+            fault_manager=self.fault_manager,
+            key=f"review_eof_{self.reviews_input_queue[0]}",
+        )
         self.next_instance = 1
+        self.load_aware_routing = load_aware_routing
+        self.language_router = None
+        self.resolved = None
         if "action" in self.games_input_queue[1].lower():
             self.packet_id = 1
+            if RESOLVED_KEYS_FEEDBACK:
+                # Juegos que el acumulador ya envió: no hace falta clasificar sus reviews
+                self.resolved = ResolvedKeys()
+                self.resolved.listen(f"resolved_keys_{self.reviews_input_queue[0]}", instance_id)
         else:
             self.packet_id = int(self.reviews_input_queue[0].split("_")[-1])
 
@@ -67,8 +83,11 @@ class GameReviewFilter:
             output_queues=self.output_queues,  ## ???
             output_exchanges=self.output_exchanges,  ## ???
             faultManager=self.fault_manager,
+            # Nodo con estado: su salida no se combina aunque el contenedor tenga OUTPUT_BATCH_LINGER_MS
+            output_linger_ms=0,
             intance_id=self.instance_id,
-            exchange_output_type="direct"
+            exchange_output_type="direct",
+            cancelCallback=self.handle_game_cancel,
         )
         self.books_middleware.start()
         
@@ -80,9 +99,18 @@ class GameReviewFilter:
             output_queues=[],  ## ???
             output_exchanges=self.output_exchanges,  ## ???
             faultManager=self.fault_manager,
+            # Nodo con estado: su salida no se combina aunque el contenedor tenga OUTPUT_BATCH_LINGER_MS
+            output_linger_ms=0,
             intance_id=self.instance_id,
             exchange_output_type="direct",
+            cancelCallback=self.handle_review_cancel,
+            cancel_producers=self.previous_review_nodes,
         )
+        if self.load_aware_routing and self.amount_of_language_filters > 1:
+            # Los lotes van al language filter menos atrasado en vez de por turno
+            self.language_router = self.reviews_middleware.load_aware_router(
+                [f"games_reviews_action_queue_{i}_0" for i in range(1, self.amount_of_language_filters + 1)]
+            )
         for key in self.fault_manager.get_keys(f'processed_packets_{self.reviews_input_queue[0]}'):
             data = self.fault_manager.get(key)
             data = json.loads(data)
@@ -139,21 +167,15 @@ class GameReviewFilter:
             data = self.fault_manager.get(key)
             data = data.strip().split("\n")
             client_id = int(key.split("_")[-1])
-            if client_id not in self.total_batches:
-                self.total_batches[client_id] = 0
-            if client_id not in self.batch_counter:
-                self.batch_counter[client_id] = 0
             if client_id not in self.last_processed_packet:
                 self.last_processed_packet[client_id] = None
             for line in data:
                 if not line:
                     continue
                 json_data = json.loads(line)
-                if isinstance(json_data, dict) and all(key in json_data for key in ["packet_id", "batch_counter", "total_batches"]):
-                    self.batch_counter[client_id] = int(json_data["batch_counter"])
-                    self.total_batches[client_id] = int(json_data["total_batches"])
+                if isinstance(json_data, dict) and "packet_id" in json_data:
                     self.last_processed_packet[client_id] = json_data["packet_id"]
-            logging.info(f"Estado REVIEW para cliente {client_id}: {self.batch_counter[client_id]} - {self.total_batches[client_id]} - {self.last_processed_packet[client_id]}")
+            logging.info(f"Estado REVIEW para cliente {client_id}: {self.last_processed_packet[client_id]}")
             
         
 
@@ -162,16 +184,15 @@ class GameReviewFilter:
         Agrega un juego al diccionario de juegos, organizados por client_id.
         """
         try:
-            aux = game.strip().split("\n")
-            packet_id = aux[0]
-            batch = aux[1:]
+            batch = decode_batch(game)
+            packet_id = batch.packet_id
             client_id_file = None
             
             
             final_list = str(packet_id) + "\n"
-            for game in batch:
+            for game in batch.rows():
                 
-                game = Game.decode(json.loads(game))
+                game = Game.decode(game)
                 # logging.info(f"Recibido juego - {packet_id}")
                 client_id = game.client_id
                 client_id_file = client_id
@@ -193,45 +214,23 @@ class GameReviewFilter:
         """
         Agrega una review a la lista y escribe en el archivo cuando llega a 1000.
         """
-        batch = message.split("\n")
-        packet_id = batch[0]
+        batch = decode_batch(message)
+        packet_id = batch.packet_id
         #logging.info(f"Recibiendo REVIEW - {packet_id}")
-        batch = batch[1:]
         if packet_id == self.last_processed_packet:
             logging.info("Ignoring duplicate packet.")
             return
         #final_list = str(packet_id) + "\n"
-       # print("Recibiendo REVIEW - batch:", len(batch), flush=True)
-       # print("Recibiendo REVIEW - batch:", batch, flush=True)
-        client_id = int(Review.decode(json.loads(batch[0])).client_id)
-        # print("Recibiendo REVIEW - client_id:", client_id, flush=True)
-        if client_id not in self.batch_counter:
-            self.batch_counter[client_id] = 0
+        client_id = int(batch.column(REVIEW_CLIENT_ID_FIELD)[0])
         if client_id not in self.reviews_to_add:
             self.reviews_to_add[client_id] = []
         if client_id not in self.review_file_size:
             self.review_file_size[client_id] = 0
-        if client_id not in self.nodes_completed:
-            self.nodes_completed[client_id] = 0
-        if client_id not in self.sended_fin:
-            self.sended_fin[client_id] = False
-        if client_id not in self.total_batches:
-            self.total_batches[client_id] = 0
-        if client_id not in self.completed_reviews:
-            self.completed_reviews[client_id] = False
-        
-        self.batch_counter[client_id] += 1
-        logging.info(f"Recibiendo REVIEW - batch_counter: {self.batch_counter[client_id]}")
+
         with self.file_lock:
-            for row in batch:
-                if not row.strip():
-                    continue
-                self.reviews_to_add[client_id].append(row)
-            meta_data = {
-                "packet_id": packet_id,
-                "batch_counter": self.batch_counter[client_id],
-                "total_batches": self.total_batches[client_id],
-            }
+            # Las reviews se persisten en JSON por líneas, sea cual sea el codec de entrada
+            self.reviews_to_add[client_id].extend(batch.json_lines())
+            meta_data = {"packet_id": packet_id}
             data_to_send = json.dumps(meta_data) +'\n' + '\n'.join(self.reviews_to_add[client_id])
             self.fault_manager.append(f"review_filter_{self.reviews_input_queue[0]}_{client_id}", data_to_send)
             
@@ -239,37 +238,82 @@ class GameReviewFilter:
             self.review_file_size[client_id] += 1
 
             if self.review_file_size[client_id] >= 2000:
-                print("Procesando reviews para cliente {client_id}", flush=True)
+                logging.info(f"Procesando reviews para cliente {client_id}")
                 self.review_file_size[client_id] = 0
                 self.process_reviews(
                     f"review_filter_{self.reviews_input_queue[0]}_{client_id}",
                     client_id,
                 )
 
-                    
-        if (self.nodes_completed[client_id] == self.previous_review_nodes) and not self.sended_fin[client_id]:
-            if self.batch_counter[client_id] >= self.total_batches[client_id] and self.total_batches[client_id] != 0:
-                
-                print("Fin de la transmisión de datos batches",self.batch_counter[client_id],flush=True)
-                with self.file_lock:
-                    self.save_last_reviews(client_id)
-                    self.process_reviews(f"review_filter_{self.reviews_input_queue[0]}_{client_id}", client_id)
-                    self.send_fin(client_id)
-                self.sended_fin[client_id] = True
-                self.fault_manager.delete_key(f"game_filter_{self.reviews_input_queue[0]}_{client_id}")
-                self.fault_manager.delete_key(f"processed_packets_{self.reviews_input_queue[0]}")
+        # Después de persistir: si era el último lote, la barrera cierra el cliente
+        self.review_barrier.batch_received(client_id, packet_id=str(packet_id))
+
+    def _reviews_completed(self, client_id):
+        """
+        Llegaron los FIN de todos los nodos anteriores y todos sus lotes:
+        procesa lo que queda del cliente y manda el FIN.
+        """
+        client_id = int(client_id)
+        self.completed_reviews[client_id] = True
+        if self.sended_fin.get(client_id):
+            return
+        logging.info(f"Fin de la transmisión de reviews para cliente {client_id}")
+        with self.file_lock:
+            self.reviews_to_add.setdefault(client_id, [])
+            self.save_last_reviews(client_id)
+            self.process_reviews(f"review_filter_{self.reviews_input_queue[0]}_{client_id}", client_id)
+            self.send_fin(client_id)
+            self.sended_fin[client_id] = True
+            self.fault_manager.discard(f"game_filter_{self.reviews_input_queue[0]}_{client_id}")
+            self.fault_manager.discard(f"processed_packets_{self.reviews_input_queue[0]}")
 
-        
     def send_fin(self, client_id):
-        # print("envío fin", flush=True)
         self.reviews_middleware.send(Fin(0, client_id).encode(), routing_key="games_reviews_queue_0")
         self.reviews_middleware.send(Fin(0, client_id).encode(), routing_key="games_reviews_action_queue_3")
         for i in range(1, self.amount_of_language_filters + 1):
             routing = f"games_reviews_action_queue_{i}_0"
-            print("Enviando FIN - ", routing, flush=True)
             self.reviews_middleware.send(data=Fin(0, client_id).encode(), routing_key=routing)
         
         
+    def send_cancel(self, client_id):
+        """
+        Manda la cancelación del cliente por las mismas colas que el FIN.
+        """
+        self.reviews_middleware.send_cancel(client_id, routing_key="games_reviews_queue_0")
+        self.reviews_middleware.send_cancel(client_id, routing_key="games_reviews_action_queue_3")
+        for i in range(1, self.amount_of_language_filters + 1):
+            self.reviews_middleware.send_cancel(client_id, routing_key=f"games_reviews_action_queue_{i}_0")
+
+    def _forget_client(self, client_id):
+        """
+        Libera los juegos, las reviews y el progreso de un cliente cancelado.
+        """
+        with self.file_lock:
+            self.games.pop(client_id, None)
+            for state in (
+                self.completed_games, self.completed_reviews, self.sended_fin, self.reviews_to_add,
+                self.review_file_size, self.last_processed_packet,
+            ):
+                state.pop(client_id, None)
+            self.review_barrier.forget(client_id)
+            self.fault_manager.discard(f"game_filter_{self.reviews_input_queue[0]}_{client_id}")
+            self.fault_manager.discard(f"review_filter_{self.reviews_input_queue[0]}_{client_id}")
+
+    def handle_game_cancel(self, client_id):
+        """
+        Cancelación por la entrada de juegos: solo libera el estado; la
+        salida sale de las reviews y el cancel sigue por ese lado.
+        """
+        self._forget_client(int(client_id))
+
+    def handle_review_cancel(self, client_id):
+        """
+        Cancelación por la entrada de reviews: libera el estado y la pasa a
+        los nodos siguientes, detrás de lo último que se mandó del cliente.
+        """
+        self._forget_client(int(client_id))
+        self.send_cancel(client_id)
+
     def handle_game_eof(self, message):
         """
         Maneja el mensaje de fin de juegos.
@@ -278,21 +322,14 @@ class GameReviewFilter:
         fin = Fin.decode(message)
 
         client_id = int(fin.client_id)
-        # print("Recibiendo EOF - ", type(client_id), flush=True)
 
         self.completed_games[client_id] = True
-        if client_id not in self.batch_counter:
-            self.batch_counter[client_id] = 0
         if client_id not in self.reviews_to_add:
             self.reviews_to_add[client_id] = []
         if client_id not in self.review_file_size:
             self.review_file_size[client_id] = 0
-        if client_id not in self.nodes_completed:
-            self.nodes_completed[client_id] = 0
         if client_id not in self.sended_fin:
             self.sended_fin[client_id] = False
-        if client_id not in self.total_batches:
-            self.total_batches[client_id] = 0
         if client_id not in self.completed_reviews:
             self.completed_reviews[client_id] = False
 
@@ -311,72 +348,25 @@ class GameReviewFilter:
         """
         Guarda las reviews restantes en el archivo.
         """
-        # print(" EOF Recibiendo- ", flush=True)
         self.fault_manager.append(f"review_filter_{self.reviews_input_queue[0]}_{client_id}", '\n'.join(self.reviews_to_add[client_id]))
 
         self.reviews_to_add[client_id] = []
 
     def handle_review_eof(self, message):
         """
-        Maneja el mensaje de fin de reviews y asegura que todas las reviews se escriban en el archivo.
+        Maneja el FIN de reviews de un nodo anterior: la barrera suma los lotes
+        que anuncia cada uno y cierra el cliente cuando llegaron todos.
         """
+        self.review_barrier.fin_received(Fin.decode(message))
 
-        message_fin = Fin.decode(message)
-        client_id = int(message_fin.client_id)
-        if client_id not in self.batch_counter:
-            self.batch_counter[client_id] = 0
-        if client_id not in self.reviews_to_add:
-            self.reviews_to_add[client_id] = []
-        if client_id not in self.review_file_size:
-            self.review_file_size[client_id] = 0
-        if client_id not in self.nodes_completed:
-            self.nodes_completed[client_id] = 0
-        if client_id not in self.sended_fin:
-            self.sended_fin[client_id] = False
-        if client_id not in self.total_batches:
-            self.total_batches[client_id] = 0
-        if client_id not in self.completed_reviews:
-            self.completed_reviews[client_id] = False
-        self.completed_reviews[client_id] = True
-        self.nodes_completed[client_id] += 1
-        self.total_batches[client_id] = int(message_fin.batch_id)
-        # print("Recibiendo EOF - counter nodes_completed", self.nodes_completed[client_id] , flush=True)
-        # print("Recibiendo EOF - Client_id", client_id, flush=True)
-        # print("Recibiendo EOF - TypeBatch_id", type(message_fin.batch_id), flush=True)
-        # print("Recibiendo EOF - Batch_id", message_fin.batch_id, flush=True)
-        # print("Recibiendo EOF - TypeTotalBatch", type(self.total_batches[client_id]), flush=True)
-        # print("Recibiendo EOF - TotalBatch", self.total_batches[client_id], flush=True)
-        
-
-        if (self.nodes_completed[client_id] == self.previous_review_nodes) and not self.sended_fin[client_id]:
-            if self.batch_counter[client_id] >= self.total_batches[client_id]:
-                print(
-                    "Fin de la transmisión de datos batches",
-                    self.batch_counter[client_id],
-                    flush=True,
-                    
-                )
-                with self.file_lock:
-                    self.save_last_reviews(client_id)
-
-                    self.process_reviews(
-                        f"review_filter_{self.reviews_input_queue[0]}_{client_id}",
-                        message_fin.client_id,
-                    )
-
-                    self.send_fin(client_id)
-                    self.sended_fin[client_id] = True
-                    self.fault_manager.delete_key(f"game_filter_{self.reviews_input_queue[0]}_{client_id}")
-                    self.fault_manager.delete_key(f"processed_packets_{self.reviews_input_queue[0]}")
-                    
     def process_reviews(self, key, client_id):
         """
         Procesa las reviews y realiza el join con los juegos específicos del client_id.
         """
         client_games = self.games.get(int(client_id), {})
         batch_size = 200
-        final_list = str(self.packet_id) + "\n"
-        final_list_action = str(self.action_packet_id) + "\n"
+        final_list = []
+        final_list_action = []
         batch_counter = 0
         data = self.fault_manager.get(key)
         if data is None:
@@ -395,7 +385,7 @@ class GameReviewFilter:
             try: 
                 json_data = json.loads(line)
             
-                if isinstance(json_data, dict) and all(key in json_data for key in ["packet_id", "batch_counter", "total_batches"]):
+                if isinstance(json_data, dict) and "packet_id" in json_data:
                     continue
                 review = Review.decode(json_data)
                 #logging.info(f"Procesando review - {type(review.client_id)}(STR) - {type(review.game_id) (STR)}")
@@ -404,44 +394,38 @@ class GameReviewFilter:
                     game = client_games[review.game_id]
                     if "action" in self.games_input_queue[1].lower():
                         game_review = GameReview(review.game_id, game, review.review_text, review.client_id)
-                        game_str = json.dumps(game_review.getData())
-                        #data_to_send = f"{self.action_packet_id}\n{game_str}\n"
-                        final_list_action += f"{game_str}\n"
+                        final_list_action.append(game_review.getData())
                         batch_counter += 1
                         if (batch_counter >= batch_size):
-                            routing = f"games_reviews_action_queue_{self.next_instance}_0"
-                            self.reviews_middleware.send(data=final_list_action,routing_key=routing) # language filter
-                            self.reviews_middleware.send(data=final_list_action,routing_key="games_reviews_action_queue_3") # Percentil directo
+                            self._send_to_language_filter(client_id, final_list_action)
+                            self.reviews_middleware.send_batch(self.action_packet_id, final_list_action, routing_key="games_reviews_action_queue_3") # Percentil directo
                             self.fault_manager.update(f"processed_packets_{self.reviews_input_queue[0]}", json.dumps({"last_sended_packet": self.action_packet_id, "last_init_process_packet": initial_packet}))
                             self.action_packet_id += 1
-                            self.next_instance = (self.next_instance % self.amount_of_language_filters) + 1
-                            final_list_action = str(self.action_packet_id) + "\n"
+                            final_list_action = []
                             batch_counter = 0                    
                     else:
                         game_review = GameReview(review.game_id, game, None, review.client_id)
-                        game_str = json.dumps(game_review.getData())
-                        final_list += f"{game_str}\n"
+                        final_list.append(game_review.getData())
                         batch_counter += 1
                         if (batch_counter >= batch_size):
                             logging.info(f"Enviando paquete {self.packet_id}")
-                            self.reviews_middleware.send(final_list, routing_key="games_reviews_queue_0")
+                            self.reviews_middleware.send_batch(self.packet_id, final_list, routing_key="games_reviews_queue_0")
                             self.fault_manager.update(f"processed_packets_{self.reviews_input_queue[0]}", json.dumps({"last_sended_packet": self.packet_id, "last_init_process_packet": indie_initial_packet}))
                             self.packet_id += 4
-                            final_list = str(self.packet_id) + "\n"
+                            final_list = []
                             batch_counter = 0
                 else:
                     pass
             except json.JSONDecodeError as e:
                 logging.error(f"Error al procesar la línea '{line}': {e}")
         
-        if final_list and "action" not in self.games_input_queue[1].lower():
-            self.reviews_middleware.send(final_list, routing_key="games_reviews_queue_0")
+        if "action" not in self.games_input_queue[1].lower():
+            self.reviews_middleware.send_batch(self.packet_id, final_list, routing_key="games_reviews_queue_0")
             self.fault_manager.update(f"processed_packets_{self.reviews_input_queue[0]}", json.dumps({"last_sended_packet": self.packet_id, "last_init_process_packet": indie_initial_packet}))
             self.packet_id += 4
-        if final_list_action and "action" in self.games_input_queue[1].lower():
-            routing = f"games_reviews_action_queue_{self.next_instance}_0"
-            self.reviews_middleware.send(data=final_list_action,routing_key=routing) # language filter
-            self.reviews_middleware.send(data=final_list_action,routing_key="games_reviews_action_queue_3")
+        if "action" in self.games_input_queue[1].lower():
+            self._send_to_language_filter(client_id, final_list_action)
+            self.reviews_middleware.send_batch(self.action_packet_id, final_list_action, routing_key="games_reviews_action_queue_3")
             self.fault_manager.update(f"processed_packets_{self.reviews_input_queue[0]}", json.dumps({"last_sended_packet": self.action_packet_id, "last_init_process_packet": initial_packet}))
             self.action_packet_id += 1
             
@@ -452,6 +436,30 @@ class GameReviewFilter:
         else:
             self.fault_manager.update(f"processed_packets_{self.reviews_input_queue[0]}", json.dumps({"last_sended_packet": self.packet_id, "last_init_process_packet": self.packet_id}))
         logging.info(f"[PROCESS REVIEW] Reviews procesadas para cliente {client_id} - {self.action_packet_id} - {self.packet_id}")
+    def _send_to_language_filter(self, client_id, rows):
+        """
+        Manda el lote a un language filter sin las reviews de juegos que el
+        acumulador ya resolvió. El percentil recibe el lote completo aparte.
+        """
+        if self.resolved is not None:
+            resolved = self.resolved.resolved(client_id)
+            if resolved:
+                rows = [row for row in rows if str(row[GAME_REVIEW_GAME_ID_FIELD]) not in resolved]
+                if not rows:
+                    return
+        self.reviews_middleware.send_batch(self.action_packet_id, rows, routing_key=self._language_filter_routing()) # language filter
+
+    def _language_filter_routing(self):
+        """
+        Routing key del language filter que recibe el próximo lote. El FIN
+        va a todas las instancias, así que no depende de a cuál fue cada lote.
+        """
+        if self.language_router is not None:
+            return self.language_router.choose()
+        routing = f"games_reviews_action_queue_{self.next_instance}_0"
+        self.next_instance = (self.next_instance % self.amount_of_language_filters) + 1
+        return routing
+
     def start(self):
         """
         Inicia el proceso de join.
@@ -13,8 +13,9 @@ def main():
     output_exchanges = json.loads(os.getenv("OUTPUT_EXCHANGES")) or []
     previous_review_nodes = json.loads(os.getenv("PREVIOUS_REVIEW_NODES", "[]"))
     amount_of_language_filters = int(os.getenv("AMOUNT_OF_LANGUAGE_FILTERS", "0"))
+    load_aware_routing = os.getenv("LOAD_AWARE_ROUTING", "false").lower() == "true"
     instance_id = '1'
-    gameReviewFilter = GameReviewFilter(input_game_queue,input_review_queue, output_exchanges, [], instance_id,previous_review_nodes, amount_of_language_filters)
+    gameReviewFilter = GameReviewFilter(input_game_queue,input_review_queue, output_exchanges, [], instance_id,previous_review_nodes, amount_of_language_filters, load_aware_routing)
 
     gameReviewFilter.start()
     threads_to_check = [gameReviewFilter.games_receiver, gameReviewFilter.reviews_receiver]
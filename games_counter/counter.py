@@ -1,6 +1,7 @@
 import logging
 from collections import defaultdict
 from common.game import Game
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
 from common.packet_fin import Fin
 import json
@@ -16,7 +17,7 @@ class GamesCounter:
         self.fault_manager = FaultManager(storage_dir="../persistence/")
         self.platform_counts = defaultdict(lambda: {'Windows': 0, 'Mac': 0, 'Linux': 0})
         self.init_state()
-        self.middleware = Middleware(input_queues, [], output_exchanges, instance_id, self._callBack, self._finCallBack, self.fault_manager)
+        self.middleware = Middleware(input_queues, [], output_exchanges, instance_id, self._callBack, self._finCallBack, self.fault_manager, cancelCallback=self._cancelCallBack)
         self.last_client_id = None
         self.processed_batches = []
         self.last_processed_packet = None
@@ -68,17 +69,15 @@ class GamesCounter:
         """
         try:
             logging.info(f"Mensaje recibido para procesamiento: {data}")
-            batch = data.split('\n')
-            packet_id = batch[0]
+            batch = decode_batch(data)
+            packet_id = batch.packet_id
             print("Packet ID: ", packet_id, flush=True)
             if packet_id == self.last_processed_packet:
                 logging.warning(f"Paquete {packet_id} ya fue procesado, saltando...")
                 return
-            batch = batch[1:]
-            for row in batch:
+            for row in batch.rows():
                 try:
-                    json_row = json.loads(row)
-                    game = Game.decode(json_row)
+                    game = Game.decode(row)
                     self.counterGames(game)
                 except Exception as e:
                     logging.error(f"Error al procesar la fila '{row}': {e}")
@@ -122,6 +121,14 @@ class GamesCounter:
         except Exception as e:
             logging.error(f"Error al procesar el mensaje de fin: {e}")
 
+    def _cancelCallBack(self, client_id):
+        """
+        El cliente se canceló: se descartan sus cuentas.
+        """
+        client_id = int(client_id)
+        self.platform_counts.pop(client_id, None)
+        self.fault_manager.discard(f"platforms_counter_{client_id}")
+
     def start(self):
         """
         Inicia el middleware.
@@ -0,0 +1,149 @@
+# gateway/broker_pool.py
+
+import logging
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from common.middleware import FLOW_WATCH_QUEUES, NODE_NAME, Middleware
+
+# Cada cuánto se atienden los heartbeats de las conexiones ociosas (segundos)
+POOL_MAINTENANCE_INTERVAL = 10
+# Cada cuánto revisa su stop_event un flujo que espera crédito o su conexión (segundos)
+CHECKOUT_POLL_INTERVAL = 0.5
+
+
+class CheckoutCancelled(Exception):
+    """
+    El flujo se detuvo mientras esperaba crédito o su conexión.
+    """
+
+
+class PooledPublisher:
+    """
+    Conexión del pool: un Middleware de solo publicación con su lock.
+    Cada conexión es un productor aparte: sus secuencias salen en el orden
+    de su canal, sin mezclarse con las de las otras conexiones.
+    """
+
+    def __init__(self, index: int, exchanges: dict[str, str], output_queues: list[str]):
+        self.index = index
+        self.lock = threading.Lock()
+        # El crédito de backpressure lo pide el pool antes de prestarla (ver BrokerPool.checkout)
+        self.middleware = Middleware(output_queues=output_queues, producer_name=f"{NODE_NAME}.{index}", flow_watch_queues=[])
+        for exchange, exchange_type in exchanges.items():
+            self.middleware.declare_exchange(exchange, exchange_type)
+        self.last_used = time.monotonic()
+
+
+class BrokerPool:
+    """
+    Pool de conexiones al broker compartido por todos los ConnectionHandler
+    del gateway para publicar.
+
+    Cada flujo (handler, exchange) se asigna siempre a la misma conexión,
+    de modo que sus mensajes (datos y luego el FIN) mantienen el orden; los
+    flujos de distintos clientes se reparten entre las conexiones del pool.
+    Las conexiones se abren a demanda.
+
+    El control de flujo (FLOW_WATCH_QUEUES) es uno para todo el pool, con
+    su propia conexión: el crédito se pide antes de tomar una conexión, así
+    un flujo frenado por backpressure no retiene el lock de la conexión
+    que comparte con otros flujos.
+    """
+
+    def __init__(self, size: int, exchanges: dict[str, str], output_queues: list[str] = []):
+        self.size = size
+        self.exchanges = exchanges
+        self.output_queues = output_queues
+        self.publishers: list[PooledPublisher] = [None] * size
+        self.create_lock = threading.Lock()
+        self.flow_lock = threading.Lock()
+        self.flow_middleware = Middleware(flow_watch_queues=FLOW_WATCH_QUEUES) if FLOW_WATCH_QUEUES else None
+        self.shutdown_event = threading.Event()
+        self.maintenance_thread = threading.Thread(target=self._maintenance, name="broker_pool_maintenance", daemon=True)
+        self.maintenance_thread.start()
+
+    def _slot_for(self, key) -> int:
+        return zlib.crc32(repr(key).encode()) % self.size
+
+    def _get_publisher(self, slot: int) -> PooledPublisher:
+        publisher = self.publishers[slot]
+        if publisher is None:
+            with self.create_lock:
+                publisher = self.publishers[slot]
+                if publisher is None:
+                    logging.info(f"Abriendo conexión {slot} del pool")
+                    publisher = PooledPublisher(slot, self.exchanges, self.output_queues)
+                    self.publishers[slot] = publisher
+        return publisher
+
+    @staticmethod
+    def _lock(lock: threading.Lock, stop_event: threading.Event = None):
+        while not lock.acquire(timeout=CHECKOUT_POLL_INTERVAL):
+            if stop_event is not None and stop_event.is_set():
+                raise CheckoutCancelled()
+
+    @contextmanager
+    def checkout(self, key, stop_event: threading.Event = None):
+        """
+        Presta en exclusiva el Middleware asignado al flujo `key`, después
+        de obtener crédito para publicar. Si `stop_event` se activa mientras
+        espera (crédito o la conexión) levanta CheckoutCancelled sin prestarla.
+        """
+        if self.flow_middleware is not None:
+            self._lock(self.flow_lock, stop_event)
+            try:
+                granted = self.flow_middleware.flow.acquire(stop_event)
+            finally:
+                self.flow_lock.release()
+            if not granted:
+                raise CheckoutCancelled()
+        publisher = self._get_publisher(self._slot_for(key))
+        self._lock(publisher.lock, stop_event)
+        try:
+            if stop_event is not None and stop_event.is_set():
+                raise CheckoutCancelled()
+            yield publisher.middleware
+            publisher.last_used = time.monotonic()
+        finally:
+            publisher.lock.release()
+
+    def _maintenance(self):
+        # Las BlockingConnection solo responden heartbeats cuando procesan
+        # eventos: las conexiones que no publican hace rato se atienden acá.
+        while not self.shutdown_event.wait(POOL_MAINTENANCE_INTERVAL):
+            if self.flow_middleware is not None and self.flow_lock.acquire(blocking=False):
+                try:
+                    self.flow_middleware.connection.process_data_events()
+                except Exception as e:
+                    logging.error(f"Error atendiendo la conexión de control de flujo del pool: {e}")
+                finally:
+                    self.flow_lock.release()
+            for publisher in self.publishers:
+                if publisher is None:
+                    continue
+                if time.monotonic() - publisher.last_used < POOL_MAINTENANCE_INTERVAL:
+                    continue
+                if not publisher.lock.acquire(blocking=False):
+                    continue
+                try:
+                    publisher.middleware.connection.process_data_events()
+                except Exception as e:
+                    logging.error(f"Error atendiendo la conexión {publisher.index} del pool: {e}")
+                finally:
+                    publisher.lock.release()
+
+    def close(self):
+        self.shutdown_event.set()
+        if self.flow_middleware is not None:
+            with self.flow_lock:
+                self.flow_middleware.stop()
+        for publisher in self.publishers:
+            if publisher is None:
+                continue
+            with publisher.lock:
+                try:
+                    publisher.middleware.stop()
+                except Exception as e:
+                    logging.error(f"Error cerrando la conexión {publisher.index} del pool: {e}")
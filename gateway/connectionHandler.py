@@ -3,7 +3,7 @@
 import json
 import logging
 import os
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 import random
 import sys
 import uuid
@@ -12,8 +12,11 @@ from common.middleware import Middleware
 from common.protocol import Protocol
 from common.constants import MAX_QUEUE_SIZE
 from common.review import Review
+from common.batch_codec import encode_batch, codec_for
 from common.packet_fin import Fin
+from common.checkpoint import CHECKPOINT_INTERVAL, current_epoch
 from common.utils import split_complex_string
+from broker_pool import CheckoutCancelled
 import csv
 import io
 import threading
@@ -23,6 +26,11 @@ import time
 input_queues: dict = json.loads(os.getenv("INPUT_QUEUES", "{}"))
 output_exchanges = json.loads(os.getenv("OUTPUT_EXCHANGES", "[]"))
 instance_id = os.getenv("INSTANCE_ID", "0")
+# Lotes en espera por cola interna del handler. Con las colas llenas se deja
+# de leer el socket y el cliente queda frenado por TCP (backpressure).
+GATEWAY_QUEUE_SIZE = int(os.getenv("GATEWAY_QUEUE_SIZE", "64"))
+# Espera máxima por cada publicador al cancelar un cliente (segundos)
+SENDER_STOP_TIMEOUT = 10
 
 def check_existing_file(self, client_id):
     path = f'../results_gateway/results_client_id_{client_id}.json'
@@ -56,19 +64,25 @@ def modify_queue_key(suffix: str) -> dict:
     return {new_key: original_value}
 
 class ConnectionHandler:
-    def __init__(self, client_socket, address, amount_of_review_instances, duplication_prob):
+    def __init__(self, client_socket, address, amount_of_review_instances, duplication_prob, broker_pool):
         self.id_reviews = 0
+        self.broker_pool = broker_pool
         self.client_socket = client_socket
         self.address = address
         self.protocol = Protocol(self.client_socket)
-        self.reviews_from_client_queue = Queue(maxsize=MAX_QUEUE_SIZE)
-        self.reviews_from_client_queue_to_positive = Queue(maxsize=MAX_QUEUE_SIZE)
-        self.reviews_to_process_queue = Queue(maxsize=MAX_QUEUE_SIZE)
-        self.games_from_client_queue = Queue(maxsize=MAX_QUEUE_SIZE)
+        self.reviews_from_client_queue = Queue(maxsize=GATEWAY_QUEUE_SIZE)
+        self.reviews_from_client_queue_to_positive = Queue(maxsize=GATEWAY_QUEUE_SIZE)
+        self.reviews_to_process_queue = Queue(maxsize=GATEWAY_QUEUE_SIZE)
+        self.games_from_client_queue = Queue(maxsize=GATEWAY_QUEUE_SIZE)
         self.result_to_client_queue = Queue(maxsize=MAX_QUEUE_SIZE)
         self.amount_of_review_instances = amount_of_review_instances
         self.completed_games:dict = {}
-        self.next_instance = 0
+        # Los lotes hacia los positivity filters van por turno a las instancias 1..N
+        self.next_instance = 1
+        self.positive_batches: dict = {}
+        self.review_batches = 0
+        # Última marca de checkpoint mandada por cada exchange de salida
+        self.barrier_epochs: dict = {}
         self.remaining_responses = 5
         self.filtrados = 0
         self.client_id = -1
@@ -82,6 +96,8 @@ class ConnectionHandler:
         self.gamesHeader = []
         self.shutdown_event = threading.Event()
         self.client_results_sent = False
+        # Si el cliente se va antes del FIN, se cancela su carga en todo el pipeline
+        self.upload_finished = False
         # Thread para manejar la conexión
         self.thread = threading.Thread(target=self.handle_connection, name=f"ConnectionHandler-{self.address}")
         self.thread.daemon = True
@@ -112,7 +128,7 @@ class ConnectionHandler:
         # Inicializar y arrancar hilos secundarios
         self.games_middleware_sender_thread = threading.Thread(
             target=self.__middleware_sender,
-            args=(self.games_from_client_queue, "games", [], 1, 'fanout'),
+            args=(self.games_from_client_queue, "games"),
             name="games_middleware_sender",
             daemon=True
         )
@@ -124,13 +140,13 @@ class ConnectionHandler:
         )
         self.review_middleware_sender_thread = threading.Thread(
             target=self.__middleware_sender,
-            args=(self.reviews_from_client_queue, "reviews", [], 1, 'direct'),
+            args=(self.reviews_from_client_queue, "reviews"),
             name="reviews_middleware_sender",
             daemon=True
         )
         self.review_middleware_sender_thread_positive = threading.Thread(
             target=self.__middleware_sender,
-            args=(self.reviews_from_client_queue_to_positive, "to_positive_review", [], 1, 'direct'),
+            args=(self.reviews_from_client_queue_to_positive, "to_positive_review"),
             name="reviews_middleware_sender_positive",
             daemon=True
             
@@ -211,57 +227,75 @@ class ConnectionHandler:
                         fin_msg = Fin.decode(data)
                         print("Fin de la transmisión, enviando data", fin_msg.encode(), flush=True)
                         logging.info("Fin de la transmisión de datos")
+                        self.upload_finished = True
                         self.protocol.send_message("OK - ACK de fin")
-                        self.reviews_from_client_queue.put(Fin(self.batch_id_reviews, self.client_id).encode())
-                        self._fin_sender(fin_msg.encode())
+                        # El FIN pasa por process_review detrás de los lotes del cliente,
+                        # así sale con la cantidad de lotes que se publicaron
+                        self._put(self.reviews_to_process_queue, Fin(0, self.client_id))
                         break
 
                     if data_type == "reviews":
                         self.batch_id_reviews += 1
-                        self.reviews_to_process_queue.put(parts[1:])
+                        self._put(self.reviews_to_process_queue, parts[1:])
                         self.protocol.send_message("OK\n\n")
                         if not parts[1] in self.completed_games:
-                            self.games_from_client_queue.put(Fin(0, int(parts[1])).encode()) 
+                            self._put(self.games_from_client_queue, Fin(0, int(parts[1])).encode()) 
                             self.completed_games[parts[1]] = True
                     if data_type == "games":
                         games_list = parts[2].strip().split("\n")
-                        finalList = str(self.packet_id) + "\n"
+                        rows = []
                         for row in games_list:
                             try:
                                 game = Game.from_csv_row(row, int(parts[1]))
                                 if game.checkNanElements():
                                     continue
-                                game_str = json.dumps(game.getData())
-                                finalList += f"{game_str}\n"
+                                rows.append(game.getData())
                             except Exception as e:
                                 logging.error(f"Error al procesar la fila: {row}, error: {e}")
                                 continue
+                        finalList = encode_batch(self.packet_id, rows, codec_for("games"))
                         if finalList:
                             logging.info(f"Enviando los siguientes datos a la cola: {finalList[:50]}...")
                         else:
                             logging.info("No hay datos para enviar después del filtrado.")
-                        self.games_from_client_queue.put(finalList)
+                        self._put(self.games_from_client_queue, finalList)
                         self.protocol.send_message("OK\n\n")
                         if random.random() < self.duplication_prob:
                             logging.info(f"Paquete duplicado - {self.packet_id}")
-                            self.games_from_client_queue.put(finalList)
+                            self._put(self.games_from_client_queue, finalList)
                         self.packet_id = uuid.uuid4()
                 except Exception as e:
                     logging.error(f"Error al procesar el CSV: {e}")
                     self.protocol.send_message("Error processing data")
 
             logging.info(f"Fin del recibo de datos {self.address}")
-            if not self.client_results_sent:
+            if self.client_id != -1 and not self.upload_finished:
+                self._cancel_client()
+            elif not self.client_results_sent:
                 self._send_results()
                 #self.shutdown()
         except Exception as e:
             logging.error(f"Error en la conexión con {self.address}: {e}")
+            if self.client_id != -1 and not self.upload_finished:
+                self._cancel_client()
             #self.shutdown()
         finally:
             logging.info("Conexión cerrada.")
             #self.shutdown()
             #self.shutdown_event.set()
     
+    def _put(self, packet_queue: Queue, item):
+        """
+        Encola un lote esperando lugar. Mientras la cola está llena no se
+        lee el socket, así que el cliente no recibe el OK del lote y frena.
+        """
+        while not self.shutdown_event.is_set():
+            try:
+                packet_queue.put(item, timeout=1)
+                return
+            except Full:
+                logging.debug("Cola interna llena, esperando a los publicadores")
+
     def _send_old_results(self):
         try:
             logging.info("Enviando resultados antiguos al cliente")
@@ -301,46 +335,119 @@ class ConnectionHandler:
         finally:
             self.shutdown()  # Ensure shutdown is called
 
-    def _fin_sender(self, msg):
-        middleware = Middleware(
-            output_exchanges=['to_positive_review'],
-            output_queues=['to_positive_review_1_0', 'to_positive_review_2_0', 'to_positive_review_3_0', 'to_positive_review_4_0'],
-            amount_output_instances=1,
-            exchange_output_type='direct'
-        )
-        fin_msg = Fin(self.batch_id_reviews, self.client_id)
-        for i in range(4):
-            routing = f"to_positive_review_{i+1}_0"
+    def _fin_sender(self, middleware):
+        """
+        Manda el FIN a cada positivity filter con la cantidad de lotes que
+        recibió esa instancia, para su barrera de EOF.
+        """
+        for i in range(1, self.amount_of_review_instances + 1):
+            routing = f"to_positive_review_{i}_0"
             logging.info(f"Sending to FIN {routing}")
-            middleware.send(fin_msg.encode(), routing_key=f"to_positive_review_{i+1}_0")
+            fin_msg = Fin(self.positive_batches.get(i, 0), self.client_id)
+            middleware.send_to_exchange('to_positive_review', fin_msg.encode(), routing_key=routing)
+
+    def _routings(self, output_exchange):
+        """
+        Routing keys por las que sale cada flujo del handler.
+        """
+        if output_exchange == 'reviews':
+            return ['reviews_queue_1']
+        if output_exchange == 'to_positive_review':
+            return [f"to_positive_review_{i}_0" for i in range(1, self.amount_of_review_instances + 1)]
+        return ['']
+
+    def _cancel_client(self):
+        """
+        El cliente se fue sin mandar el FIN: se descarta lo que quedó sin
+        publicar y se manda el cancel por cada flujo, detrás de lo ya
+        publicado, para que los nodos liberen su estado. Los resultados
+        parciales se borran, así puede volver a cargar todo con el mismo id.
+        """
+        logging.info(f"Cliente {self.client_id} desconectado antes del FIN, cancelando su carga")
+        self.shutdown()
+        self._stop_senders()
+        try:
+            for output_exchange in ('games', 'reviews', 'to_positive_review'):
+                with self.broker_pool.checkout((self.address, output_exchange)) as middleware:
+                    for routing in self._routings(output_exchange):
+                        middleware.send_cancel(self.client_id, output_exchange, routing)
+        except Exception as e:
+            logging.error(f"Error al cancelar el cliente {self.client_id}: {e}")
+        path = f'../results_gateway/results_client_id_{self.client_id}.json'
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _stop_senders(self):
+        """
+        Despierta a los publicadores (un None en sus colas; shutdown ya activó
+        el evento que interrumpe la espera de crédito o de conexión del pool),
+        los espera un rato acotado y descarta lo que haya quedado en sus colas.
+        Ningún lote del cliente sale detrás del cancel: un publicador que
+        sigue vivo está publicando con el lock de la conexión de su flujo, la
+        misma por la que sale el cancel, o sale sin publicar al tomarlo.
+        """
+        for packet_queue in (
+            self.games_from_client_queue, self.reviews_from_client_queue, self.reviews_from_client_queue_to_positive
+        ):
+            try:
+                packet_queue.put_nowait(None)
+            except Full:
+                pass
+        current_thread = threading.current_thread()
+        deadline = time.monotonic() + SENDER_STOP_TIMEOUT
+        for thread in self.active_threads:
+            if thread != current_thread:
+                thread.join(timeout=max(0, deadline - time.monotonic()))
+                if thread.is_alive():
+                    logging.warning(f"{thread.name} sigue publicando, el cancel sale detrás por su misma conexión")
+        self._clear_queues()
+
+    def _send_barrier(self, middleware, output_exchange):
+        """
+        Manda la marca de checkpoint del intervalo en curso por cada camino
+        de este flujo, una vez por intervalo. Los nodos con checkpoints toman
+        uno por marca (ignoran las repetidas de otros clientes).
+        """
+        epoch = current_epoch()
+        if epoch <= self.barrier_epochs.get(output_exchange, 0):
+            return
+        self.barrier_epochs[output_exchange] = epoch
+        for routing in self._routings(output_exchange):
+            middleware.send_barrier(epoch, output_exchange, routing)
 
-    def __middleware_sender(self, packet_queue, output_exchange, output_queues, instances, output_type):
+    def __middleware_sender(self, packet_queue, output_exchange):
         logging.info("Middleware sender started")
-        middleware = Middleware(
-            output_exchanges=[output_exchange],
-            output_queues=output_queues,
-            amount_output_instances=instances,
-            exchange_output_type=output_type
-        )
         while not self.shutdown_event.is_set():
             try:
                 packet = packet_queue.get(block=True, timeout=1)
                 if packet is None:
                     break
+                if isinstance(packet, Fin):
+                    # Solo llega por la cola de to_positive_review, detrás de los lotes del cliente
+                    with self.broker_pool.checkout((self.address, output_exchange), self.shutdown_event) as middleware:
+                        self._fin_sender(middleware)
+                    continue
                 logging.debug(f"Enviando mensaje {packet[:50]}...")
 
-                if output_exchange == 'reviews':
-                    middleware.send(data=packet, routing_key='reviews_queue_1')
-                elif output_exchange == 'to_positive_review':
-                    routing = f"to_positive_review_{self.next_instance}_0"
-                    middleware.send(data=packet, routing_key=routing)
-                    self.next_instance = (self.next_instance % 4) + 1
-                else:
-                    middleware.send(packet)
+                with self.broker_pool.checkout((self.address, output_exchange), self.shutdown_event) as middleware:
+                    if output_exchange == 'reviews':
+                        middleware.send_to_exchange(output_exchange, packet, routing_key='reviews_queue_1')
+                    elif output_exchange == 'to_positive_review':
+                        routing = f"to_positive_review_{self.next_instance}_0"
+                        middleware.send_to_exchange(output_exchange, packet, routing_key=routing)
+                        self.positive_batches[self.next_instance] = self.positive_batches.get(self.next_instance, 0) + 1
+                        self.next_instance = (self.next_instance % self.amount_of_review_instances) + 1
+                    else:
+                        middleware.send_to_exchange(output_exchange, packet)
+                    if CHECKPOINT_INTERVAL > 0:
+                        self._send_barrier(middleware, output_exchange)
                 
                 logging.debug(f"Dispatched message {packet[:50]}...")
             except Empty:
                 continue #revisar except
+            except CheckoutCancelled:
+                logging.info("Publicador detenido mientras esperaba crédito o su conexión")
+                break
             except OSError:
                 logging.error("Middleware closed")
                 break
@@ -362,21 +469,34 @@ class ConnectionHandler:
         while not self.shutdown_event.is_set():
             try:
                 packet = self.reviews_to_process_queue.get(block=True, timeout=1)
+                if isinstance(packet, Fin):
+                    self._put(self.reviews_from_client_queue, Fin(self.review_batches, packet.client_id).encode())
+                    self._put(self.reviews_from_client_queue_to_positive, packet)
+                    continue
                 data = packet[1]
                 client_id = packet[0]
                 review_list = data.strip().split("\n")
-                finalList = str(self.packet_id_review) + "\n"
+                rows = []
                 for row in review_list:
                     review = Review.from_csv_row(self.id_reviews, row, client_id)
                     if review.checkNanElements():
                         self.filtrados += 1
 
                         continue
-                    review_str = json.dumps(review.getData())
-                    finalList += f"{review_str}\n"
+                    rows.append(review.getData())
                     self.id_reviews += 1
-                self.reviews_from_client_queue.put(finalList)
-                self.reviews_from_client_queue_to_positive.put(finalList)
+                if not rows:
+                    # Un lote vacío no se publica: no cuenta para las barreras de EOF
+                    continue
+                self.review_batches += 1
+                self._put(
+                    self.reviews_from_client_queue,
+                    encode_batch(self.packet_id_review, rows, codec_for("reviews_queue_1", "reviews"))
+                )
+                self._put(
+                    self.reviews_from_client_queue_to_positive,
+                    encode_batch(self.packet_id_review, rows, codec_for("to_positive_review"))
+                )
                 self.packet_id_review = uuid.uuid4()
                 logging.info("Review batch processed")
             except Empty:
@@ -8,6 +8,7 @@ import configparser
 import socket
 import threading
 from connectionHandler import ConnectionHandler
+from broker_pool import BrokerPool
 from common.healthcheck import HealthCheckServer
 
 def load_config(config_file='config.ini'):
@@ -35,6 +36,15 @@ def setup_logging(level, log_file):
     )
     logging.info("Logging configurado.")
 
+# Exchanges en los que publica el gateway y su tipo
+GATEWAY_EXCHANGES = {"games": "fanout", "reviews": "direct", "to_positive_review": "direct"}
+
+def gateway_output_queues(amount_of_review_instances):
+    """
+    Colas de los filtros de positividad, una por instancia de reviews.
+    """
+    return [f"to_positive_review_{i}_0" for i in range(1, amount_of_review_instances + 1)]
+
 def start_server(config, shutdown_event, active_connections):
     """
     Inicia el servidor que escucha por conexiones entrantes y maneja cada conexión.
@@ -47,6 +57,9 @@ def start_server(config, shutdown_event, active_connections):
     logging.info(f"Gateway escuchando en {config['gateway_IP']}:{config['gateway_PORT']}")
     amount_of_review_instances = int(os.getenv("AMOUNT_OF_REVIEW_INSTANCE", 1))
     duplication_prob = float(os.getenv("DUPLICATION_PROB", 0.0))
+    broker_pool = BrokerPool(
+        int(os.getenv("BROKER_POOL_SIZE", 4)), GATEWAY_EXCHANGES, gateway_output_queues(amount_of_review_instances)
+    )
     
     server.settimeout(1.0)  # Timeout para permitir verificar el shutdown_event
     
@@ -55,12 +68,13 @@ def start_server(config, shutdown_event, active_connections):
             logging.debug("Esperando conexión...")
             client_sock, address = server.accept()
             logging.info(f"Conexión aceptada de {address[0]}:{address[1]}")
-            handler = ConnectionHandler(client_sock, address, amount_of_review_instances, duplication_prob)
+            handler = ConnectionHandler(client_sock, address, amount_of_review_instances, duplication_prob, broker_pool)
             active_connections.append(handler)
         except socket.timeout:
             continue  # Verificar nuevamente el shutdown_event
         except Exception as e:
             logging.error(f"Error al aceptar conexiones: {e}")
+    broker_pool.close()
 
 
 def main():
@@ -1,9 +1,253 @@
 import configparser
+import json
 import yaml
 import re
 
 
-def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3, duplication_prob=0, timeout_doctors=15):
+def prefetch_environment(prefetch_config, node):
+    """
+    Variables de entorno de la ventana de prefetch/acks para un tipo de nodo.
+    """
+    if not prefetch_config or node not in prefetch_config:
+        return []
+    return [
+        f"PREFETCH_COUNT={prefetch_config[node]}",
+        f"ACK_WINDOW={prefetch_config['ack_window']}",
+    ]
+
+
+def compression_environment(compression_config, exchanges):
+    """
+    Variables de entorno para comprimir lo que un nodo publica en `exchanges`.
+    """
+    if not compression_config or compression_config.get("enabled", "false").lower() != "true":
+        return []
+    return [
+        f"COMPRESS_EXCHANGES={json.dumps(exchanges)}",
+        f"COMPRESSION_THRESHOLD={compression_config.get('threshold', '4096')}",
+        f"COMPRESSION_CODEC={compression_config.get('codec', 'zlib')}",
+    ]
+
+
+def batch_codec_environment(batch_codec_config):
+    """
+    Codec de lote por cola/exchange de destino. Lo leen los productores;
+    los consumidores detectan el formato de cada mensaje.
+    """
+    if not batch_codec_config:
+        return []
+    return [f"BATCH_CODECS={json.dumps(batch_codec_config)}"]
+
+
+def metrics_environment(metrics_config):
+    """
+    Activa las métricas del Middleware, que se consultan por el puerto del health check.
+    """
+    if not metrics_config or metrics_config.get("enabled", "false").lower() != "true":
+        return []
+    return ["METRICS_ENABLED=true"]
+
+
+def batch_delivery_environment(batch_delivery_config):
+    """
+    Tamaño y espera máxima de los grupos de entregas de los nodos con batch_callback.
+    """
+    if not batch_delivery_config:
+        return []
+    return [
+        f"BATCH_DELIVERY_SIZE={batch_delivery_config['size']}",
+        f"BATCH_DELIVERY_LINGER_MS={batch_delivery_config['linger_ms']}",
+    ]
+
+
+def flow_control_environment(flow_control_config, language_num_nodes):
+    """
+    Backpressure del gateway: colas de los primeros consumidores de reviews
+    y de los language filters que observa antes de publicar.
+    """
+    if not flow_control_config or flow_control_config.get("enabled", "false").lower() != "true":
+        return []
+    watch_queues = (
+        ["reviews_queue_1"]
+        + [f"to_positive_review_{i}_0" for i in range(1, 5)]
+        + [f"games_reviews_action_queue_{i}_0" for i in range(1, language_num_nodes + 1)]
+    )
+    return [
+        f"FLOW_WATCH_QUEUES={json.dumps(watch_queues)}",
+        f"FLOW_HIGH_WATERMARK={flow_control_config.get('high_watermark', '1000')}",
+        f"FLOW_LOW_WATERMARK={flow_control_config.get('low_watermark', '500')}",
+        f"GATEWAY_QUEUE_SIZE={flow_control_config.get('gateway_queue_size', '64')}",
+    ]
+
+
+def queue_limit_environment(flow_control_config):
+    """
+    Largo máximo de las colas; va a todos los nodos para que las declaren igual.
+    """
+    if not flow_control_config or int(flow_control_config.get("queue_max_length", "0")) <= 0:
+        return []
+    return [f"QUEUE_MAX_LENGTH={flow_control_config['queue_max_length']}"]
+
+
+def output_batching_environment(output_batching_config):
+    """
+    Combinación de lotes de salida de los filtros sin estado.
+    """
+    if not output_batching_config or int(output_batching_config.get("linger_ms", "0")) <= 0:
+        return []
+    return [
+        f"OUTPUT_BATCH_LINGER_MS={output_batching_config['linger_ms']}",
+        f"OUTPUT_BATCH_MIN_BYTES={output_batching_config.get('min_bytes', '4096')}",
+        f"OUTPUT_BATCH_MAX_BYTES={output_batching_config.get('max_bytes', '65536')}",
+    ]
+
+
+def worker_pool_environment(worker_pool_config, node):
+    """
+    Pool de workers del Middleware para los callbacks de CPU de un tipo de nodo.
+    """
+    if not worker_pool_config or int(worker_pool_config.get(node, "0")) <= 0:
+        return []
+    return [
+        f"WORKER_POOL_SIZE={worker_pool_config[node]}",
+        f"WORKER_POOL_MODE={worker_pool_config.get('mode', 'process')}",
+    ]
+
+
+def fair_scheduling_environment(fair_scheduling_config):
+    """
+    Reparto round-robin entre clientes de las entregas de las colas compartidas.
+    """
+    if not fair_scheduling_config or fair_scheduling_config.get("enabled", "false").lower() != "true":
+        return []
+    return [
+        "FAIR_SCHEDULING=true",
+        f"FAIR_PREFETCH={fair_scheduling_config.get('prefetch', '200')}",
+        f"FAIR_WEIGHTS={fair_scheduling_config.get('weights', '{}')}",
+    ]
+
+
+def routing_environment(routing_config):
+    """
+    Reparto de los lotes de action entre los language filters: por turno o según el largo de sus colas.
+    """
+    if not routing_config or routing_config.get("language_filter", "round_robin") != "power_of_two":
+        return []
+    return [
+        "LOAD_AWARE_ROUTING=true",
+        f"ROUTING_REFRESH_INTERVAL={routing_config.get('refresh_interval', '0.5')}",
+    ]
+
+
+def checkpoint_environment(checkpoint_config):
+    """
+    Checkpoints por intervalo en lugar de persistir cada lote (gateway, camino de indie y top10).
+    """
+    if not checkpoint_config or float(checkpoint_config.get("interval", "0")) <= 0:
+        return []
+    return [
+        f"CHECKPOINT_INTERVAL={checkpoint_config['interval']}",
+        f"CHECKPOINT_MAX_PENDING={checkpoint_config.get('max_pending', '200')}",
+    ]
+
+
+# Exchanges que no son fanout (el tipo por defecto del Middleware)
+EXCHANGE_TYPES = {
+    "reviews": "direct",
+    "to_positive_review": "direct",
+    "games_reviews_indie": "direct",
+    "games_reviews_action": "direct",
+}
+
+# Variables de entorno propias de cada etapa; el resto se comparte en el contenedor co-ubicado
+STAGE_KEYS = ["INPUT_QUEUES", "OUTPUT_EXCHANGES", "OUTPUT_QUEUES", "INSTANCE_ID", "GENRE"]
+
+
+def service_environment(service):
+    return dict(item.split("=", 1) for item in service.get("environment", []))
+
+
+def consumed_exchanges(service):
+    """
+    Exchanges de los que consume un servicio, según su entorno.
+    """
+    env = service_environment(service)
+    exchanges = set(json.loads(env.get("INPUT_QUEUES", "{}")).values())
+    for key in ("INPUT_GAMES_QUEUE", "INPUT_REVIEWS_QUEUE"):
+        if key in env:
+            exchanges.add(json.loads(env[key])[1])
+    return exchanges
+
+
+def colocate_services(services, name, members):
+    """
+    Reemplaza los servicios `members` por un contenedor que los corre en un
+    proceso (colocated/): entre ellos se comunican en memoria y solo pasan
+    por RabbitMQ las colas que consumen de afuera y los exchanges que tienen
+    consumidores afuera.
+
+    Admite a lo sumo un nodo con estado: cada uno guarda en ../persistence/
+    (/persistence en el contenedor) con nombres de clave propios de su
+    código, sin prefijo por nodo, así que dos compartiendo el volumen se
+    pisarían el estado. Dos con estado van en contenedores distintos.
+    """
+    produced = set()
+    for member in members:
+        produced.update(json.loads(service_environment(services[member]).get("OUTPUT_EXCHANGES", "[]")))
+    outside = set()
+    for host, service in services.items():
+        if host not in members:
+            outside.update(consumed_exchanges(service))
+
+    stages, inbound, outbound, shared, volumes, depends_on = [], {}, {}, {}, {}, []
+    for member in members:
+        service = services.pop(member)
+        env = service_environment(service)
+        node = service["build"]["dockerfile"].split("/")[1]
+        stages.append({"name": member, "node": node, "env": {key: env[key] for key in STAGE_KEYS if key in env}})
+        instance_id = json.loads(env.get("INSTANCE_ID") or "0")
+        for queue, exchange in json.loads(env.get("INPUT_QUEUES", "{}")).items():
+            if exchange not in produced:
+                inbound[f"{queue}_{instance_id}"] = [exchange, EXCHANGE_TYPES.get(exchange, "fanout")]
+        for exchange in json.loads(env.get("OUTPUT_EXCHANGES", "[]")):
+            if exchange in outside:
+                outbound[exchange] = EXCHANGE_TYPES.get(exchange, "fanout")
+        for key, value in env.items():
+            if key not in STAGE_KEYS:
+                shared.setdefault(key, value)
+        for volume in service.get("volumes", []):
+            host_path, container_path = volume.split(":", 1)
+            if volumes.setdefault(container_path, host_path) != host_path:
+                raise ValueError(
+                    f"{name}: two stages mount {container_path}; a colocated container holds at most one stateful stage"
+                )
+        depends_on.extend(d for d in service.get("depends_on", []) if d not in members and d not in depends_on)
+
+    services[name] = {
+        "container_name": name,
+        "build": {"context": ".", "dockerfile": "./colocated/Dockerfile"},
+        "image": "colocated:latest",
+        "networks": ["testing_net"],
+        "environment": [f"{key}={value}" for key, value in shared.items()]
+        + [
+            "MIDDLEWARE_ENGINE=memory",
+            f"FUSED_STAGES={json.dumps(stages)}",
+            f"BRIDGE_INBOUND={json.dumps(inbound)}",
+            f"BRIDGE_OUTBOUND={json.dumps(outbound)}",
+        ],
+    }
+    if depends_on:
+        services[name]["depends_on"] = depends_on
+    if volumes:
+        services[name]["volumes"] = [f"{host_path}:{container_path}" for container_path, host_path in volumes.items()]
+    # Quien dependía de alguna etapa ahora depende del contenedor
+    for service in services.values():
+        if any(d in members for d in service.get("depends_on", [])):
+            replaced = [name if d in members else d for d in service["depends_on"]]
+            service["depends_on"] = list(dict.fromkeys(replaced))
+
+
+def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3, duplication_prob=0, timeout_doctors=15, prefetch_config=None, compression_config=None, batch_codec_config=None, metrics_config=None, batch_delivery_config=None, flow_control_config=None, output_batching_config=None, worker_pool_config=None, fair_scheduling_config=None, colocation_config=None, routing_config=None, checkpoint_config=None):
 
     # Base configuration
     base_config = {
@@ -41,7 +285,9 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     'OUTPUT_EXCHANGES=["games"]',
                     'INPUT_QUEUES={"result_queue_gateway": "result_queue"}',
                     f"DUPLICATION_PROB={duplication_prob}",
-                ],
+                ]
+                + compression_environment(compression_config, ["reviews", "to_positive_review"])
+                + flow_control_environment(flow_control_config, language_num_nodes),
                 "volumes": ["./results_gateway:/results_gateway"],
             },
             "games_counter": {
@@ -130,7 +376,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "LOGGING_LEVEL=INFO",
                     "POSITIVITY=1",
                     "INSTANCE_ID=0",
-                ],
+                ]
+                + compression_environment(compression_config, ["positive_reviews"])
+                + batch_delivery_environment(batch_delivery_config),
+                "volumes": ["./positivity_filter/persistence:/persistence"],
             },
             "positive_review_filter4": {
                 "container_name": "positive_review_filter4",
@@ -146,7 +395,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "LOGGING_LEVEL=INFO",
                     "POSITIVITY=1",
                     "INSTANCE_ID=0",
-                ],
+                ]
+                + compression_environment(compression_config, ["positive_reviews_4"])
+                + batch_delivery_environment(batch_delivery_config),
+                "volumes": ["./positivity_filter/persistence:/persistence"],
             },
             "positive_review_filter3": {
                 "container_name": "positive_review_filter3",
@@ -162,7 +414,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "LOGGING_LEVEL=INFO",
                     "POSITIVITY=1",
                     "INSTANCE_ID=0",
-                ],
+                ]
+                + compression_environment(compression_config, ["positive_reviews_3"])
+                + batch_delivery_environment(batch_delivery_config),
+                "volumes": ["./positivity_filter/persistence:/persistence"],
             },
             "positive_review_filter_2": {
                 "container_name": "positive_review_filter_2",
@@ -178,7 +433,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "LOGGING_LEVEL=INFO",
                     "POSITIVITY=1",
                     "INSTANCE_ID=0",
-                ],
+                ]
+                + compression_environment(compression_config, ["positive_reviews_2"])
+                + batch_delivery_environment(batch_delivery_config),
+                "volumes": ["./positivity_filter/persistence:/persistence"],
             },
             "negative_review_filter": {
                 "container_name": "negative_review_filter",
@@ -194,7 +452,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "INSTANCE_ID=1",
                     "LOGGING_LEVEL=INFO",
                     "POSITIVITY=-1",
-                ],
+                ]
+                + compression_environment(compression_config, ["negative_reviews"])
+                + batch_delivery_environment(batch_delivery_config),
+                "volumes": ["./positivity_filter/persistence:/persistence"],
             },
             "indie_game_review_filter": {
                 "container_name": "indie_game_review_filter",
@@ -211,7 +472,8 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     'INPUT_REVIEWS_QUEUE=["positive_review_queue_1","positive_reviews"]',
                     "PREVIOUS_REVIEW_NODES=1",
                     "LOGGING_LEVEL=INFO",
-                ],
+                ]
+                + prefetch_environment(prefetch_config, "game_review_filter"),
                 "volumes": ["./game_review_filter/data:/data", 
                             "./game_review_filter/persistence:/persistence"],
             },
@@ -230,7 +492,8 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     'INPUT_REVIEWS_QUEUE=["positive_review_queue_2","positive_reviews_2"]',
                     "PREVIOUS_REVIEW_NODES=1",
                     "LOGGING_LEVEL=INFO",
-                ],
+                ]
+                + prefetch_environment(prefetch_config, "game_review_filter"),
                 "volumes": ["./game_review_filter/data:/data", 
                             "./game_review_filter/persistence:/persistence"],
             },
@@ -249,7 +512,8 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     'INPUT_REVIEWS_QUEUE=["positive_review_queue_3","positive_reviews_3"]',
                     "PREVIOUS_REVIEW_NODES=1",
                     "LOGGING_LEVEL=INFO",
-                ],
+                ]
+                + prefetch_environment(prefetch_config, "game_review_filter"),
                 "volumes": ["./game_review_filter/data:/data", 
                             "./game_review_filter/persistence:/persistence"],
             },
@@ -268,7 +532,8 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     'INPUT_REVIEWS_QUEUE=["positive_review_queue_4","positive_reviews_4"]',
                     "PREVIOUS_REVIEW_NODES=1",
                     "LOGGING_LEVEL=INFO",
-                ],
+                ]
+                + prefetch_environment(prefetch_config, "game_review_filter"),
                 "volumes": ["./game_review_filter/data:/data", 
                             "./game_review_filter/persistence:/persistence"],
             },
@@ -291,7 +556,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                     "PREVIOUS_REVIEW_NODES=1",
                     "LOGGING_LEVEL=INFO",
                     f"AMOUNT_OF_LANGUAGE_FILTERS={language_num_nodes}",
-                ],
+                ]
+                + prefetch_environment(prefetch_config, "game_review_filter")
+                + compression_environment(compression_config, ["games_reviews_action"])
+                + routing_environment(routing_config),
                 "volumes": ["./game_review_filter/data:/data", 
                             "./game_review_filter/persistence:/persistence"],
             },
@@ -303,8 +571,10 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                 "environment": [
                     'OUTPUT_EXCHANGES=["result_queue"]',
                     'INPUT_QUEUES={"games_reviews_queue":"games_reviews_indie"}',
+                    "PREVIOUS_REVIEW_FILTER_NODES=4",
                     "LOGGING_LEVEL=INFO",
-                ],
+                ]
+                + batch_delivery_environment(batch_delivery_config),
                 "volumes": ["./review_counter/persistence:/persistence"],
             },
             "action_name_accumulator": {
@@ -389,11 +659,35 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
                 f'INPUT_QUEUES={{"games_reviews_action_queue_{i}":"games_reviews_action"}}',
                 "LOGGING_LEVEL=INFO",
                 "INSTANCE_ID=0",
-            ],
+            ]
+            + prefetch_environment(prefetch_config, "language_filter")
+            + worker_pool_environment(worker_pool_config, "language_filter"),
         }
 
 
     
+    # Filtros sin estado: sus lotes de salida se pueden combinar
+    stateless_filters = ["indie_filter", "action_filter", "range_filter"] + [
+        f"language_filter_{i}" for i in range(1, language_num_nodes + 1)
+    ]
+    for host in stateless_filters:
+        base_config["services"][host]["environment"].extend(output_batching_environment(output_batching_config))
+
+    # Consumidores de las colas que comparten todos los clientes (to_positive_review_N, games_reviews_action_queue_N)
+    shared_queue_consumers = [
+        host for host, service in base_config["services"].items()
+        if service.get("image") in ("positivity_filter:latest", "language_filter:latest")
+    ]
+    for host in shared_queue_consumers:
+        base_config["services"][host]["environment"].extend(fair_scheduling_environment(fair_scheduling_config))
+
+    # Las marcas salen del gateway y siguen por los filtros hasta el nodo con checkpoints
+    for host in ["gateway", "indie_filter", "range_filter", "top10_indie_counter"]:
+        base_config["services"][host]["environment"].extend(checkpoint_environment(checkpoint_config))
+
+    for name, members in (colocation_config or {}).items():
+        colocate_services(base_config["services"], name, [m.strip() for m in members.split(",") if m.strip()])
+
     not_include_host_regex = "client\\d"
     workers: list[str] = list(base_config["services"].keys())
 
@@ -402,6 +696,11 @@ def generate_yaml(num_clients, client_files, language_num_nodes, num_doctors=3,
     for host in workers:
         if not re.search(not_include_host_regex, host):
             new_workers.append(host)
+            base_config["services"][host].setdefault("environment", []).extend(
+                batch_codec_environment(batch_codec_config)
+                + metrics_environment(metrics_config)
+                + queue_limit_environment(flow_control_config)
+            )
     workers_str = ",".join(new_workers)
     print(workers_str)
 
@@ -441,6 +740,18 @@ def load_node_files(config_file="config.ini"):
     timeout_doctors = int(config["global"]["timeout_doctors"])
     language_num_nodes = int(config["language_filter"]["instances"])
     duplication_prob = float(config["duplication"]["probability"])
+    prefetch_config = dict(config["prefetch"]) if config.has_section("prefetch") else None
+    compression_config = dict(config["compression"]) if config.has_section("compression") else None
+    batch_codec_config = dict(config["batch_codec"]) if config.has_section("batch_codec") else None
+    metrics_config = dict(config["metrics"]) if config.has_section("metrics") else None
+    batch_delivery_config = dict(config["batch_delivery"]) if config.has_section("batch_delivery") else None
+    flow_control_config = dict(config["flow_control"]) if config.has_section("flow_control") else None
+    output_batching_config = dict(config["output_batching"]) if config.has_section("output_batching") else None
+    worker_pool_config = dict(config["worker_pool"]) if config.has_section("worker_pool") else None
+    fair_scheduling_config = dict(config["fair_scheduling"]) if config.has_section("fair_scheduling") else None
+    colocation_config = dict(config["colocation"]) if config.has_section("colocation") else None
+    routing_config = dict(config["routing"]) if config.has_section("routing") else None
+    checkpoint_config = dict(config["checkpoint"]) if config.has_section("checkpoint") else None
     # Collect client-specific file information
     client_files = {}
     for i in range(1, num_clients + 1):
@@ -450,12 +761,12 @@ def load_node_files(config_file="config.ini"):
             "review_file": config[client_name]["review_file"],
         }
 
-    return num_clients, client_files, language_num_nodes, duplication_prob, num_doctors, timeout_doctors
+    return num_clients, client_files, language_num_nodes, duplication_prob, num_doctors, timeout_doctors, prefetch_config, compression_config, batch_codec_config, metrics_config, batch_delivery_config, flow_control_config, output_batching_config, worker_pool_config, fair_scheduling_config, colocation_config, routing_config, checkpoint_config
 
 
 # Ejemplo de uso
 if __name__ == "__main__":
-    num_clients, client_files, language_num_nodes, duplication_prob, num_doctors, timeout_doctors = load_node_files()
-    config = generate_yaml(num_clients, client_files, language_num_nodes, num_doctors, duplication_prob, timeout_doctors)
+    num_clients, client_files, language_num_nodes, duplication_prob, num_doctors, timeout_doctors, prefetch_config, compression_config, batch_codec_config, metrics_config, batch_delivery_config, flow_control_config, output_batching_config, worker_pool_config, fair_scheduling_config, colocation_config, routing_config, checkpoint_config = load_node_files()
+    config = generate_yaml(num_clients, client_files, language_num_nodes, num_doctors, duplication_prob, timeout_doctors, prefetch_config, compression_config, batch_codec_config, metrics_config, batch_delivery_config, flow_control_config, output_batching_config, worker_pool_config, fair_scheduling_config, colocation_config, routing_config, checkpoint_config)
     save_yaml(config)
     print(f"Archivo YAML generado con {num_clients} clientes.")
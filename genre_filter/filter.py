@@ -1,6 +1,7 @@
 import json
 import logging
 from common.game import Game
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
 
 class GenreFilter:
@@ -47,40 +48,26 @@ class GenreFilter:
     
     def _callBack(self, data):
         try:
-            clean_data = data.strip()
-            batch = clean_data.split('\n')
-            packet_id = batch[0]
+            batch = decode_batch(data)
+            packet_id = batch.packet_id
             logging.info(f"Recibido paquete con ID: {packet_id}")
-            batch = batch[1:]
             finalList = []
 
                 
-            for row in batch:
-                row = row.strip()
-                if not row:
-                    logging.warning("Fila vacía o compuesta solo de espacios, saltando...")
-                    continue
-
-                json_row = json.loads(row)
-                game = Game.decode(json_row)
+            for row in batch.rows():
+                game = Game.decode(row)
                 
                 logging.debug(f"Mensaje decodificado: {game}")
                 filtered_game = self.filter_games_by_genre(game)
                 if filtered_game:
-                    game_str = json.dumps(filtered_game.getData())
-                    #game_str = f"{self.packet_id}\n{game_str}\n"
-                    #self.middleware.send(game_str)
-                    #self.packet_id += 1
-                    finalList.append(game_str)
+                    finalList.append(filtered_game.getData())
                     
                     logging.info(f"Juego filtrado enviado: {filtered_game}")
                 else:
                     logging.info("Juego no cumple con el filtro de género.")
             
             if finalList:
-                finalList = "\n".join(finalList)
-                finalList = f"{packet_id}\n{finalList}"
-                self.middleware.send(finalList)
+                self.middleware.send_batch(packet_id, finalList)
             
                     
         except json.JSONDecodeError as e:
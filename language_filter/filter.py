@@ -1,11 +1,46 @@
-import json
 import logging
 from collections import defaultdict
-from common.game_review import GameReview
+from common.batch_codec import decode_batch, describe
+from common.feedback import RESOLVED_KEYS_FEEDBACK, ResolvedKeys
+from common.game_review import GameReview, GAME_REVIEW_GAME_ID_FIELD
 from common.middleware import Middleware
 from common.utils import split_complex_string
 import langid
 
+
+def init_worker():
+    langid.set_languages(['en'])
+
+
+def filter_english(data, resolved: frozenset = frozenset()):
+    """
+    Clasifica el idioma de las reviews de un lote. Corre en los workers del
+    middleware, así que no usa estado del nodo: los juegos ya resueltos
+    llegan como argumento y sus reviews se descartan sin clasificarlas.
+
+    :param data: Lote recibido.
+    :param resolved: game_ids (como str) que el acumulador ya no necesita.
+    :return: Tupla (packet_id, filas de las reviews en inglés).
+    """
+    finalList = []
+    try:
+        batch = decode_batch(data)
+        game_ids = batch.column(GAME_REVIEW_GAME_ID_FIELD) if resolved and len(batch) else []
+        for index, row in enumerate(batch.rows()):
+            if game_ids and str(game_ids[index]) in resolved:
+                continue
+            game_review = GameReview.decode(row)
+            language, confidence = langid.classify(game_review.review_text)
+            if language == 'en':
+                finalList.append(game_review.getData())
+            else:
+                logging.info("Mensaje no es en inglés, no se envía")
+        return batch.packet_id, finalList
+    except Exception as e:
+        logging.error(f"Error en LanguageFilter callback: {e}")
+        return None, []
+
+
 class LanguageFilter:
     def __init__(self, input_queues, output_exchanges, instance_id):
         """
@@ -15,44 +50,43 @@ class LanguageFilter:
         :param output_exchanges: Lista de exchanges de salida.
         :param instance_id: ID de instancia para identificar colas únicas.
         """
-        self.middleware = Middleware(input_queues, [], output_exchanges, instance_id, self._callBack, self._finCallBack, None, 1, "fanout", "direct" )
+        self.resolved = None
+        if RESOLVED_KEYS_FEEDBACK:
+            # Una cola de avisos por filtro, derivada de su cola de entrada
+            self.resolved = ResolvedKeys()
+            self.resolved.listen(f"resolved_keys_{next(iter(input_queues))}", instance_id)
+        self.middleware = Middleware(
+            input_queues, [], output_exchanges, instance_id, self._callBack, self._finCallBack, None, 1, "fanout", "direct",
+            worker_function=filter_english, worker_initializer=init_worker,
+            worker_context=self._resolved_games if self.resolved is not None else None,
+        )
+
+    def _resolved_games(self, data) -> frozenset:
+        """
+        Juegos ya resueltos del cliente del lote, para pasárselos al worker.
+        """
+        _, client_id, _ = describe(data)
+        if client_id is None:
+            return frozenset()
+        return self.resolved.resolved(client_id)
 
     def start(self):
         """
         Inicia el filtro.
         """
-        langid.set_languages(['en'])  
         self.middleware.start()
         logging.info("LanguageFilter started")
         
-    def _callBack(self, data):
+    def _callBack(self, result):
         """
-        Callback para procesar los mensajes recibidos.
+        Publica las reviews en inglés de un lote, ya filtradas por `filter_english`
+        (en el pool de workers del middleware o en este hilo).
 
-        :param data: Datos recibidos.
+        :param result: Tupla (packet_id, filas en inglés).
         """
-        try:
-            aux = data.split('\n')
-            packet_id = aux[0]
-            batch = aux[1:]
-            finalList = []
-            
-            for row in batch:
-                if not row.strip():
-                    continue
-                game_review = GameReview.decode(json.loads(row))
-                result_text = game_review.review_text
-                language, confidence = langid.classify(result_text)
-                if language == 'en':
-                    finalList.append(json.dumps(game_review.getData()))
-                else:
-                    logging.info("Mensaje no es en inglés, no se envía")
-            if finalList:
-                data_to_send = packet_id + '\n' + '\n'.join(finalList) + '\n'
-                self.middleware.send(data_to_send)
-            
-        except Exception as e:
-            logging.error(f"Error en LanguageFilter callback: {e}")
+        packet_id, finalList = result
+        if finalList:
+            self.middleware.send_batch(packet_id, finalList)
     
     def _finCallBack(self, data):
         """
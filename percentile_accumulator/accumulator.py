@@ -2,6 +2,7 @@ import json
 import logging
 from collections import defaultdict
 from common.game_review import GameReview
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
 from common.packet_fin import Fin
 from common.healthcheck import HealthCheckServer
@@ -23,7 +24,8 @@ class PercentileAccumulator:
         self.fault_manager = FaultManager('../persistence/')
         self.init_state()
         self.middleware = Middleware(input_queues, [], output_exchanges, instance_id, 
-                                     self._callBack, self._finCallBack, self.fault_manager, 1, "fanout", "direct")
+                                     self._callBack, self._finCallBack, self.fault_manager, 1, "fanout", "direct",
+                                     cancelCallback=self._cancelCallBack)
         self.value_to_store = ''
     def start(self):
         """
@@ -122,6 +124,14 @@ class PercentileAccumulator:
         if client_id in self.games_by_client:
             del self.games_by_client[client_id]
     
+    def _cancelCallBack(self, client_id):
+        """
+        El cliente se canceló: se descartan sus reseñas acumuladas.
+        """
+        client_id = int(client_id)
+        self.games_by_client.pop(client_id, None)
+        self.fault_manager.discard(f"percentile_{client_id}")
+
     def _callBack(self, data):
         """
         Callback para procesar los mensajes recibidos.
@@ -129,16 +139,16 @@ class PercentileAccumulator:
         :param data: Datos recibidos.
         """
         try:
-            aux = data.strip().split("\n")
-            packet_id = aux[0]
+            batch = decode_batch(data)
+            packet_id = batch.packet_id
             logging.info(f"Mensaje recibido, packet_id: {packet_id}")
             self.value_to_store = ''
             if packet_id in self.last_packet_id:
                 logging.info(f"Paquete {packet_id} ya ha sido procesado, saltando...")
                 self.last_packet_id.remove(packet_id)
                 return
-            for row in aux[1:]:
-                game_review = GameReview.decode(json.loads(row))
+            for row in batch.rows():
+                game_review = GameReview.decode(row)
                 self.process_game(game_review, packet_id)
             self.fault_manager.append(f"percentile_{game_review.client_id}", self.value_to_store)
         except Exception as e:
@@ -1,8 +1,10 @@
-import json
 import logging
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
+from common.eof_barrier import EofBarrier
+from common.fault_manager import FaultManager
 from common.packet_fin import Fin
-from common.review import Review
+from common.review import Review, REVIEW_SCORE_FIELD, REVIEW_CLIENT_ID_FIELD
 
 class PositivityFilter:
     def __init__(
@@ -17,61 +19,46 @@ class PositivityFilter:
             callback=self._callback,
             eofCallback=self._finCallback,
             exchange_input_type=input_type,
+            batch_callback=self._batch_callback,
+            cancelCallback=self._cancelCallback,
         )
-        self.batch_counter: dict = {}
-        self.expected_batches: dict = {}
-        if len(output_exchange[0].split("_")) > 2:
-            self.instance_id = int(output_exchange[0].split("_")[-1])
-        else:
-            self.instance_id = 1
-        self.null_counts = {}
-        
+        # Varias instancias comparten el directorio: el índice va por cola
+        self.fault_manager = FaultManager("../persistence/", next(iter(input_queue)))
+        self.batch_counter: dict = {}  # client_id -> packet_id de los lotes no vacíos enviados
+        # El FIN del gateway trae cuántos lotes le mandó a esta instancia
+        self.eof_barrier = EofBarrier(1, self._send_fin, count_batches=True, fault_manager=self.fault_manager)
+        self.init_state()
+
     def start(self):
         self.middleware.start()
         logging.info("FilterPositivity started")
 
+    def _batch_callback(self, messages):
+        # Los lotes se filtran de a uno (cada uno sale con su packet_id); el
+        # grupo comparte la llamada del middleware y un único ack
+        for message in messages:
+            self._callback(message)
+
     def _callback(self, message):
         try:
-            batch = message.split("\n")
-            packet_id = batch[0]
+            batch = decode_batch(message)
+            packet_id = batch.packet_id
             logging.info(f"Processing batch {packet_id}")
-            batch = batch[1:]
             finalList = []
 
-            for row in batch:
-                if not row.strip():
-                    continue
-                result_review = Review.decode(json.loads(row))
-                review_score = result_review.review_score
-                
-                if int(review_score) == self.positivity:
-                    finalList.append(json.dumps(result_review.getData()))
+            # Solo se decodifica la columna del score; las filas, si pasan el filtro
+            scores = batch.column(REVIEW_SCORE_FIELD)
+            for index, review_score in enumerate(scores):
+                if int(str(review_score).strip('"')) == self.positivity:
+                    finalList.append(Review.decode(batch.row(index)).getData())
 
-            client_id = int(Review.decode(json.loads(batch[0])).client_id)
+            client_id = int(batch.column(REVIEW_CLIENT_ID_FIELD)[0])
 
-            if client_id not in self.batch_counter:
-                # print(f"Client id {client_id} not in batch_counter", flush=True)
-                self.batch_counter[client_id] = 0
-            if client_id not in self.expected_batches:
-                # print(f"Client id {client_id} not in expected_batches", flush=True)
-                self.expected_batches[client_id] = 0
-            if client_id not in self.null_counts:
-                # print(f"Client id {client_id} not in null_counts", flush=True)
-                self.null_counts[client_id] = 0
-                
             if finalList:
-                # Unir todas las líneas con \n solo cuando hay contenido válido
-                finalList = "\n".join(finalList)
-                finalList = f"{packet_id}\n{finalList}"
-                self.middleware.send(finalList)
-                self.batch_counter[client_id] += 1
-            else:
-                self.null_counts[client_id] += 1
-                # print(f"Null count: {self.null_counts[client_id]}", flush=True)
-                                
-            # print(f"Batch counter: {self.batch_counter[client_id]}", flush=True)
-            if ((self.batch_counter[client_id] + self.null_counts[client_id]) >= self.expected_batches[client_id]) and self.expected_batches[client_id] !=0:
-                self.middleware.send(Fin(self.batch_counter[client_id], client_id).encode())
+                self.middleware.send_batch(packet_id, finalList)
+                self._count_sent(client_id, packet_id)
+
+            self.eof_barrier.batch_received(client_id, packet_id=str(packet_id))
 
         except Exception as e:
             print(f"Error processing batch: {e}", flush=True)
@@ -79,22 +66,43 @@ class PositivityFilter:
     def _finCallback(self, message):
         if not message:
             raise ValueError("Message is empty or None")
-        
-        json_row = Fin.decode(message)
-        # fin_message = Fin(self.batch_counter[int(json_row.client_id)], json_row.client_id)
-        # print("llega batch id: ", json_row.batch_id,flush=True)
-        if self.positivity == 1:
-            remainder = int(json_row.batch_id) % 4
-            division_result = int(json_row.batch_id) // 4
-            self.expected_batches[int(json_row.client_id)] = division_result + (1 if remainder >= self.instance_id else 0)
-        else:
-            self.expected_batches[int(json_row.client_id)] = int(json_row.batch_id)
-        print("Fin de la transmisión, enviando data", self.expected_batches[int(json_row.client_id)], flush=True)
-        if int(json_row.client_id) not in self.batch_counter:
-            print(f"Client id {json_row.client_id} not in batch_counter", flush=True)
-            #self.middleware.send(message)
-            return
-        
-        if (self.batch_counter[int(json_row.client_id)] + self.null_counts[int(json_row.client_id)]) >= self.expected_batches[int(json_row.client_id)]:
-            self.middleware.send(Fin(self.batch_counter[int(json_row.client_id)], int(json_row.client_id)).encode())
+        self.eof_barrier.fin_received(Fin.decode(message))
+
+    def _cancelCallback(self, client_id):
+        """
+        El cliente se canceló: se descartan su barrera y su cuenta de lotes.
+        """
+        self.eof_barrier.forget(client_id)
+        self._forget_sent(int(client_id))
+
+    def _count_sent(self, client_id: int, packet_id):
+        # Un lote reentregado sale de nuevo (abajo se deduplica) pero no se cuenta dos veces
+        sent = self.batch_counter.setdefault(client_id, set())
+        if str(packet_id) not in sent:
+            sent.add(str(packet_id))
+            self.fault_manager.append(f"sent_batches_{client_id}", str(packet_id))
+
+    def _forget_sent(self, client_id: int):
+        if self.batch_counter.pop(client_id, None):
+            self.fault_manager.delete_key(f"sent_batches_{client_id}")
+
+    def _send_fin(self, client_id):
+        """
+        Llegaron el FIN y todos los lotes del cliente: el FIN de salida lleva
+        cuántos lotes no vacíos se mandaron aguas abajo.
+        """
+        client_id = int(client_id)
+        sent = len(self.batch_counter.get(client_id, ()))
+        print("Fin de la transmisión, enviando data", sent, flush=True)
+        self.middleware.send(Fin(sent, client_id).encode())
+        self._forget_sent(client_id)
         logging.info("FilterPositivity finished")
+
+    def init_state(self):
+        for key in self.fault_manager.get_keys("sent_batches_"):
+            state = self.fault_manager.get(key)
+            if not state:
+                continue
+            client_id = int(key[len("sent_batches_"):])
+            self.batch_counter[client_id] = set(state.split("\n"))
+            logging.info(f"Lotes enviados del cliente {client_id} restaurados: {len(self.batch_counter[client_id])}")
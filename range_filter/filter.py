@@ -2,6 +2,7 @@ import json
 import logging
 from datetime import datetime
 from common.game import Game
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
 
 class RangeFilter:
@@ -13,21 +14,18 @@ class RangeFilter:
         #self.packet_id = 0
         
     def _callBack(self, data):
-        aux = data.strip().split("\n")
-        packet_id = aux[0]
+        batch = decode_batch(data)
+        packet_id = batch.packet_id
         print(f"Recibido paquete con ID: {packet_id}", flush=True)
-        batch = aux[1:]
         finalList = []
         
-        for row in batch:
-            json_row = json.loads(row)
-            game = Game.decode(json_row)
+        for row in batch.rows():
+            game = Game.decode(row)
             logging.debug(f"Mensaje decodificado: {game}")
 
             filtered_game = self.filter_by_range(game)
             if filtered_game:
-                game_str = json.dumps(filtered_game.getData())
-                finalList.append(game_str)
+                finalList.append(filtered_game.getData())
                 # game_str = f'{packet_id}\n{game_str}\n'
                 # self.middleware.send(game_str)
                 logging.info(f"Paquete enviado: {packet_id}")
@@ -36,9 +34,7 @@ class RangeFilter:
                 logging.info("Juego no cumple con el filtro de rango.")
         
         if finalList:
-            finalList = "\n".join(finalList)
-            finalList = f"{packet_id}\n{finalList}"
-            self.middleware.send(data = finalList)
+            self.middleware.send_batch(packet_id, finalList)
             
             
     def filter_by_range(self, game):
@@ -13,7 +13,10 @@ def main():
     input_queues: dict = json.loads(os.getenv("INPUT_QUEUES")) or {}
     output_exchanges = json.loads(os.getenv("OUTPUT_EXCHANGES")) or []
     instance_id = json.loads(os.getenv("INSTANCE_ID") or '0')
-    top5ReviewCounter = Top5ReviewCounter(input_queues, output_exchanges, instance_id)
+    previous_nodes = int(os.getenv("PREVIOUS_REVIEW_FILTER_NODES", "4"))
+    shard_role = os.getenv("SHARD_ROLE") or None
+    shards = int(os.getenv("SHARDS", "1"))
+    top5ReviewCounter = Top5ReviewCounter(input_queues, output_exchanges, instance_id, previous_nodes, shard_role, shards)
 
     t1 = threading.Thread(target=top5ReviewCounter.start)
     t1.start()
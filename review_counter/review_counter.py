@@ -1,21 +1,49 @@
 import json
 import logging
 from common.game_review import GameReview
-from common.middleware import Middleware
+from common.batch_codec import decode_batch
+from common.middleware import Middleware, NODE_NAME
+from common.eof_barrier import EofBarrier
 from common.packet_fin import Fin
 from common.healthcheck import HealthCheckServer
+from common.shard_merge import PartialCountsMerger
 from common.fault_manager import FaultManager
 
+# Roles con el conteo particionado por juego: cada shard manda sus cuentas
+# parciales y una instancia aparte las suma y arma el top 5
+PARTIAL_ROLE = "partial"
+MERGE_ROLE = "merge"
+
+
 class Top5ReviewCounter:
-    def __init__(self, input_queues, output_exchanges, instance_id):
+    def __init__(self, input_queues, output_exchanges, instance_id, previous_nodes=4, shard_role=None, shards=1):
         self.games_dict_by_client = {}
-        self.remaining_fin : dict = {}
+        self.shard_role = shard_role
         self.fault_manager = FaultManager("../persistence/")
         self.last_packet_id = None
         self.last_games = ''
         self.last_client_id = None
+
+        if shard_role == MERGE_ROLE:
+            # Recibe resultados parciales, no lotes ni FIN: el merger deduplica
+            # por shard y cierra al cliente cuando llegaron todos
+            self.eof_barrier = None
+            self.merger = PartialCountsMerger(shards, self._send_merged_top5, self.fault_manager, "top5_shard_merge")
+            self.middleware = Middleware(
+                input_queues=input_queues,
+                output_queues=[],
+                output_exchanges=output_exchanges,
+                intance_id=instance_id,
+                callback=self._merge_callback,
+                exchange_input_type="direct",
+                cancelCallback=self._cancel_merge_callback,
+                cancel_producers=shards,
+            )
+            return
+
+        # Un FIN por cada game review filter de indie
+        self.eof_barrier = EofBarrier(previous_nodes, self._send_top5, fault_manager=self.fault_manager)
         self.init_state()
-        
         self.middleware = Middleware(
             input_queues=input_queues,
             output_queues=[],
@@ -24,7 +52,12 @@ class Top5ReviewCounter:
             callback=self._process_callback,
             eofCallback=self._eof_callback,
             faultManager=self.fault_manager,
+            # Nodo con estado: su salida no se combina aunque el contenedor tenga OUTPUT_BATCH_LINGER_MS
+            output_linger_ms=0,
             exchange_input_type="direct",
+            batch_callback=self._process_batch_callback,
+            cancelCallback=self._cancel_callback,
+            cancel_producers=previous_nodes,
         )
 
 
@@ -88,49 +121,81 @@ class Top5ReviewCounter:
         """
         Callback function to process messages.
         """
-        batch = data.split("\n")
-        packet_id = batch[0]
-        batch = batch[1:]
-        self.last_games = str(packet_id) + "\n"
+        self._process_batch_callback([data])
 
-        logging.info(f"Received batch with packet_id {packet_id}")
+    def _process_batch_callback(self, messages):
+        """
+        Processes a group of messages and persists them with one append per client.
+        """
+        to_store: dict = {}
+        for data in messages:
+            batch = decode_batch(data)
+            packet_id = batch.packet_id
 
-        if packet_id == self.last_packet_id:
-            logging.info("Ignoring duplicate packet.")
-            return
-        
-        for row in batch:
-            if not row.strip():
+            logging.info(f"Received batch with packet_id {packet_id}")
+
+            if packet_id == self.last_packet_id:
+                logging.info("Ignoring duplicate packet.")
                 continue
-            json_data = json.loads(row)
-            game_review = GameReview.decode(json_data)
-            self.process_game(game_review, packet_id)
-        self.fault_manager.append(f"top5_review_counter_{str(self.last_client_id)}", self.last_games)
-        self.last_games = ''
+
+            self.last_games = str(packet_id) + "\n"
+            for row in batch.rows():
+                game_review = GameReview.decode(row)
+                self.process_game(game_review, packet_id)
+            client_key = str(self.last_client_id)
+            to_store[client_key] = to_store.get(client_key, "") + self.last_games
+            self.last_games = ''
+
+        for client_key, value in to_store.items():
+            self.fault_manager.append(f"top5_review_counter_{client_key}", value)
         
         
     def _eof_callback(self, data):
         """
         Callback function for handling end of file (EOF) messages.
         """
-        fin_msg = Fin.decode(data)
-        client_id = fin_msg.client_id
-        if client_id not in self.remaining_fin:
-            self.remaining_fin[client_id] = 3
-        else:
-            self.remaining_fin[client_id] -= 1
-        if self.remaining_fin[client_id] > 0:
-            return
+        self.eof_barrier.fin_received(Fin.decode(data))
+
+    def _cancel_callback(self, client_id):
+        """
+        El cliente se canceló: se descartan sus cuentas y los FIN que ya llegaron.
+        """
+        self.eof_barrier.forget(client_id)
+        self.games_dict_by_client.pop(client_id, None)
+        self.fault_manager.discard(f"top5_review_counter_{client_id}")
+
+    def _send_top5(self, client_id):
+        """
+        Llegó el FIN de todos los nodos previos: envía el top 5 del cliente.
+        """
         logging.info("End of file received. Sending top 5 indie games positive reviews data for each client.")
-        top_5_games = self.get_games(client_id)
-        
-        self.middleware.send(json.dumps(top_5_games))
+        if self.shard_role == PARTIAL_ROLE:
+            partial = {"partial_review_counts": {"client_id": client_id, "shard": NODE_NAME, "games": self.games_dict_by_client.get(client_id, {})}}
+            self.middleware.send(json.dumps(partial))
+        else:
+            self.middleware.send(json.dumps(self.get_games(client_id)))
         self.fault_manager.delete_key(f"top5_review_counter_{str(client_id)}")
         # for client_id in self.games_dict_by_client:
         #     top5_games = json.dumps(self.get_games(client_id), indent=4)
         #     self.middleware.send(top5_games)
         logging.info(f"Top 5 indie games positive reviews data sent for client {client_id}.")
 
+    def _merge_callback(self, data):
+        """
+        Suma las cuentas parciales de un shard.
+        """
+        partial = json.loads(data)["partial_review_counts"]
+        self.merger.add(partial["client_id"], partial["shard"], partial["games"])
+
+    def _cancel_merge_callback(self, client_id):
+        self.merger.forget(client_id)
+
+    def _send_merged_top5(self, client_id, counts):
+        self.games_dict_by_client[client_id] = counts
+        self.middleware.send(json.dumps(self.get_games(client_id)))
+        self.games_dict_by_client.pop(client_id, None)
+        logging.info(f"Top 5 merged from all shards sent for client {client_id}.")
+
     def start(self):
         """
         Start middleware to begin consuming messages.
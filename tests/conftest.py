@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import pytest
+
+# Los tests corren el Middleware sobre el broker en memoria, sin RabbitMQ
+os.environ.setdefault("MIDDLEWARE_ENGINE", "memory")
+os.environ.setdefault("SEQUENCER_STORAGE", tempfile.mkdtemp(prefix="sequencer-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def eventually():
+    """
+    Espera a que `predicate` se cumpla (los nodos corren en otros hilos).
+    """
+    def wait(predicate, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                raise AssertionError("condition not met in time")
+            time.sleep(0.01)
+    return wait
+
+
+@pytest.fixture
+def start():
+    """
+    Arranca un Middleware consumidor en su propio hilo.
+    """
+    def run(middleware):
+        threading.Thread(target=middleware.start, daemon=True).start()
+        return middleware
+    return run
+
+
+@pytest.fixture
+def queue_name(request):
+    # Todos los tests comparten el broker en memoria del proceso
+    return request.node.name.replace("[", "_").replace("]", "")
@@ -0,0 +1,81 @@
+from common import middleware as middleware_module
+from common.fault_manager import FaultManager
+from common.middleware import Middleware
+from common.packet_fin import Fin
+
+
+def record_acks(node, events):
+    basic_ack = node.channel.basic_ack
+
+    def ack(delivery_tag=0, multiple=False):
+        events.append((delivery_tag, multiple))
+        basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+    node.channel.basic_ack = ack
+
+
+def test_prefetch_covers_the_ack_window(queue_name):
+    node = Middleware(input_queues={queue_name: f"{queue_name}_ex"}, intance_id=0, ack_window=50, prefetch_count=1)
+
+    assert node.prefetch_count == 50
+
+
+def test_acks_go_out_as_one_multiple_ack_per_window(start, eventually, queue_name):
+    acks, seen = [], []
+    node = Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=seen.append,
+        ack_window=3,
+    )
+    record_acks(node, acks)
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    for i in range(7):
+        producer.send_batch(f"p{i}", [["row", 1]])
+    start(node)
+
+    # El séptimo sale con el flush periódico, sin esperar a llenar la ventana
+    eventually(lambda: len(acks) == 3)
+    assert len(seen) == 7
+    assert acks == [(3, True), (6, True), (7, True)]
+
+
+def test_fin_flushes_the_pending_acks(monkeypatch, start, eventually, queue_name):
+    monkeypatch.setattr(middleware_module, "ACK_FLUSH_INTERVAL", 60)
+    acks = []
+    node = Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=lambda _: None,
+        eofCallback=lambda _: None,
+        ack_window=10,
+    )
+    record_acks(node, acks)
+    start(node)
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p1", [["row", 1]])
+    producer.send_batch("p2", [["row", 1]])
+    producer.send(Fin(2, 1).encode())
+
+    eventually(lambda: acks == [(3, True)], timeout=2)
+
+
+def test_state_is_synced_before_the_multiple_ack(tmp_path, start, eventually, queue_name):
+    events = []
+    fault_manager = FaultManager(str(tmp_path))
+    sync = fault_manager.sync
+    fault_manager.sync = lambda: (events.append("sync"), sync())
+    node = Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=lambda _: None,
+        faultManager=fault_manager,
+        ack_window=2,
+    )
+    record_acks(node, events)
+    start(node)
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p1", [["row", 1]])
+    producer.send_batch("p2", [["row", 1]])
+
+    eventually(lambda: (2, True) in events)
+    assert events[events.index((2, True)) - 1] == "sync"
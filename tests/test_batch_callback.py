@@ -0,0 +1,58 @@
+from common.fault_manager import FaultManager
+from common.middleware import Middleware
+from common.packet_fin import Fin
+
+
+def batching_node(queue_name, batches, **kwargs):
+    return Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        batch_callback=lambda messages: batches.append([m.split("\n")[0] for m in messages]),
+        eofCallback=lambda _: batches.append("fin"),
+        **kwargs,
+    )
+
+
+def test_groups_are_delivered_together_and_acked_once(start, eventually, queue_name):
+    batches, acks = [], []
+    node = batching_node(queue_name, batches, batch_size=3, batch_linger_ms=60000)
+    basic_ack = node.channel.basic_ack
+    node.channel.basic_ack = lambda delivery_tag=0, multiple=False: (
+        acks.append((delivery_tag, multiple)), basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+    )
+    assert node.prefetch_count >= 3
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    for i in range(4):
+        producer.send_batch(f"p{i}", [["row", 1]])
+    producer.send(Fin(4, 1).encode())
+    start(node)
+
+    # El FIN entrega antes el grupo incompleto
+    eventually(lambda: len(batches) == 3)
+    assert batches == [["p0", "p1", "p2"], ["p3"], "fin"]
+    assert acks[:2] == [(3, True), (4, True)]
+
+
+def test_an_incomplete_group_goes_out_after_the_linger(start, eventually, queue_name):
+    batches = []
+    start(batching_node(queue_name, batches, batch_size=100, batch_linger_ms=20))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p0", [["row", 1]])
+    producer.send_batch("p1", [["row", 1]])
+
+    eventually(lambda: batches == [["p0", "p1"]], timeout=2)
+
+
+def test_redelivered_packets_are_dropped_from_the_group(tmp_path, start, eventually, queue_name):
+    batches = []
+    start(batching_node(queue_name, batches, batch_size=2, batch_linger_ms=20, faultManager=FaultManager(str(tmp_path))))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p0", [["row", 1]])
+    producer.send_batch("p1", [["row", 1]])
+    eventually(lambda: batches == [["p0", "p1"]])
+
+    producer.send_to_exchange(f"{queue_name}_ex", "p1\n[]")  # mismo packet_id, sin secuencia
+    producer.send_batch("p2", [["row", 1]])
+
+    eventually(lambda: len(batches) == 2)
+    assert batches[1] == ["p2"]
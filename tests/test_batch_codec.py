@@ -0,0 +1,52 @@
+import pytest
+from common import batch_codec
+from common.batch_codec import COLUMNAR_CODEC, JSON_CODEC, decode_batch, encode_batch
+from common.packet_fin import Fin
+from common.review import Review
+
+ROWS = [
+    Review(10, "Game ñ", "great", 1, 1, 7).getData(),
+    Review(11, "Other", "bad\nreally", -1, 2, 7).getData(),
+]
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, COLUMNAR_CODEC])
+def test_round_trip(codec):
+    batch = decode_batch(encode_batch("p1", ROWS, codec))
+
+    assert batch.packet_id == "p1"
+    assert len(batch) == 2
+    assert batch.rows() == ROWS
+    assert batch.row(1) == ROWS[1]
+
+
+def test_columnar_keeps_column_types():
+    rows = [[1, "a", ["x", 2]], [2**40, "b", None]]
+    batch = decode_batch(encode_batch("p2", rows, COLUMNAR_CODEC))
+
+    assert batch.column(0) == [1, 2**40]
+    assert batch.column(1) == ["a", "b"]
+    assert batch.column(2) == [["x", 2], None]
+
+
+def test_columnar_falls_back_to_json_for_out_of_range_ints():
+    rows = [[2**70], [1]]
+    assert decode_batch(encode_batch("p3", rows, COLUMNAR_CODEC)).column(0) == [2**70, 1]
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, COLUMNAR_CODEC])
+def test_describe_reads_client_and_rows(codec):
+    message = encode_batch("p1", ROWS, codec)
+
+    assert batch_codec.packet_id_of(message) == "p1"
+    assert batch_codec.describe(message) == (batch_codec.BATCH_MESSAGE, 7, 2)
+
+
+def test_describe_fin():
+    assert batch_codec.describe(Fin(3, 7).encode())[:2] == (batch_codec.FIN_MESSAGE, "7")
+
+
+def test_empty_columnar_batch():
+    batch = decode_batch(encode_batch("p4", [], COLUMNAR_CODEC))
+    assert batch.packet_id == "p4"
+    assert batch.rows() == []
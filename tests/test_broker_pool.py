@@ -0,0 +1,77 @@
+import threading
+from gateway import broker_pool
+from gateway.broker_pool import BrokerPool, CheckoutCancelled
+from common.middleware import Middleware
+from common.packet_fin import Fin
+
+
+def test_connections_open_on_demand_and_each_flow_keeps_its_own(queue_name):
+    pool = BrokerPool(4, {f"{queue_name}_ex": "fanout"})
+    assert pool.publishers == [None] * 4
+
+    with pool.checkout(("handler-1", "games")) as first:
+        pass
+    with pool.checkout(("handler-1", "games")) as again:
+        pass
+
+    assert again is first
+    assert sum(publisher is not None for publisher in pool.publishers) == 1
+    pool.close()
+
+
+def test_a_flow_keeps_its_order_through_the_pool(start, eventually, queue_name):
+    exchange = f"{queue_name}_ex"
+    seen = []
+    start(Middleware(
+        input_queues={queue_name: exchange},
+        intance_id=0,
+        callback=lambda message: seen.append(message.split("\n")[0]),
+        eofCallback=lambda _: seen.append("fin"),
+    ))
+    pool = BrokerPool(2, {exchange: "fanout"})
+
+    for i in range(5):
+        with pool.checkout(("handler-1", exchange)) as middleware:
+            middleware.send_to_exchange(exchange, f"p{i}\nrow")
+    with pool.checkout(("handler-1", exchange)) as middleware:
+        middleware.send_to_exchange(exchange, Fin(5, 1).encode())
+
+    eventually(lambda: len(seen) == 6)
+    assert seen == ["p0", "p1", "p2", "p3", "p4", "fin"]
+    pool.close()
+
+
+def test_checkout_is_exclusive_and_a_stopped_flow_gives_up(monkeypatch, queue_name):
+    monkeypatch.setattr(broker_pool, "CHECKOUT_POLL_INTERVAL", 0.01)
+    pool = BrokerPool(1, {f"{queue_name}_ex": "fanout"})
+    stop = threading.Event()
+    outcome = []
+
+    def other_flow():
+        try:
+            with pool.checkout("other", stop):
+                outcome.append("checked out")
+        except CheckoutCancelled:
+            outcome.append("cancelled")
+
+    with pool.checkout("flow"):
+        waiting = threading.Thread(target=other_flow)
+        waiting.start()
+        waiting.join(timeout=0.1)
+        assert outcome == []  # la única conexión está prestada
+        stop.set()
+        waiting.join(timeout=1)
+
+    assert outcome == ["cancelled"]
+    pool.close()
+
+
+def test_closed_pool_stops_its_connections(queue_name):
+    pool = BrokerPool(1, {f"{queue_name}_ex": "fanout"})
+    with pool.checkout("flow") as middleware:
+        pass
+
+    pool.close()
+
+    assert middleware.connection.is_closed
+    assert pool.shutdown_event.is_set()
@@ -0,0 +1,107 @@
+import pika
+from common.envelope import Envelope
+from common.fault_manager import FaultManager
+from common.memory_engine import MemoryBroker
+from common.middleware import Middleware
+
+
+def cancel_from(exchange, client_id, origin):
+    properties = pika.BasicProperties(headers=Envelope("cancel", client_id=str(client_id), origin=origin).to_headers())
+    MemoryBroker.instance().publish(exchange, "", b"", properties)
+
+
+def test_cancel_drops_the_client_until_every_producer_cancelled(tmp_path, start, eventually, queue_name):
+    exchange = f"{queue_name}_ex"
+    seen = []
+    node = start(Middleware(
+        input_queues={queue_name: exchange},
+        intance_id=0,
+        callback=lambda message: seen.append(message.split("\n")[0]),
+        eofCallback=lambda _: None,
+        cancelCallback=lambda client_id: seen.append(f"cancel {client_id}"),
+        cancel_producers=2,
+        faultManager=FaultManager(str(tmp_path)),
+    ))
+    producer = Middleware(output_exchanges=[exchange])
+
+    producer.send_batch("x1", [["a", 5]])
+    cancel_from(exchange, 5, "f1")
+    producer.send_batch("x2", [["b", 5]])  # de otro productor, todavía en camino: se descarta
+    producer.send_batch("y1", [["c", 6]])
+    eventually(lambda: "y1" in seen)
+    assert seen == ["x1", "cancel 5", "y1"]
+    assert "5" in node.cancelled_clients
+
+    cancel_from(exchange, 5, "f2")
+    producer.send_batch("x3", [["d", 5]])  # vuelve a cargar con el mismo id
+
+    eventually(lambda: "x3" in seen)
+    assert seen == ["x1", "cancel 5", "y1", "x3"]
+    assert node.cancelled_clients == {}
+
+
+def test_cancel_is_forwarded_downstream(start, eventually, queue_name):
+    forwarded = []
+    start(Middleware(
+        input_queues={f"{queue_name}_sink": f"{queue_name}_out"},
+        intance_id=0,
+        callback=lambda _: None,
+        eofCallback=lambda _: None,
+        cancelCallback=forwarded.append,
+    ))
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_in"},
+        output_exchanges=[f"{queue_name}_out"],
+        intance_id=0,
+        callback=lambda _: None,
+        eofCallback=lambda _: None,
+    ))
+
+    Middleware(output_exchanges=[f"{queue_name}_in"]).send_cancel(9)
+
+    eventually(lambda: forwarded == ["9"])
+
+
+def test_stop_senders_wakes_a_sender_blocked_on_flow_credit(queue_name):
+    import os
+    import sys
+    import threading
+    import time
+    from queue import Queue
+    from types import SimpleNamespace
+    from common.flow_control import FlowController
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gateway"))
+    from broker_pool import BrokerPool
+    from connectionHandler import ConnectionHandler
+
+    pool = BrokerPool(1, {"games": "fanout"})
+    # Las colas aguas abajo no se vacían nunca: el publicador queda esperando crédito
+    flow = FlowController(None, ["slow"], 10, 5, check_interval=0.01)
+    flow.probe = SimpleNamespace(depth=lambda queue: 100)
+    pool.flow_middleware = SimpleNamespace(flow=flow, stop=lambda: None)
+
+    handler = ConnectionHandler.__new__(ConnectionHandler)
+    handler.broker_pool = pool
+    handler.address = (queue_name, 0)
+    handler.shutdown_event = threading.Event()
+    for name in (
+        "games_from_client_queue", "reviews_from_client_queue", "reviews_from_client_queue_to_positive",
+        "reviews_to_process_queue", "result_to_client_queue",
+    ):
+        setattr(handler, name, Queue())
+    sender = threading.Thread(
+        target=handler._ConnectionHandler__middleware_sender, args=(handler.games_from_client_queue, "games"), daemon=True
+    )
+    handler.active_threads = [sender]
+    sender.start()
+    handler.games_from_client_queue.put("p1\nrow")
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    handler.shutdown_event.set()
+    handler._stop_senders()
+
+    assert not sender.is_alive()
+    assert time.monotonic() - started < 2
+    pool.close()
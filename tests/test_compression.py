@@ -0,0 +1,51 @@
+import pytest
+from common import compression
+from common.middleware import Middleware
+
+BODY = ("\n".join(f'["{i}", "review text {i % 7}", 1]' for i in range(500))).encode("utf-8")
+
+
+@pytest.mark.parametrize("codec", [compression.ZLIB_CODEC, compression.LZ4_CODEC])
+def test_round_trip(codec):
+    if codec not in compression.available_codecs():
+        pytest.skip(f"{codec} is not installed")
+    compressed = compression.compress(BODY, codec)
+    assert len(compressed) < len(BODY)
+    assert compression.decompress(compressed, codec) == BODY
+
+
+def test_unavailable_codec_falls_back_to_zlib(monkeypatch):
+    monkeypatch.setattr(compression, "lz4_frame", None)
+    assert compression.resolve_codec(compression.LZ4_CODEC) == compression.ZLIB_CODEC
+    assert compression.available_codecs() == [compression.ZLIB_CODEC]
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        compression.decompress(BODY, "brotli")
+
+
+@pytest.mark.parametrize("codec", [compression.ZLIB_CODEC, compression.LZ4_CODEC])
+def test_middleware_decompresses_transparently(codec, start, eventually, queue_name, monkeypatch):
+    if codec not in compression.available_codecs():
+        pytest.skip(f"{codec} is not installed")
+    compress = compression.compress
+    used = []
+    monkeypatch.setattr(compression, "compress", lambda body, codec: used.append(codec) or compress(body, codec))
+    received = []
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=received.append,
+        eofCallback=lambda _: None,
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"], compressed_exchanges=[f"{queue_name}_ex"])
+    producer.compression_codec = codec
+    rows = [[str(i), f"review text {i % 7}", 1] for i in range(500)]
+
+    producer.send_batch("p1", rows)
+
+    eventually(lambda: received)
+    assert used == [codec]
+    assert received[0].split("\n")[0] == "p1"
+    assert len(received[0].strip().split("\n")) == 501
@@ -0,0 +1,142 @@
+import pika
+from common.confirms import ConfirmWindow
+
+
+class FakeChannel:
+    """
+    Canal con la API pública que usa ChannelConfirms; los confirms los
+    manda el test.
+    """
+
+    def __init__(self):
+        self.published = []
+        self.ack_nack_callback = None
+        self.timers = []  # (delay, callback); los corre el test
+        self.connection = self
+
+    def call_later(self, delay, callback):
+        self.timers.append((delay, callback))
+
+    def fire_timers(self):
+        timers, self.timers = self.timers, []
+        for _, callback in timers:
+            callback()
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self.ack_nack_callback = ack_nack_callback
+        callback(None)
+
+    def wait_until(self, predicate):
+        assert predicate(), "would block"
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append(body)
+
+    def confirm(self, delivery_tag, multiple=False, nack=False):
+        method = pika.spec.Basic.Nack if nack else pika.spec.Basic.Ack
+        self.ack_nack_callback(pika.frame.Method(1, method(delivery_tag=delivery_tag, multiple=multiple)))
+
+
+def window(max_outstanding=10):
+    channel = FakeChannel()
+    confirms = ConfirmWindow(channel, max_outstanding)
+    confirms.enable()
+    return channel, confirms
+
+
+def test_ack_is_not_held_without_pending_publishes():
+    _, confirms = window()
+    assert not confirms.hold(1)
+
+
+def test_acks_are_released_in_order_once_earlier_publishes_are_confirmed():
+    channel, confirms = window()
+    confirms.publish("ex", "", b"a", None)
+    assert confirms.hold(1)
+    confirms.publish("ex", "", b"b", None)
+    assert confirms.hold(2)
+
+    channel.confirm(2)
+    assert confirms.take_released() == []
+    channel.confirm(1)
+    assert confirms.take_released() == [1, 2]
+    assert not confirms.pending()
+
+
+def test_multiple_ack_confirms_everything_up_to_the_tag():
+    channel, confirms = window()
+    for body in (b"a", b"b", b"c"):
+        confirms.publish("ex", "", body, None)
+    confirms.hold(7)
+
+    channel.confirm(3, multiple=True)
+
+    assert confirms.take_released() == [7]
+
+
+def test_nacked_publish_is_republished_and_keeps_holding_the_ack():
+    channel, confirms = window()
+    confirms.publish("ex", "", b"a", None)
+    confirms.hold(1)
+
+    channel.confirm(1, nack=True)
+    channel.fire_timers()
+    assert channel.published == [b"a", b"a"]
+    assert confirms.take_released() == []
+
+    channel.confirm(2)
+    assert confirms.take_released() == [1]
+
+
+def test_nacked_publish_backs_off_instead_of_spinning():
+    channel, confirms = window(max_outstanding=2)
+    confirms.publish("ex", "", b"a", None)
+    confirms.hold(1)
+
+    channel.confirm(1, nack=True)
+    # Espera antes de reenviar y sigue ocupando su lugar en la ventana
+    assert channel.published == [b"a"]
+    assert confirms.pending() and confirms.take_released() == []
+    confirms.publish("ex", "", b"b", None)
+    assert not confirms.has_room()
+
+    channel.fire_timers()
+    channel.confirm(3, nack=True)
+    channel.fire_timers()
+    channel.confirm(2)
+    assert confirms.take_released() == []
+    channel.confirm(4)
+    assert confirms.take_released() == [1]
+
+    assert not channel.timers
+    assert channel.published == [b"a", b"b", b"a", b"a"]
+
+
+def test_backoff_doubles_with_each_consecutive_nack():
+    channel, confirms = window()
+    confirms.publish("ex", "", b"a", None)
+    delays = []
+    for seq in (1, 2, 3):
+        channel.confirm(seq, nack=True)
+        delays.append(channel.timers[0][0])
+        channel.fire_timers()
+
+    assert delays == [0.05, 0.1, 0.2]
+
+
+def test_unconfirmed_includes_publishes_waiting_to_be_retried():
+    channel, confirms = window()
+    confirms.publish("ex", "", b"a", None)
+    confirms.publish("ex", "", b"b", None)
+    channel.confirm(1, nack=True)
+
+    assert [entry[2] for entry in confirms.unconfirmed()] == [b"a", b"b"]
+
+
+def test_has_room_tracks_the_window():
+    channel, confirms = window(max_outstanding=2)
+    confirms.publish("ex", "", b"a", None)
+    confirms.publish("ex", "", b"b", None)
+    assert not confirms.has_room()
+    channel.confirm(1)
+    assert confirms.has_room()
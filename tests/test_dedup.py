@@ -0,0 +1,112 @@
+from common.dedup import DedupIndex, ProducerWatermark
+from common.fault_manager import FaultManager
+from common.middleware import Middleware
+
+
+def test_mark_many_is_restored_after_restart(tmp_path):
+    index = DedupIndex(FaultManager(str(tmp_path)), "dedup")
+    index.mark_many(["p1", "p2"])
+    index.mark("p3")
+
+    restored = DedupIndex(FaultManager(str(tmp_path)), "dedup")
+    assert len(restored) == 3
+    assert all(restored.seen(packet_id) for packet_id in ("p1", "p2", "p3"))
+    assert not restored.seen("p4")
+
+
+def test_expire_drops_old_segments_and_their_keys(tmp_path):
+    fault_manager = FaultManager(str(tmp_path))
+    index = DedupIndex(fault_manager, "dedup", segment_seconds=10, retained_segments=2)
+    index._add("old", 1)
+    fault_manager.append("dedup_1", "old")
+    index._add("new", 5)
+    fault_manager.append("dedup_5", "new")
+
+    index.expire(now=60)
+
+    assert not index.seen("old")
+    assert index.seen("new")
+    assert sorted(fault_manager.get_keys("dedup_")) == ["dedup_5", "dedup_watermarks"]
+
+
+def test_remarked_packet_moves_to_the_new_segment():
+    index = DedupIndex(None, "dedup", segment_seconds=10, retained_segments=2)
+    index._add("p1", 1)
+    index._add("p1", 5)
+
+    index.expire(now=60)
+
+    assert index.seen("p1")
+    assert index.export()["segments"] == {"5": ["p1"]}
+
+
+def test_export_and_load_round_trip():
+    index = DedupIndex(None, "dedup")
+    index.mark_many(["b", "a"])
+
+    index.mark("c", "node/ex", 7)
+
+    copy = DedupIndex(None, "dedup")
+    copy.load(index.export())
+
+    assert copy.seen("a") and copy.seen("b")
+    assert copy.seen("other", "node/ex", 7)
+
+
+def test_watermark_tolerates_out_of_order_sequences_within_the_window():
+    watermark = ProducerWatermark(window=4)
+    for seq in (1, 3, 2, 5):
+        watermark.add(seq)
+
+    assert watermark.hwm == 3 and watermark.pending == {5}
+    assert watermark.seen(2) and watermark.seen(5)
+    assert not watermark.seen(4)
+
+    # Un hueco que queda fuera de la ventana ya no se espera
+    watermark.add(10)
+    assert watermark.hwm == 6
+    assert watermark.seen(4)
+    assert not watermark.seen(8)
+
+
+def test_redelivery_is_caught_by_sequence_after_its_segment_expires(tmp_path):
+    fault_manager = FaultManager(str(tmp_path))
+    index = DedupIndex(fault_manager, "dedup", segment_seconds=10, retained_segments=2)
+    index.mark_many(["p1", "p2"], [("node/ex", 1), ("node/ex", 2)])
+
+    index.expire(now=10 ** 12)
+    assert not index.seen("p1")
+    assert index.seen("p1", "node/ex", 1)
+
+    restored = DedupIndex(FaultManager(str(tmp_path)), "dedup", segment_seconds=10, retained_segments=2)
+    assert restored.seen("p2", "node/ex", 2)
+    assert not restored.seen("p3", "node/ex", 3)
+
+
+def test_sequences_are_restored_from_the_journal(tmp_path):
+    index = DedupIndex(FaultManager(str(tmp_path)), "dedup")
+    index.mark_many(["p1", "p2"], [("node/ex", 1), (None, None)])
+
+    restored = DedupIndex(FaultManager(str(tmp_path)), "dedup")
+    assert restored.seen("other", "node/ex", 1)
+    assert restored.seen("p2")
+    assert not restored.seen("p3", "node/ex", 2)
+
+
+def test_middleware_skips_duplicates_delivered_out_of_order(tmp_path, start, eventually, queue_name):
+    # El gateway duplica lotes y un nodo caído los reenvía: el duplicado
+    # puede llegar después de otros lotes, con otra secuencia
+    processed = []
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=processed.append,
+        eofCallback=lambda _: None,
+        faultManager=FaultManager(str(tmp_path)),
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    for packet_id in ("p1", "p2", "p1", "p3", "p2", "p4"):
+        producer.send_batch(packet_id, [[packet_id, 1]])
+
+    eventually(lambda: len(processed) == 4)
+    assert [message.split("\n")[0] for message in processed] == ["p1", "p2", "p3", "p4"]
@@ -0,0 +1,80 @@
+from common.eof_barrier import EofBarrier
+from common.fault_manager import FaultManager
+from common.packet_fin import Fin
+
+
+def test_fires_once_after_every_producer():
+    fired = []
+    barrier = EofBarrier(2, fired.append)
+
+    assert not barrier.fin_received(Fin(0, 1, "a"))
+    assert not barrier.fin_received(Fin(0, 1, "a"))  # reentregado
+    assert barrier.fin_received(Fin(0, 1, "b"))
+    assert not barrier.fin_received(Fin(0, 1, "b"))
+
+    assert fired == ["1"]
+    assert barrier.is_complete(1)
+
+
+def test_waits_for_the_announced_batches():
+    fired = []
+    barrier = EofBarrier(1, fired.append, count_batches=True)
+    barrier.batch_received(1)
+    barrier.fin_received(Fin(3, 1, "a"))
+    barrier.batch_received(1, 1)
+    assert fired == []
+
+    barrier.batch_received(1)
+
+    assert fired == ["1"]
+
+
+def test_fins_and_counted_batches_survive_a_restart(tmp_path):
+    fired = []
+    barrier = EofBarrier(2, fired.append, count_batches=True, fault_manager=FaultManager(str(tmp_path)))
+    barrier.batch_received(1, packet_id="p1")
+    barrier.fin_received(Fin(2, 1, "a"))
+
+    restarted = EofBarrier(2, fired.append, count_batches=True, fault_manager=FaultManager(str(tmp_path)))
+    assert not restarted.batch_received(1, packet_id="p1")  # reentregado tras la caída
+    assert not restarted.fin_received(Fin(2, 1, "a"))
+    restarted.batch_received(1, packet_id="p2")
+    assert restarted.fin_received(Fin(0, 1, "b"))
+
+    assert fired == ["1"]
+    assert EofBarrier(2, fired.append, fault_manager=FaultManager(str(tmp_path))).clients == {}
+
+
+def test_forget_drops_the_client(tmp_path):
+    fired = []
+    barrier = EofBarrier(2, fired.append, fault_manager=FaultManager(str(tmp_path)))
+    barrier.fin_received(Fin(0, 1, "a"))
+
+    barrier.forget(1)
+
+    assert EofBarrier(2, fired.append, fault_manager=FaultManager(str(tmp_path))).clients == {}
+    assert fired == []
+
+
+def test_sums_the_batches_announced_by_each_producer():
+    fired = []
+    barrier = EofBarrier(2, fired.append, count_batches=True)
+    barrier.fin_received(Fin(2, 1, "a"))
+    barrier.fin_received(Fin(3, 1, "b"))
+    for packet_id in ("p1", "p2", "p3", "p4"):
+        barrier.batch_received(1, packet_id=packet_id)
+    assert fired == []
+
+    assert barrier.batch_received(1, packet_id="p5")
+    assert fired == ["1"]
+
+
+def test_remembers_only_the_latest_completed_clients():
+    fired = []
+    barrier = EofBarrier(1, fired.append, completed_window=2)
+    for client_id in (1, 2, 3):
+        barrier.fin_received(Fin(0, client_id, "a"))
+
+    assert list(barrier.completed) == ["2", "3"]
+    assert not barrier.fin_received(Fin(0, 3, "a"))  # reentregado tras el resultado
+    assert fired == ["1", "2", "3"]
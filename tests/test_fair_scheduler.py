@@ -0,0 +1,55 @@
+from common.fair_scheduler import FairScheduler
+
+
+def pop_all(scheduler):
+    items = []
+    while (item := scheduler.pop()) is not None:
+        items.append(item)
+    return items
+
+
+def test_weighted_share_while_both_clients_have_work():
+    scheduler = FairScheduler({"heavy": 3})
+    for i in range(30):
+        scheduler.push("heavy", ("heavy", i))
+    for i in range(10):
+        scheduler.push("light", ("light", i))
+
+    first = [scheduler.pop() for _ in range(16)]
+
+    assert sum(1 for client, _ in first if client == "heavy") == 12
+    assert sum(1 for client, _ in first if client == "light") == 4
+
+
+def test_late_client_waits_at_most_one_turn():
+    scheduler = FairScheduler()
+    for i in range(100):
+        scheduler.push(1, ("big", i))
+    scheduler.pop()
+    scheduler.push(2, ("small", 0))
+
+    # Un turno del cliente grande (peso 1) y enseguida el chico
+    assert [scheduler.pop(), scheduler.pop()] == [("big", 1), ("small", 0)]
+
+
+def test_each_client_keeps_its_order():
+    scheduler = FairScheduler({"a": 2})
+    for i in range(5):
+        scheduler.push("a", ("a", i))
+        scheduler.push("b", ("b", i))
+
+    items = pop_all(scheduler)
+
+    assert [i for client, i in items if client == "a"] == list(range(5))
+    assert [i for client, i in items if client == "b"] == list(range(5))
+    assert len(scheduler) == 0
+
+
+def test_drop_removes_a_client():
+    scheduler = FairScheduler()
+    scheduler.push("a", 1)
+    scheduler.push("b", 2)
+    scheduler.push("a", 3)
+
+    assert scheduler.drop("a") == [1, 3]
+    assert pop_all(scheduler) == [2]
@@ -0,0 +1,36 @@
+from common.feedback import RESOLVED_KEYS_EXCHANGE, ResolvedKeys, resolved_notice
+from common.memory_engine import MemoryBroker
+from common.middleware import Middleware
+
+
+def test_notices_accumulate_per_client():
+    resolved = ResolvedKeys()
+    resolved.apply(resolved_notice(1, ["10"]))
+    resolved.apply(resolved_notice(1, [11]))
+    resolved.apply(resolved_notice(2, ["20"]))
+
+    assert resolved.resolved(1) == {"10", "11"}
+    assert resolved.resolved("2") == {"20"}
+    assert resolved.resolved(3) == frozenset()
+
+
+def test_done_forgets_the_client():
+    resolved = ResolvedKeys()
+    resolved.apply(resolved_notice(1, ["10"]))
+
+    resolved.apply(resolved_notice(1, done=True))
+
+    assert resolved.resolved(1) == frozenset()
+
+
+def test_listener_receives_notices_from_the_exchange(eventually, queue_name):
+    resolved = ResolvedKeys()
+    resolved.listen(queue_name)
+    publisher = Middleware(output_exchanges=[RESOLVED_KEYS_EXCHANGE])
+    broker = MemoryBroker.instance()
+    # El listener declara su cola (con sufijo de instancia) en su propio hilo
+    eventually(lambda: any(queue.startswith(queue_name) for queue, _ in broker.exchanges[RESOLVED_KEYS_EXCHANGE][1]))
+
+    publisher.send(resolved_notice(1, ["10"]))
+
+    eventually(lambda: resolved.resolved(1) == {"10"})
@@ -0,0 +1,97 @@
+import pika
+from common.flow_control import FlowController, QueueProbe
+from common.memory_engine import MemoryBroker, MemoryEngineConnection
+
+
+class FakeProbe:
+    """
+    Largo de cola que devuelve, en orden, los valores que arma el test.
+    """
+
+    def __init__(self, depths):
+        self.depths = list(depths)
+        self.calls = 0
+
+    def depth(self, queue):
+        self.calls += 1
+        return self.depths.pop(0) if len(self.depths) > 1 else self.depths[0]
+
+
+def controller(depths, high=10, low=5, check_interval=60.0):
+    waits = []
+    flow = FlowController(
+        None, ["slow"], high, low, check_interval=check_interval, pump=lambda time_limit: waits.append(time_limit)
+    )
+    flow.probe = FakeProbe(depths)
+    return flow, waits
+
+
+def test_probe_measures_ready_messages_and_tolerates_missing_queues():
+    broker = MemoryBroker()
+    connection = MemoryEngineConnection(broker)
+    probe = QueueProbe(connection)
+    assert probe.depth("slow") == 0
+
+    channel = connection.channel()
+    channel.queue_declare("slow")
+    for body in (b"a", b"b", b"c"):
+        channel.basic_publish("", "slow", body, pika.BasicProperties())
+    assert probe.depth("slow") == 3
+
+
+def test_credits_are_spent_before_measuring_again():
+    flow, waits = controller([7])
+    for _ in range(3):
+        flow.acquire()
+
+    # Una medición con lag 7 bajo un máximo de 10 da lugar para 3 publicaciones
+    assert flow.probe.calls == 1
+    flow.acquire()
+    assert flow.probe.calls == 2
+    assert waits == []
+
+
+def test_blocks_above_the_high_watermark_until_below_the_low_one():
+    flow, waits = controller([12, 8, 6, 5])
+    flow.acquire()
+
+    # 8 y 6 siguen arriba de low_watermark: solo reanuda con 5
+    assert flow.probe.calls == 4
+    assert len(waits) == 3
+    assert flow.credits == 10 - 5 - 1
+
+
+def test_stale_credits_are_measured_again():
+    flow, _ = controller([0, 3], check_interval=0.0)
+    flow.acquire()
+    flow.acquire()
+    assert flow.probe.calls == 2
+
+
+def test_pool_takes_credit_before_locking_the_connection(queue_name):
+    from types import SimpleNamespace
+    from gateway.broker_pool import BrokerPool
+
+    pool = BrokerPool(1, {f"{queue_name}_ex": "fanout"})
+    with pool.checkout("flow"):
+        pass
+    locked_while_waiting = []
+    flow = SimpleNamespace(acquire=lambda stop_event: locked_while_waiting.append(pool.publishers[0].lock.locked()) or True)
+    pool.flow_middleware = SimpleNamespace(flow=flow, stop=lambda: None)
+
+    with pool.checkout("flow") as middleware:
+        middleware.send_to_exchange(f"{queue_name}_ex", "p1\nrow")
+
+    assert locked_while_waiting == [False]
+    pool.close()
+
+
+def test_stop_event_interrupts_the_wait_without_credit():
+    import threading
+
+    stop = threading.Event()
+    flow = FlowController(None, ["slow"], 10, 5, check_interval=60.0, pump=lambda time_limit: stop.set())
+    flow.probe = FakeProbe([50])
+
+    assert flow.acquire(stop) is False
+    assert flow.credits == 0
@@ -0,0 +1,70 @@
+import random
+import pika
+from common.load_routing import LoadAwareRouter
+from common.memory_engine import MemoryBroker, MemoryEngineConnection
+
+
+def backlog(broker, queue, messages):
+    broker.queue_declare(queue)
+    for _ in range(messages):
+        broker.publish("", queue, b"batch", pika.BasicProperties())
+
+
+def test_bursts_go_to_the_least_loaded_queue_until_it_catches_up():
+    broker = MemoryBroker()
+    backlog(broker, "lang_1", 10)
+    backlog(broker, "lang_2", 0)
+    connection = MemoryEngineConnection(broker)
+    router = LoadAwareRouter(lambda: connection, ["lang_1", "lang_2"], refresh_interval=60, rng=random.Random(1))
+
+    chosen = [router.choose() for _ in range(10)]
+
+    # Lo mandado desde la medición cuenta como carga: la ráfaga no va toda a la misma
+    assert chosen == ["lang_2"] * 10
+    assert router.load("lang_1") == router.load("lang_2") == 10
+
+
+def test_measurement_replaces_the_sent_estimate():
+    broker = MemoryBroker()
+    backlog(broker, "lang_1", 0)
+    backlog(broker, "lang_2", 3)
+    connection = MemoryEngineConnection(broker)
+    router = LoadAwareRouter(lambda: connection, ["lang_1", "lang_2"], refresh_interval=0)
+
+    router.choose()
+    assert router.measured == {"lang_1": 0, "lang_2": 3}
+    backlog(broker, "lang_1", 5)
+    router.choose()
+
+    assert router.measured == {"lang_1": 5, "lang_2": 3}
+    assert router.sent == {"lang_1": 0, "lang_2": 1}
+
+
+def test_probe_follows_the_middleware_to_a_new_connection():
+    broker = MemoryBroker()
+    backlog(broker, "lang_1", 2)
+    connections = [MemoryEngineConnection(broker)]
+    router = LoadAwareRouter(lambda: connections[-1], ["lang_1"], refresh_interval=0)
+    router.choose()
+
+    connections.append(MemoryEngineConnection(broker))
+    router.choose()
+
+    assert router.probe.connection is connections[-1]
+    assert router.measured["lang_1"] == 2
+
+
+def test_failed_measurement_keeps_the_last_estimate():
+    broker = MemoryBroker()
+    backlog(broker, "lang_1", 4)
+    backlog(broker, "lang_2", 0)
+    connection = MemoryEngineConnection(broker)
+    router = LoadAwareRouter(lambda: connection, ["lang_1", "lang_2"], refresh_interval=0)
+    router.choose()
+
+    def broken(queue):
+        raise pika.exceptions.AMQPConnectionError("lost")
+    router.probe.depth = broken
+
+    assert router.choose() == "lang_2"
+    assert router.measured == {"lang_1": 4, "lang_2": 0}
@@ -0,0 +1,165 @@
+import threading
+import pika
+import pytest
+from common.memory_engine import MemoryBroker, MemoryEngineConnection
+
+
+def consumer(broker, queue, on_message):
+    connection = MemoryEngineConnection(broker)
+    channel = connection.channel()
+    channel.basic_consume(queue, on_message)
+    threading.Thread(target=channel.start_consuming, daemon=True).start()
+    return channel
+
+
+def test_derived_messages_keep_the_inbound_delivery_alive(eventually):
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    broker.queue_declare("out")
+    broker.publish("", "in", b"a", pika.BasicProperties(), origin=5)
+    broker.publish("", "in", b"b", pika.BasicProperties(), origin=6)
+
+    done = []
+
+    def stage(channel, method, _properties, body):
+        # Publica lo derivado antes de confirmar la entrada, como un nodo
+        channel.basic_publish("", "out", body + b"'")
+        channel.basic_ack(method.delivery_tag)
+        done.append(body)
+
+    consumer(broker, "in", stage)
+    eventually(lambda: len(done) == 2)
+    assert broker.low_watermark() == 5
+
+    delivered = []
+    sink = consumer(broker, "out", lambda _ch, method, _p, body: delivered.append(method.delivery_tag))
+    eventually(lambda: len(delivered) == 2)
+    sink.basic_ack(delivered[0])
+    assert broker.low_watermark() == 6
+    sink.basic_ack(delivered[1])
+    assert broker.low_watermark() is None
+
+
+def test_requeued_messages_keep_their_origin_and_purge_releases_them(eventually):
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    broker.publish("", "in", b"a", pika.BasicProperties(), origin=3)
+    delivered = []
+    channel = consumer(broker, "in", lambda _ch, method, _p, _body: delivered.append(method.delivery_tag))
+    eventually(lambda: delivered)
+
+    channel.close()
+
+    assert broker.low_watermark() == 3
+    assert broker.queue_purge("in") == 1
+    assert broker.low_watermark() is None
+
+
+def test_messages_without_origin_are_not_tracked():
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    broker.publish("", "in", b"a", pika.BasicProperties())
+    assert broker.low_watermark() is None
+
+
+def test_exchanges_route_like_rabbitmq():
+    broker = MemoryBroker()
+    broker.exchange_declare("fan", "fanout")
+    broker.exchange_declare("dir", "direct")
+    for queue in ("q1", "q2"):
+        broker.queue_declare(queue)
+        broker.queue_bind(queue, "fan")
+    broker.queue_bind("q1", "dir", "k1")
+    broker.queue_bind("q2", "dir")  # sin routing key se usa el nombre de la cola
+
+    broker.publish("fan", "", b"all", pika.BasicProperties())
+    broker.publish("dir", "k1", b"to q1", pika.BasicProperties())
+    broker.publish("dir", "q2", b"to q2", pika.BasicProperties())
+    broker.publish("dir", "nobody", b"dropped", pika.BasicProperties())
+
+    assert [m[2] for m in broker.queues["q1"].messages] == [b"all", b"to q1"]
+    assert [m[2] for m in broker.queues["q2"].messages] == [b"all", b"to q2"]
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker):
+        broker.queue_declare("missing", passive=True)
+
+
+def test_prefetch_holds_deliveries_until_acked(eventually):
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    for body in (b"a", b"b", b"c"):
+        broker.publish("", "in", body, pika.BasicProperties())
+    connection = MemoryEngineConnection(broker)
+    channel = connection.channel()
+    channel.basic_qos(prefetch_count=2)
+    delivered = []
+    channel.basic_consume("in", lambda _ch, method, _p, body: delivered.append((method.delivery_tag, body)))
+    threading.Thread(target=channel.start_consuming, daemon=True).start()
+
+    eventually(lambda: len(delivered) == 2)
+    assert len(broker.queues["in"].messages) == 1
+
+    channel.basic_ack(2, multiple=True)
+    eventually(lambda: len(delivered) == 3)
+    assert [body for _, body in delivered] == [b"a", b"b", b"c"]
+    assert broker.idle() is False
+    channel.basic_ack(3)
+    assert broker.idle()
+
+
+def test_unacked_deliveries_come_back_redelivered_in_order(eventually):
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    for body in (b"a", b"b"):
+        broker.publish("", "in", body, pika.BasicProperties())
+    first = []
+    channel = consumer(broker, "in", lambda _ch, method, _p, body: first.append(body))
+    eventually(lambda: len(first) == 2)
+
+    channel.close()
+    again = []
+    consumer(broker, "in", lambda _ch, method, _p, body: again.append((body, method.redelivered)))
+
+    eventually(lambda: len(again) == 2)
+    assert again == [(b"a", True), (b"b", True)]
+
+
+def _service(node, volume=None, **env):
+    service = {
+        "build": {"context": ".", "dockerfile": f"./{node}/Dockerfile"},
+        "environment": [f"{key}={value}" for key, value in env.items()],
+    }
+    if volume:
+        service["volumes"] = [f"./{node}/persistence:{volume}"]
+    return service
+
+
+def test_colocated_image_ships_every_stage():
+    import os
+    from common.stages import NODES_ROOT, STAGES
+
+    with open(os.path.join(NODES_ROOT, "colocated", "Dockerfile")) as dockerfile:
+        copied = dockerfile.read()
+    assert all(f"COPY /{node} /src/{node}" in copied for node in STAGES)
+
+
+def test_colocation_rejects_two_stateful_stages():
+    from generador_compose import colocate_services
+
+    services = {
+        "top10": _service("top10_indie_counter", "/persistence", OUTPUT_EXCHANGES='["a"]'),
+        "percentile": _service("percentile_accumulator", "/persistence", OUTPUT_EXCHANGES='["b"]'),
+    }
+    with pytest.raises(ValueError, match="at most one stateful stage"):
+        colocate_services(services, "both", ["top10", "percentile"])
+
+
+def test_colocation_keeps_the_single_stateful_volume():
+    from generador_compose import colocate_services
+
+    services = {
+        "range": _service("range_filter", OUTPUT_EXCHANGES='["ranged"]'),
+        "top10": _service("top10_indie_counter", "/persistence", INPUT_QUEUES='{"q": "ranged"}'),
+    }
+    colocate_services(services, "pipeline", ["range", "top10"])
+
+    assert services["pipeline"]["volumes"] == ["./top10_indie_counter/persistence:/persistence"]
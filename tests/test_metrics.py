@@ -0,0 +1,67 @@
+import json
+import socket
+from common import metrics
+from common.healthcheck import HealthCheckServer
+from common.metrics import BUCKETS, Histogram, MetricsRegistry
+from common.middleware import Middleware
+from common.packet_fin import Fin
+
+
+def test_histogram_quantiles_use_the_bucket_bounds():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.observe(0.00004)
+    histogram.observe(100)
+
+    assert histogram.quantile(0.5) == BUCKETS[0]
+    assert histogram.quantile(0.99) == BUCKETS[0]
+    assert histogram.quantile(1) == 100  # por encima del último bucket se usa el máximo
+    assert histogram.to_dict()["buckets"] == {f"{BUCKETS[0]:g}": 99, "+Inf": 1}
+
+
+def test_labels_keep_separate_series():
+    registry = MetricsRegistry()
+    registry.increment("messages_total", client="1")
+    registry.increment("messages_total", 2, client="2")
+    registry.increment("messages_total", client="1")
+    with registry.timer("ack_seconds"):
+        pass
+
+    snapshot = registry.snapshot()
+    counters = {c["labels"]["client"]: c["value"] for c in snapshot["counters"]}
+    assert counters == {"1": 2, "2": 2}
+    assert [h["name"] for h in snapshot["histograms"]] == ["ack_seconds"]
+
+
+def test_middleware_measures_callbacks_per_client(monkeypatch, start, eventually, queue_name):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "registry", registry)
+    seen = []
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=seen.append,
+        eofCallback=seen.append,
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p1", [["a", 7], ["b", 7]])
+    producer.send(Fin(1, 7).encode())
+
+    eventually(lambda: len(seen) == 2)
+    eventually(lambda: ("messages_total", (("client", "7"), ("type", "fin"))) in registry.counters)
+    assert registry.counters[("rows_total", (("client", "7"),))] == 2
+    assert ("callback_seconds", (("client", "7"), ("type", "batch"))) in registry.histograms
+
+
+def test_metrics_are_served_on_the_health_check_socket(monkeypatch):
+    registry = MetricsRegistry()
+    registry.increment("messages_total")
+    monkeypatch.setattr(metrics, "registry", registry)
+    server, client = socket.socketpair()
+    with server, client:
+        HealthCheckServer._send_metrics(None, server)
+        length = int.from_bytes(metrics._recv_exactly(client, 4), byteorder="big")
+        snapshot = json.loads(metrics._recv_exactly(client, length))
+
+    assert snapshot["counters"] == [{"name": "messages_total", "labels": {}, "value": 1}]
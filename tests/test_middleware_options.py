@@ -0,0 +1,131 @@
+import pytest
+from common import middleware as middleware_module
+from common.batch_codec import decode_batch
+from common.envelope import Envelope
+from common.fault_manager import FaultManager
+from common.memory_engine import MemoryBroker
+from common.middleware import Middleware
+
+
+def tap(exchange, queue):
+    """
+    Cola propia atada al exchange de salida, para ver lo que publica un nodo en orden.
+    """
+    broker = MemoryBroker.instance()
+    broker.queue_declare(queue)
+    broker.queue_bind(queue, exchange, "")
+    return broker.queues[queue].messages
+
+
+def published(messages):
+    kinds = []
+    for _, _, body, properties, _, _ in list(messages):
+        envelope = Envelope.from_properties(properties)
+        kinds.append(f"barrier {envelope.batch_id}" if envelope.is_barrier else decode_batch(body).packet_id)
+    return kinds
+
+
+def test_output_batching_on_a_stateful_node_is_rejected(tmp_path, monkeypatch, queue_name):
+    def stateful(**kwargs):
+        return Middleware(
+            input_queues={queue_name: f"{queue_name}_ex"},
+            intance_id=0,
+            callback=lambda _: None,
+            faultManager=FaultManager(str(tmp_path)),
+            **kwargs,
+        )
+
+    with pytest.raises(ValueError, match="stateless"):
+        stateful(output_linger_ms=20)
+    # También si viene del entorno del contenedor
+    monkeypatch.setattr(middleware_module, "OUTPUT_BATCH_LINGER_MS", 20)
+    with pytest.raises(ValueError, match="stateless"):
+        stateful()
+
+    assert stateful(output_linger_ms=0).output_batcher is None
+
+
+@pytest.mark.parametrize("concurrency", [{"fair_scheduling": True}, {"worker_function": str, "workers": 2}])
+def test_checkpoints_with_concurrent_delivery_are_rejected(concurrency, tmp_path, monkeypatch, queue_name):
+    monkeypatch.setattr(middleware_module, "CHECKPOINT_INTERVAL", 1.0)
+
+    with pytest.raises(ValueError, match="single-threaded"):
+        Middleware(
+            input_queues={queue_name: f"{queue_name}_ex"},
+            intance_id=0,
+            callback=lambda _: None,
+            faultManager=FaultManager(str(tmp_path)),
+            snapshot=lambda: {},
+            restore=lambda _: None,
+            **concurrency,
+        )
+
+
+def forwarding_node(queue_name, **kwargs):
+    node = None
+
+    def forward(result):
+        batch = decode_batch(result) if isinstance(result, (str, bytes)) else result
+        node.send_batch(batch.packet_id, batch.rows())
+
+    node = Middleware(
+        input_queues={queue_name: f"{queue_name}_in"},
+        output_exchanges=[f"{queue_name}_out"],
+        intance_id=0,
+        callback=forward,
+        **kwargs,
+    )
+    return node
+
+
+def test_worker_pool_forwards_the_barrier_behind_earlier_results(monkeypatch, start, eventually, queue_name):
+    monkeypatch.setattr(middleware_module, "CHECKPOINT_INTERVAL", 60.0)
+    monkeypatch.setattr(middleware_module, "WORKER_POOL_MODE", middleware_module.THREAD_WORKERS)
+    node = start(forwarding_node(queue_name, worker_function=decode_batch, workers=2))
+    output = tap(f"{queue_name}_out", f"{queue_name}_tap")
+    producer = Middleware(output_exchanges=[f"{queue_name}_in"])
+    producer.send_batch("p1", [["a", 1]])
+    producer.send_batch("p2", [["b", 2]])
+    producer.send_barrier(4)
+
+    eventually(lambda: len(output) == 3)
+    assert published(output) == ["p1", "p2", "barrier 4"]
+    assert node.last_barrier == 4
+
+
+def test_fair_scheduler_forwards_the_barrier_without_waiting_its_turn(monkeypatch, start, eventually, queue_name):
+    monkeypatch.setattr(middleware_module, "CHECKPOINT_INTERVAL", 60.0)
+    node = start(forwarding_node(queue_name, fair_scheduling=True))
+    output = tap(f"{queue_name}_out", f"{queue_name}_tap")
+    producer = Middleware(output_exchanges=[f"{queue_name}_in"])
+    producer.send_batch("p1", [["a", 1]])
+    producer.send_batch("p2", [["b", 2]])
+    producer.send_barrier(4)
+
+    # Cada ack es individual: la marca no retiene las entregas que esperan turno
+    eventually(lambda: len(output) == 3)
+    assert sorted(published(output)) == ["barrier 4", "p1", "p2"]
+    assert node.last_barrier == 4
+    eventually(lambda: not node.channel.unacked)
+
+
+def test_cancel_flushes_the_group_without_the_cancelled_client(start, eventually, queue_name):
+    events = []
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=lambda _: None,
+        batch_callback=lambda messages: events.append([m.split("\n")[0] for m in messages]),
+        batch_size=10,
+        batch_linger_ms=60000,
+        cancelCallback=lambda client_id: events.append(f"cancel {client_id}"),
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("x1", [["a", 5]])
+    producer.send_batch("y1", [["b", 6]])
+
+    producer.send_cancel(5)
+
+    # El cancel no espera el linger: sale el grupo (sin lo del cliente cancelado) y después el cancel
+    eventually(lambda: len(events) == 2, timeout=2)
+    assert events == [["y1"], "cancel 5"]
@@ -0,0 +1,107 @@
+from common.batch_codec import decode_batch
+from common.middleware import Middleware
+from common.output_batcher import OutputBatcher
+
+
+def batcher(min_bytes=10, max_bytes=1000, linger=0.1):
+    published, acked = [], []
+    output = OutputBatcher(
+        lambda packet_id, rows, routing_key: published.append((packet_id, rows, routing_key)),
+        acked.append, linger, min_bytes, max_bytes,
+    )
+    return output, published, acked
+
+
+def test_rows_wait_for_the_linger_and_leave_in_one_batch_per_destination():
+    output, published, _ = batcher()
+    output.begin()
+    assert output.add("rk", "p1", [["a", 1], ["b", 2]])  # abre el primer grupo: hay que programar el timer
+    output.begin()
+    assert not output.add("rk", "p2", [["c", 1]])
+    assert published == []
+
+    output.flush()
+
+    assert sorted((rows, key) for _, rows, key in published) == [
+        ([["a", 1], ["c", 1]], "rk"),
+        ([["b", 2]], "rk"),
+    ]
+
+
+def test_a_full_budget_flushes_without_waiting():
+    output, published, _ = batcher(max_bytes=30)
+    output.begin()
+    output.add("rk", "p1", [["x" * 20, 1]])
+    assert published == []
+
+    output.begin()
+    output.add("rk", "p2", [["y" * 20, 1]])
+
+    assert len(published) == 1
+    assert published[0][1] == [["x" * 20, 1], ["y" * 20, 1]]
+
+
+def test_budget_follows_the_observed_rate_within_its_bounds():
+    output, _, _ = batcher(min_bytes=100, max_bytes=1000, linger=0.1)
+    key = ("rk", "1")
+    assert output.budget(key) == 1000  # sin medición: el máximo
+
+    output.rates[key] = 5000.0  # 500 bytes por linger
+    assert output.budget(key) == 500
+    output.rates[key] = 10.0
+    assert output.budget(key) == 100
+    output.rates[key] = 1e9
+    assert output.budget(key) == 1000
+
+
+def test_combined_packet_ids_are_deterministic():
+    first, first_published, _ = batcher()
+    second, second_published, _ = batcher()
+    for output in (first, second):
+        output.add("rk", "p1", [["a", 1]])
+        output.add("rk", "p2", [["b", 1]])
+        output.add("other", "p3", [["c", 1]])
+        output.flush()
+
+    assert first_published == second_published
+    ids = {key: packet_id for packet_id, _, key in first_published}
+    assert ids["other"] == "p3"
+    assert ids["rk"] not in ("p1", "p2")
+
+
+def test_acks_wait_for_the_rows_of_their_delivery_and_earlier_ones():
+    output, _, acked = batcher()
+    output.begin()
+    output.add("a", "p1", [["x", 1]])
+    assert output.hold(1)
+    output.begin()
+    output.add("b", "p2", [["y", 1]])
+    assert output.hold(2)
+
+    output._flush_group(("b", "1"))
+    assert acked == []  # la entrega 2 no pasa a la 1, que sigue pendiente
+    output._flush_group(("a", "1"))
+    assert acked == [1, 2]
+    assert not output.hold(3)
+
+
+def test_middleware_combines_output_after_the_linger(start, eventually, queue_name):
+    received = []
+    start(Middleware(
+        input_queues={f"{queue_name}_sink": f"{queue_name}_out"},
+        intance_id=0,
+        callback=lambda message: received.append(decode_batch(message).rows()),
+    ))
+    node = start(Middleware(
+        input_queues={queue_name: f"{queue_name}_in"},
+        output_exchanges=[f"{queue_name}_out"],
+        intance_id=0,
+        callback=lambda message: node.send_batch(decode_batch(message).packet_id, decode_batch(message).rows()),
+        output_linger_ms=50,
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_in"])
+    producer.send_batch("p1", [["a", 1]])
+    producer.send_batch("p2", [["b", 1]])
+
+    eventually(lambda: received)
+    assert received == [[["a", 1], ["b", 1]]]
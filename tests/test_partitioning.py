@@ -0,0 +1,93 @@
+import random
+import pytest
+from common.partitioning import HashRing, HeavyHitters
+
+KEYS = [str(app_id) for app_id in range(2000)]
+
+
+def test_adding_a_partition_only_moves_keys_to_it():
+    before = HashRing(["p1", "p2", "p3"])
+    after = HashRing(["p1", "p2", "p3", "p4"])
+
+    moved = [key for key in KEYS if before.partition_for(key) != after.partition_for(key)]
+
+    assert all(after.partition_for(key) == "p4" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.4
+
+
+def test_assignment_is_stable_across_instances():
+    assert [HashRing(["a", "b"]).partition_for(key) for key in KEYS[:50]] == [
+        HashRing(["a", "b"]).partition_for(key) for key in KEYS[:50]
+    ]
+
+
+def test_split_groups_rows_by_key():
+    ring = HashRing(["p1", "p2", "p3"])
+    rows = [[key, "name", 1] for key in KEYS[:100]]
+
+    partitioned = ring.split(rows, 0)
+
+    assert sum(len(part) for part in partitioned.values()) == 100
+    for partition, part in partitioned.items():
+        assert all(ring.partition_for(row[0]) == partition for row in part)
+
+
+def test_needs_a_partition():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def test_heavy_hitters_bounds():
+    stream = ["hot"] * 3000 + [f"cold{i % 500}" for i in range(7000)]
+    random.Random(1).shuffle(stream)
+    detector = HeavyHitters(threshold=0.1, capacity=16)
+    for key in stream:
+        detector.add(key)
+
+    assert len(detector.counts) <= 16
+    for key, count in detector.counts.items():
+        true_count = stream.count(key)
+        # Space-Saving nunca subestima, y la cuenta garantizada nunca sobreestima
+        assert count >= true_count
+        assert count - detector.errors[key] <= true_count
+    assert detector.is_hot("hot")
+    assert not any(detector.is_hot(f"cold{i}") for i in range(500))
+
+
+def test_no_hot_keys_before_min_rows():
+    detector = HeavyHitters(threshold=0.1, min_rows=1000)
+    detector.add("hot", 999)
+    assert not detector.is_hot("hot")
+    detector.add("hot")
+    assert detector.is_hot("hot")
+
+
+def test_hot_key_rows_are_spread_over_the_splits():
+    ring = HashRing(["p1", "p2", "p3", "p4"], hot_key_splits=2, hot_key_threshold=0.2, merged=True)
+    ring.heavy_hitters.min_rows = 10
+    rows = [["hot", i] for i in range(40)] + [[key, 0] for key in KEYS[:20]]
+
+    ring.split(rows, 0)
+    partitioned = ring.split(rows, 0)
+
+    owner = ring.partition_for("hot")
+    following = ring.partitions[(ring.partitions.index(owner) + 1) % 4]
+    hot_partitions = {partition for partition, part in partitioned.items() if any(row[0] == "hot" for row in part)}
+    assert hot_partitions == {owner, following}
+
+
+def test_hot_key_splitting_needs_a_merge_behind_the_consumers():
+    with pytest.raises(ValueError):
+        HashRing(["p1", "p2"], hot_key_splits=2)
+
+
+def test_each_hot_key_takes_its_own_turns():
+    ring = HashRing(["p1", "p2", "p3", "p4"], hot_key_splits=2, merged=True)
+    first = [ring._hot_partition("a") for _ in range(4)]
+    # Las filas de otra clave no le corren el turno a la primera
+    ring._hot_partition("b")
+    second = [ring._hot_partition("a") for _ in range(4)]
+
+    owner = ring.partition_for("a")
+    following = ring.partitions[(ring.partitions.index(owner) + 1) % 4]
+    assert first == second == [owner, following, owner, following]
@@ -0,0 +1,80 @@
+import pika
+from common import middleware as middleware_module
+from common.fault_manager import FaultManager
+from common.middleware import Middleware
+from common.select_engine import CLOSED
+
+
+def test_consumer_resumes_after_the_broker_drops_the_connection(start, eventually, queue_name):
+    seen = []
+    node = start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=lambda message: seen.append(message.split("\n")[0]),
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p0", [["row", 1]])
+    eventually(lambda: seen == ["p0"])
+    dropped = node.connection
+
+    dropped.events.put((CLOSED, pika.exceptions.ConnectionClosedByBroker(320, "CONNECTION_FORCED")))
+    eventually(lambda: node.connection is not dropped)
+    producer.send_batch("p1", [["row", 1]])
+
+    eventually(lambda: seen == ["p0", "p1"])
+
+
+def test_delivery_cut_by_the_drop_is_redelivered_and_deduplicated(tmp_path, start, eventually, queue_name):
+    seen = []
+    node = None
+
+    def callback(message):
+        packet_id = message.split("\n")[0]
+        seen.append(packet_id)
+        if packet_id == "p0" and seen.count("p0") == 1:
+            # Se cae la conexión antes del ack: el broker la vuelve a entregar
+            node._on_connection_lost(pika.exceptions.StreamLostError("lost"))
+
+    node = start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=callback,
+        faultManager=FaultManager(str(tmp_path)),
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    producer.send_batch("p0", [["row", 1]])
+    producer.send_batch("p1", [["row", 1]])
+
+    eventually(lambda: "p1" in seen)
+    assert seen == ["p0", "p1"]
+    eventually(lambda: node.connection.channels[-1].unacked == {})
+
+
+def test_publisher_retries_with_backoff_and_resends_what_was_lost(monkeypatch, start, eventually, queue_name):
+    monkeypatch.setattr(middleware_module, "RECONNECT_INITIAL_DELAY", 0.01)
+    seen = []
+    start(Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=lambda message: seen.append(message.split("\n")[0]),
+    ))
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+
+    def broken_publish(*args, **kwargs):
+        raise pika.exceptions.StreamLostError("lost")
+    producer.channel.basic_publish = broken_publish
+    attempts = []
+    open_connection = producer._open_connection
+
+    def flaky_open():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise pika.exceptions.AMQPConnectionError("broker down")
+        return open_connection()
+    producer._open_connection = flaky_open
+
+    producer.send_batch("p0", [["row", 1]])
+
+    assert len(attempts) == 3
+    assert not producer.connection_lost
+    eventually(lambda: seen == ["p0"])
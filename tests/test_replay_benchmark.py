@@ -0,0 +1,70 @@
+import threading
+import time
+import pika
+import yaml
+from benchmarks import replay_benchmark
+from benchmarks.replay_benchmark import (
+    _merged_histogram, _wait_until_settled, read_messages, service_environment, write_message,
+)
+from common import metrics
+from common.envelope import Envelope
+from common.memory_engine import MemoryBroker, MemoryEngineConnection
+from common.metrics import MetricsRegistry
+
+
+def test_recording_keeps_headers_encoding_and_order(tmp_path):
+    path = tmp_path / "node.rec"
+    fin = Envelope("fin", client_id="1", batch_id="3").to_headers()
+    with open(path, "wb") as file:
+        write_message(file, "games_0", "games_0", pika.BasicProperties(content_encoding="zlib"), b"\x00compressed")
+        # pika entrega los strings de los headers como bytes
+        headers = {key: value.encode() if isinstance(value, str) else value for key, value in fin.items()}
+        write_message(file, "games_0", "games_0", pika.BasicProperties(headers=headers), b"")
+
+    (first_meta, first_body), (fin_meta, fin_body) = read_messages(str(path))
+
+    assert first_meta["content_encoding"] == "zlib" and first_body == b"\x00compressed"
+    assert fin_meta["headers"] == fin and fin_body == b""
+    assert Envelope.from_properties(pika.BasicProperties(headers=fin_meta["headers"])).is_fin
+
+
+def test_callback_latency_merges_every_series():
+    registry = MetricsRegistry()
+    for _ in range(9):
+        registry.observe("callback_seconds", 0.00004, type="batch", client="1")
+    registry.observe("callback_seconds", 0.5, type="fin", client="2")
+    registry.observe("ack_seconds", 10)
+
+    merged = _merged_histogram(registry.snapshot(), metrics, "callback_seconds")
+
+    assert merged.count == 10
+    assert merged.max == 0.5
+    assert merged.quantile(0.5) == metrics.BUCKETS[0]
+
+
+def test_settles_once_the_last_delivery_is_acked(monkeypatch):
+    monkeypatch.setattr(replay_benchmark, "SETTLE_SECONDS", 0.01)
+    broker = MemoryBroker()
+    broker.queue_declare("in")
+    channel = MemoryEngineConnection(broker).channel()
+    channel.basic_consume("in", lambda *_: None)
+    broker.publish("", "in", b"a", pika.BasicProperties())
+    acked = []
+
+    def ack():
+        acked.append(time.perf_counter())
+        channel.basic_ack(1)
+    threading.Timer(0.05, ack).start()
+
+    assert _wait_until_settled(broker) >= acked[0]
+
+
+def test_environment_comes_from_the_compose_service(tmp_path):
+    compose = tmp_path / "compose.yaml"
+    compose.write_text(yaml.safe_dump({"services": {"action_filter": {
+        "environment": ['INPUT_QUEUES={"q": "ex"}', "OUTPUT_BATCH_LINGER_MS=5"],
+    }}}))
+
+    env = service_environment(str(compose), "action_filter")
+
+    assert env == {"INPUT_QUEUES": '{"q": "ex"}', "OUTPUT_BATCH_LINGER_MS": "5"}
@@ -0,0 +1,89 @@
+import threading
+import pika
+import pytest
+from types import SimpleNamespace
+from common.select_engine import CLOSED, DELIVERY, QueuedEventsConnection, SelectEngineChannel
+
+
+class FakeEngine(QueuedEventsConnection):
+    """
+    Motor sin ioloop: lo que se manda al loop corre en el momento.
+    """
+
+    def in_loop(self, callback):
+        callback()
+
+    def call_sync(self, starter, channel=None):
+        result = []
+        starter(lambda frame=None: result.append(frame))
+        return result[0]
+
+
+class FakeImpl:
+    def __init__(self):
+        self.consumers = {}
+        self.acks = []
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def basic_consume(self, queue, on_message, auto_ack=False, callback=None):
+        self.consumers[queue] = on_message
+        callback(SimpleNamespace(method=SimpleNamespace(consumer_tag=f"ctag-{queue}")))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+
+def test_deliveries_wait_while_a_sync_operation_runs_control_events():
+    engine = FakeEngine()
+    seen = []
+    confirmed = threading.Event()
+    engine.events.put((DELIVERY, lambda: seen.append("delivery 1")))
+    engine.add_callback_threadsafe(confirmed.set)
+    engine.events.put((DELIVERY, lambda: seen.append("delivery 2")))
+
+    engine.wait_until(confirmed.is_set)
+    assert seen == []
+
+    engine.events.put((DELIVERY, lambda: seen.append("delivery 3")))
+    engine.add_callback_threadsafe(lambda: engine.events.put((CLOSED, pika.exceptions.ConnectionClosedByClient(200, ""))))
+    engine.consume_events()
+    assert seen == ["delivery 1", "delivery 2", "delivery 3"]
+
+
+def test_broker_close_is_raised_to_the_consumer():
+    engine = FakeEngine()
+    engine.events.put((CLOSED, pika.exceptions.ConnectionClosedByBroker(320, "CONNECTION_FORCED")))
+
+    with pytest.raises(pika.exceptions.ConnectionClosedByBroker):
+        engine.consume_events()
+
+
+def test_callbacks_run_in_the_consuming_thread_in_delivery_order():
+    engine = FakeEngine()
+    impl = FakeImpl()
+    channel = SelectEngineChannel(engine, impl)
+    seen = []
+
+    def on_message(ch, method, _properties, body):
+        seen.append((threading.current_thread().name, body))
+        ch.basic_ack(delivery_tag=method.delivery_tag, multiple=True)
+
+    assert channel.basic_consume("q", on_message) == "ctag-q"
+    # El ioloop entrega desde su hilo
+    loop = threading.Thread(
+        target=lambda: [
+            impl.consumers["q"](impl, pika.spec.Basic.Deliver(delivery_tag=tag), None, f"m{tag}".encode())
+            for tag in (1, 2)
+        ],
+        name="pika-ioloop",
+    )
+    loop.start()
+    loop.join()
+    engine.add_callback_threadsafe(lambda: engine.events.put((CLOSED, pika.exceptions.ConnectionClosedByClient(200, ""))))
+    engine.consume_events()
+
+    main = threading.current_thread().name
+    assert seen == [(main, b"m1"), (main, b"m2")]
+    assert impl.acks == [(1, True), (2, True)]
@@ -0,0 +1,57 @@
+import json
+from common.fault_manager import FaultManager
+from common.shard_merge import PartialCountsMerger
+
+
+def test_sums_partials_of_split_keys_once_every_shard_reported():
+    merged = []
+    merger = PartialCountsMerger(2, lambda client_id, counts: merged.append((client_id, counts)))
+
+    merger.add(1, "s1", {"10": {"name": "Hot", "count": 5}, "11": {"name": "A", "count": 1}})
+    merger.add(1, "s1", {"10": {"name": "Hot", "count": 5}})  # reentregado
+    assert merged == []
+    merger.add(1, "s2", {"10": {"name": "Hot", "count": 3}})
+
+    assert merged == [("1", {"10": {"name": "Hot", "count": 8}, "11": {"name": "A", "count": 1}})]
+
+
+def test_partials_survive_a_restart(tmp_path):
+    merged = []
+    merger = PartialCountsMerger(2, lambda client_id, counts: merged.append(counts), FaultManager(str(tmp_path)))
+    merger.add(1, "s1", {"10": {"name": "Hot", "count": 5}})
+
+    restarted = PartialCountsMerger(2, lambda client_id, counts: merged.append(counts), FaultManager(str(tmp_path)))
+    restarted.add(1, "s1", {"10": {"name": "Hot", "count": 5}})
+    restarted.add(1, "s2", {"10": {"name": "Hot", "count": 2}})
+
+    assert merged == [{"10": {"name": "Hot", "count": 7}}]
+
+
+def test_merge_role_needs_no_fins(tmp_path, monkeypatch, start, eventually, queue_name):
+    from common.middleware import Middleware
+    from common.packet_fin import Fin
+    from review_counter.review_counter import MERGE_ROLE, Top5ReviewCounter
+
+    # El contador persiste en ../persistence/, relativo al directorio de trabajo
+    (tmp_path / "persistence").mkdir()
+    (tmp_path / "app").mkdir()
+    monkeypatch.chdir(tmp_path / "app")
+    results = []
+    start(Middleware(input_queues={f"{queue_name}_out": f"{queue_name}_out_ex"}, intance_id=0, callback=results.append))
+    counter = Top5ReviewCounter(
+        {queue_name: f"{queue_name}_ex"}, [f"{queue_name}_out_ex"], 0, shard_role=MERGE_ROLE, shards=2
+    )
+    assert counter.eof_barrier is None
+    start(counter.middleware)
+
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"], exchange_output_type="direct")
+    for shard, count in (("s1", 5), ("s2", 3)):
+        producer.send(json.dumps({"partial_review_counts": {
+            "client_id": 1, "shard": shard, "games": {"10": {"name": "Hot", "count": count}},
+        }}), routing_key=f"{queue_name}_0")
+        # Un FIN suelto no dispara nada ni frena al consumidor
+        producer.send(Fin(1, 1).encode(), routing_key=f"{queue_name}_0")
+
+    eventually(lambda: len(results) == 1)
+    top5 = json.loads(results[0])["top_5_indie_games_positive_reviews"]["client_id 1"]
+    assert top5 == [{"rank": 1, "name": "Hot", "positive_review_count": 8}]
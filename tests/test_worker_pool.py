@@ -0,0 +1,39 @@
+import time
+from common import middleware as middleware_module
+from common.batch_codec import decode_batch
+from common.middleware import Middleware
+from common.packet_fin import Fin
+
+
+def slow_for_early_batches(message):
+    # El primer lote es el más lento: los workers terminan en orden inverso
+    packet_id = decode_batch(message).packet_id
+    time.sleep(0.05 * (5 - int(packet_id[1:])))
+    return packet_id
+
+
+def test_results_and_acks_follow_delivery_order(monkeypatch, start, eventually, queue_name):
+    monkeypatch.setattr(middleware_module, "WORKER_POOL_MODE", middleware_module.THREAD_WORKERS)
+    processed, acks = [], []
+    node = Middleware(
+        input_queues={queue_name: f"{queue_name}_ex"},
+        intance_id=0,
+        callback=processed.append,
+        eofCallback=lambda _: processed.append("fin"),
+        worker_function=slow_for_early_batches,
+        workers=4,
+    )
+    basic_ack = node.channel.basic_ack
+    node.channel.basic_ack = lambda delivery_tag=0, multiple=False: (
+        acks.append(delivery_tag), basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+    )
+    start(node)
+    producer = Middleware(output_exchanges=[f"{queue_name}_ex"])
+    for i in range(1, 5):
+        producer.send_batch(f"p{i}", [[f"row{i}", 1]])
+    producer.send(Fin(4, 1).encode())
+
+    eventually(lambda: len(acks) == 5)
+    # El FIN espera a los lotes anteriores aunque no pase por el pool
+    assert processed == ["p1", "p2", "p3", "p4", "fin"]
+    assert acks == sorted(acks)
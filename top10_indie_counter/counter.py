@@ -1,7 +1,9 @@
 import json
 import logging
 from common.game import Game
+from common.batch_codec import decode_batch
 from common.middleware import Middleware
+from common.checkpoint import CHECKPOINT_INTERVAL
 from common.utils import split_complex_string
 from common.packet_fin import Fin
 from common.healthcheck import HealthCheckServer
@@ -15,6 +17,8 @@ class Top10IndieCounter:
         self.last_processed_packet = None
         self.last_packet_id = None
         self.last_client_id = None
+        # Con checkpoints el estado se guarda entero una vez por intervalo, no en cada lote
+        self.checkpointing = CHECKPOINT_INTERVAL > 0
         self._init_state()
         self.middleware = Middleware(
             input_queues=input_queues,
@@ -24,6 +28,11 @@ class Top10IndieCounter:
             callback=self._process_callback,
             eofCallback=self._eof_callback,
             faultManager=self.fault_manager,
+            # Nodo con estado: su salida no se combina aunque el contenedor tenga OUTPUT_BATCH_LINGER_MS
+            output_linger_ms=0,
+            snapshot=self._snapshot,
+            restore=self._restore,
+            cancelCallback=self._cancel_callback,
         )
         
     def _init_state(self):
@@ -116,21 +125,21 @@ class Top10IndieCounter:
         """
         Callback function to process messages.
         """
-        aux = data.strip().split("\n")
-        packet_id = aux[0]
+        batch = decode_batch(data)
+        packet_id = batch.packet_id
         logging.info(f"Received packet with ID: {packet_id}")
-        batch = aux[1:]
-        logging.info(f'Process batch: {batch}')
+        logging.info(f'Process batch: {len(batch)} rows')
         
         if packet_id == self.last_processed_packet:
             logging.info(f"Packet {packet_id} has already been processed, skipping...")
             return
         
         try:
-            for row in batch:
-                json_row = json.loads(row)
-                game = Game.decode(json_row)
+            for row in batch.rows():
+                game = Game.decode(row)
                 self.process_game(game, packet_id)
+            if self.checkpointing:
+                return
             serialized_dict = json.dumps(self.game_playtimes_by_client[self.last_client_id])
             value_to_store = f"{packet_id}\n{serialized_dict}"
             self.fault_manager.update(f'top10_indie_counter_{self.last_client_id}', value_to_store)
@@ -150,13 +159,34 @@ class Top10IndieCounter:
             fin_msg = Fin.decode(data)
             client_id = int(fin_msg.client_id)
             self.middleware.send(json.dumps(self.get_games(client_id)))
-            self.fault_manager.delete_key(f"top10_indie_counter_{client_id}")
+            if not self.checkpointing:
+                self.fault_manager.delete_key(f"top10_indie_counter_{client_id}")
             if client_id in self.game_playtimes_by_client:
                 del self.game_playtimes_by_client[client_id]
             logging.info(f"Top 10 indie games data sent and memory cleared for client {client_id}.")
         except Exception as e:
             logging.error(f"Error in _eof_callback: {e}")
 
+    def _cancel_callback(self, client_id):
+        """
+        El cliente se canceló: se descarta su top 10 parcial.
+        """
+        client_id = int(client_id)
+        self.game_playtimes_by_client.pop(client_id, None)
+        if not self.checkpointing:
+            self.fault_manager.discard(f"top10_indie_counter_{client_id}")
+
+    def _snapshot(self):
+        """
+        Estado del nodo para el checkpoint del Middleware.
+        """
+        return {"games": self.game_playtimes_by_client, "last_packet": self.last_processed_packet}
+
+    def _restore(self, state):
+        # json deja las claves como texto: los client_id vuelven a ser enteros
+        self.game_playtimes_by_client = {int(client_id): games for client_id, games in state["games"].items()}
+        self.last_processed_packet = state["last_packet"]
+
     def start(self):
         """
         Start middleware to begin consuming messages.